@@ -30,7 +30,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'helpdesk_app.middleware.AsyncWhiteNoiseMiddleware',
+    'helpdesk_app.middleware.RequestMetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -44,7 +45,7 @@ ROOT_URLCONF = 'helpdesk.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'helpdesk_app.metrics.InstrumentedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -107,6 +108,20 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# Attachment downloads: '' streams through Django, 'nginx' hands off with
+# X-Accel-Redirect (to an internal location mapped to MEDIA_ROOT at
+# ATTACHMENT_ACCEL_PREFIX), 'apache' hands off with X-Sendfile
+ATTACHMENT_SENDFILE_BACKEND = config('ATTACHMENT_SENDFILE_BACKEND', default='')
+ATTACHMENT_ACCEL_PREFIX = config('ATTACHMENT_ACCEL_PREFIX', default='/protected-media/')
+
+# Attachment thumbnails and excerpts (rendered by `python manage.py process_attachment_previews`)
+ATTACHMENT_PREVIEW_WORKERS = config('ATTACHMENT_PREVIEW_WORKERS', default=2, cast=int)  # processes decoding images
+ATTACHMENT_PREVIEW_BATCH_SIZE = config('ATTACHMENT_PREVIEW_BATCH_SIZE', default=20, cast=int)
+ATTACHMENT_PREVIEW_POLL_INTERVAL = config('ATTACHMENT_PREVIEW_POLL_INTERVAL', default=5, cast=int)  # seconds
+
+# Stored attachment files unused this long are deleted by `python manage.py collect_attachment_garbage`
+ATTACHMENT_GC_GRACE_HOURS = config('ATTACHMENT_GC_GRACE_HOURS', default=24, cast=float)
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -119,6 +134,25 @@ EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
 DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='noreply@example.com')
 ADMIN_EMAIL = config('ADMIN_EMAIL', default='admin@example.com')
+EMAIL_POOL_SIZE = config('EMAIL_POOL_SIZE', default=2, cast=int)  # idle SMTP connections kept per process
+EMAIL_POOL_MAX_IDLE = config('EMAIL_POOL_MAX_IDLE', default=60, cast=int)  # seconds before an idle connection is reopened
+
+# Email Outbox (drained by `python manage.py process_email_outbox`)
+EMAIL_OUTBOX_ENABLED = config('EMAIL_OUTBOX_ENABLED', default=True, cast=bool)
+EMAIL_OUTBOX_BATCH_SIZE = config('EMAIL_OUTBOX_BATCH_SIZE', default=50, cast=int)
+EMAIL_OUTBOX_MAX_ATTEMPTS = config('EMAIL_OUTBOX_MAX_ATTEMPTS', default=5, cast=int)
+EMAIL_OUTBOX_RETRY_DELAY = config('EMAIL_OUTBOX_RETRY_DELAY', default=60, cast=int)  # seconds, doubled per attempt
+EMAIL_OUTBOX_POLL_INTERVAL = config('EMAIL_OUTBOX_POLL_INTERVAL', default=5, cast=int)  # seconds
+
+# Inbound mail (read by `python manage.py ingest_mail`)
+INBOUND_IMAP_HOST = config('INBOUND_IMAP_HOST', default='')
+INBOUND_IMAP_PORT = config('INBOUND_IMAP_PORT', default=993, cast=int)
+INBOUND_IMAP_SSL = config('INBOUND_IMAP_SSL', default=True, cast=bool)
+INBOUND_IMAP_USER = config('INBOUND_IMAP_USER', default='')
+INBOUND_IMAP_PASSWORD = config('INBOUND_IMAP_PASSWORD', default='')
+INBOUND_IMAP_FOLDER = config('INBOUND_IMAP_FOLDER', default='INBOX')
+INBOUND_MAIL_BATCH_SIZE = config('INBOUND_MAIL_BATCH_SIZE', default=500, cast=int)  # emails stored per transaction
+INBOUND_MAIL_POLL_INTERVAL = config('INBOUND_MAIL_POLL_INTERVAL', default=30, cast=int)  # seconds, with --watch
 
 # CORS Settings
 CORS_ALLOWED_ORIGINS = config('CSRF_TRUSTED_ORIGINS', default='http://localhost:8000').split(',')
@@ -135,57 +169,116 @@ SESSION_COOKIE_HTTPONLY = True
 CSRF_COOKIE_HTTPONLY = True
 
 # Rate Limiting
-RATELIMIT_ENABLE = True
+RATELIMIT_ENABLE = config('RATELIMIT_ENABLE', default=True, cast=bool)
 RATELIMIT_USE_CACHE = 'default'
 
 # Cache Configuration
+# SQLiteCache is shared by every worker process on the host (rate limits,
+# message counters, settings version); set CACHE_BACKEND to
+# django.core.cache.backends.locmem.LocMemCache for a per-process cache.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+        'BACKEND': config('CACHE_BACKEND', default='helpdesk_app.cache_backends.SQLiteCache'),
+        'LOCATION': config('CACHE_LOCATION', default=str(BASE_DIR / 'cache.sqlite3')),
+        'KEY_PREFIX': config('CACHE_KEY_PREFIX', default=''),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=100000, cast=int),
+        },
     }
 }
 
-# Logging Configuration
+# Logging: JSON lines, written off the request thread by helpdesk_app.log.QueueListenerHandler
+LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+LOG_FILE = config('LOG_FILE', default='')  # path of a rotating log file; empty logs to the console only
+LOG_MAX_BYTES = config('LOG_MAX_BYTES', default=10 * 1024 * 1024, cast=int)  # rotate the file at this size
+LOG_BACKUP_COUNT = config('LOG_BACKUP_COUNT', default=5, cast=int)
+REQUEST_LOG_SAMPLE_RATE = config('REQUEST_LOG_SAMPLE_RATE', default=1.0, cast=float)  # share of requests logged
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
     'formatters': {
-        'verbose': {
-            'format': '{levelname} {asctime} {module} {message}',
-            'style': '{',
+        'json': {
+            '()': 'helpdesk_app.log.JSONFormatter',
         },
-        'simple': {
-            'format': '{levelname} {message}',
-            'style': '{',
+    },
+    'filters': {
+        'sample_requests': {
+            '()': 'helpdesk_app.log.SamplingFilter',
+            'rate': REQUEST_LOG_SAMPLE_RATE,
         },
     },
     'handlers': {
-        'file': {
-            'level': 'INFO',
-            'class': 'logging.FileHandler',
-            'filename': BASE_DIR / 'helpdesk.log',
-            'formatter': 'verbose',
-        },
         'console': {
-            'level': 'DEBUG',
             'class': 'logging.StreamHandler',
-            'formatter': 'simple',
+            'formatter': 'json',
+        },
+        # Handlers are set up in name order, so the ones it references exist by now
+        'queue': {
+            '()': 'helpdesk_app.log.QueueListenerHandler',
+            'handlers': ['cfg://handlers.console'] + (['cfg://handlers.file'] if LOG_FILE else []),
         },
     },
     'loggers': {
         'django': {
-            'handlers': ['file', 'console'],
+            'handlers': ['queue'],
             'level': 'INFO',
-            'propagate': True,
+            'propagate': False,
         },
         'helpdesk_app': {
-            'handlers': ['file', 'console'],
-            'level': 'DEBUG',
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
             'propagate': False,
         },
+        'helpdesk_app.requests': {
+            'filters': ['sample_requests'],
+        },
     },
 }
+if LOG_FILE:
+    LOGGING['handlers']['file'] = {
+        'class': 'logging.handlers.RotatingFileHandler',
+        'filename': LOG_FILE,
+        'maxBytes': LOG_MAX_BYTES,
+        'backupCount': LOG_BACKUP_COUNT,
+        'encoding': 'utf-8',
+        'delay': True,
+        'formatter': 'json',
+    }
+
+# manage.py test runs on a temporary cache file and keeps the log output quiet
+TEST_RUNNER = 'helpdesk_app.test_runner.HelpdeskTestRunner'
+
+# Seconds a worker trusts its in-memory SystemSettings before re-checking the shared version key
+SYSTEM_SETTINGS_CACHE_TTL = config('SYSTEM_SETTINGS_CACHE_TTL', default=5, cast=int)
+
+# Search backend: dotted path to a helpdesk_app.search backend class.
+# Empty picks MySQL FULLTEXT, SQLite FTS5 or the in-process index automatically.
+HELPDESK_SEARCH_BACKEND = config('HELPDESK_SEARCH_BACKEND', default='')
+
+# Inbox pagination: 'keyset' (cursor, constant cost per page) or 'offset' (numbered pages)
+INBOX_PAGINATION = config('INBOX_PAGINATION', default='keyset')
+
+# Identifies the deployed code. Cached public pages are keyed by it, so every deploy starts afresh;
+# Render and Railway provide the commit. When empty, template file changes count as a new release.
+RELEASE_VERSION = config('RELEASE_VERSION', default=config(
+    'RENDER_GIT_COMMIT', default=config('RAILWAY_GIT_COMMIT_SHA', default='')
+))
+PAGE_CACHE_TIMEOUT = config('PAGE_CACHE_TIMEOUT', default=86400, cast=int)  # seconds a rendered public page is kept
+
+# Seconds between each worker's checks for inbox changes to push to open inboxes
+LIVE_INBOX_POLL_INTERVAL = config('LIVE_INBOX_POLL_INTERVAL', default=1, cast=float)
+
+# A contact submission repeating one received this many seconds ago is merged into it (0 disables)
+DUPLICATE_WINDOW_SECONDS = config('DUPLICATE_WINDOW_SECONDS', default=600, cast=int)
+
+# Requests slower than this are logged with a breakdown of their database queries
+SLOW_REQUEST_THRESHOLD_MS = config('SLOW_REQUEST_THRESHOLD_MS', default=1000, cast=int)
+
+# Archival (manage.py archive_messages): replied messages idle this many days move to the archive tables
+ARCHIVE_AFTER_DAYS = config('ARCHIVE_AFTER_DAYS', default=365, cast=int)
+ARCHIVE_COMPRESS = config('ARCHIVE_COMPRESS', default=False, cast=bool)  # zlib-compress archived bodies
+ARCHIVE_BATCH_SIZE = config('ARCHIVE_BATCH_SIZE', default=500, cast=int)  # messages moved per transaction
 
 # Login URLs
 LOGIN_URL = '/login/'
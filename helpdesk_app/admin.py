@@ -1,35 +1,106 @@
 from django.contrib import admin
-from .models import Message, Reply, SystemSettings
+from django.utils import timezone
+from .models import ArchivedMessage, Message, Reply, StoredBlob, SystemSettings, OutgoingEmail
+from .pagination import ApproximateCountPaginator
+from .search import get_search_backend
 
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
-    list_display = ['sender_name', 'sender_email', 'subject', 'timestamp', 'status']
+    list_display = ['sender_name', 'sender_email', 'subject', 'timestamp', 'status', 'duplicate_count']
     list_filter = ['status', 'timestamp']
     search_fields = ['sender_name', 'sender_email', 'subject', 'message_body']
-    readonly_fields = ['timestamp']
+    readonly_fields = ['timestamp', 'duplicate_count', 'attachment_name', 'preview_status']
+    exclude = ['fingerprint']
     date_hierarchy = 'timestamp'
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
     
     fieldsets = (
         ('Sender Information', {
             'fields': ('sender_name', 'sender_email')
         }),
         ('Message Details', {
-            'fields': ('subject', 'message_body', 'attachment')
+            'fields': ('subject', 'message_body', 'attachment', 'attachment_name', 'preview_status')
         }),
         ('Status', {
             'fields': ('status', 'timestamp')
         }),
     )
+    
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        # The change list never shows the body; the change form still needs it
+        if request.resolver_match.url_name == 'helpdesk_app_message_changelist':
+            queryset = queryset.defer('message_body')
+        return queryset
+    
+    def get_search_results(self, request, queryset, search_term):
+        # Use the full-text index instead of icontains over the message body
+        if not search_term:
+            return queryset, False
+        return get_search_backend().filter(queryset, search_term), False
 
 
 @admin.register(Reply)
 class ReplyAdmin(admin.ModelAdmin):
-    list_display = ['message', 'admin', 'timestamp']
-    list_filter = ['timestamp']
+    list_display = ['message', 'admin', 'is_inbound', 'timestamp']
+    list_filter = ['is_inbound', 'timestamp']
     search_fields = ['message__subject', 'reply_body']
-    readonly_fields = ['timestamp']
+    readonly_fields = ['timestamp', 'attachment_name']
     date_hierarchy = 'timestamp'
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
+    # admin is nullable, so the default select_related() would skip it
+    list_select_related = ['message', 'admin']
+    
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if request.resolver_match.url_name == 'helpdesk_app_reply_changelist':
+            queryset = queryset.defer('message__message_body')
+        return queryset
+
+
+@admin.register(ArchivedMessage)
+class ArchivedMessageAdmin(admin.ModelAdmin):
+    list_display = ['sender_name', 'sender_email', 'subject', 'timestamp', 'archived_at']
+    list_filter = ['archived_at']
+    search_fields = ['sender_name', 'sender_email', 'subject']
+    exclude = ['body', 'body_compressed']
+    readonly_fields = ['message_body']
+    date_hierarchy = 'timestamp'
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
+    
+    # Archived threads are moved here by archive_messages and never edited
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return get_search_backend().filter(queryset, search_term), False
+
+
+@admin.register(StoredBlob)
+class StoredBlobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'size', 'ref_count', 'created_at', 'released_at']
+    search_fields = ['name']
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
+    
+    # Counted by the attachment storage; collect_attachment_garbage removes unused files
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(SystemSettings)
@@ -41,3 +112,19 @@ class SystemSettingsAdmin(admin.ModelAdmin):
     def has_delete_permission(self, request, obj=None):
         # Prevent deleting the settings
         return False
+
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ['to_email', 'subject', 'status', 'attempts', 'created_at', 'sent_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['to_email', 'subject']
+    readonly_fields = ['created_at', 'sent_at', 'attempts', 'last_error']
+    actions = ['requeue']
+    
+    @admin.action(description='Requeue selected emails')
+    def requeue(self, request, queryset):
+        updated = queryset.exclude(status='sent').update(
+            status='pending', attempts=0, next_attempt_at=timezone.now()
+        )
+        self.message_user(request, f"{updated} email(s) requeued.")
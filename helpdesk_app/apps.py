@@ -5,3 +5,6 @@ class HelpdeskAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'helpdesk_app'
     verbose_name = 'Helpdesk System'
+    
+    def ready(self):
+        from . import metrics, signals  # noqa: F401
@@ -0,0 +1,116 @@
+"""
+Hot/cold archival of old, resolved messages
+
+Replied messages with no activity for ARCHIVE_AFTER_DAYS are moved, with
+their replies, into the ArchivedMessage / ArchivedReply tables, keeping
+their ids. The hot tables and their indexes then only hold live work, while
+search and the detail view still find archived threads by the same id.
+
+Each batch is one transaction: the rows are copied and then deleted from
+the hot tables, so an interrupted run simply resumes with the next batch.
+"""
+from datetime import timedelta
+import zlib
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+
+def cutoff_for(days=None):
+    """Messages last active before this moment are due for archival"""
+    if days is None:
+        days = settings.ARCHIVE_AFTER_DAYS
+    return timezone.now() - timedelta(days=days)
+
+
+def archivable(cutoff):
+    """Hot messages due for archival"""
+    from .models import Message
+
+    return Message.objects.filter(status='replied', last_activity_at__lt=cutoff)
+
+
+def archive_batch(cutoff, batch_size=None, compress=None):
+    """
+    Move one batch of archivable messages and their replies to the archive
+
+    Args:
+        cutoff: Only messages last active before this are moved
+        batch_size: Messages per batch (default ARCHIVE_BATCH_SIZE)
+        compress: zlib-compress the bodies (default ARCHIVE_COMPRESS)
+
+    Returns:
+        Number of messages archived; 0 once nothing is left
+    """
+    from . import storage
+    from .models import ArchivedMessage, ArchivedReply, Message
+    from .search import get_search_backend
+
+    batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+    if compress is None:
+        compress = settings.ARCHIVE_COMPRESS
+
+    with transaction.atomic():
+        # Rows claimed by a concurrent run are left to it
+        messages = list(
+            archivable(cutoff).select_for_update(skip_locked=True)
+            .order_by('id').prefetch_related('replies')[:batch_size]
+        )
+        if not messages:
+            return 0
+
+        archived = ArchivedMessage.objects.bulk_create([
+            ArchivedMessage(
+                id=message.pk,
+                sender_name=message.sender_name,
+                sender_email=message.sender_email,
+                subject=message.subject,
+                timestamp=message.timestamp,
+                status=message.status,
+                attachment=message.attachment.name or None,
+                attachment_name=message.attachment_name,
+                preview_status=message.preview_status,
+                reply_count=message.reply_count,
+                last_reply_at=message.last_reply_at,
+                last_responder_id=message.last_responder_id,
+                last_activity_at=message.last_activity_at,
+                external_id=message.external_id,
+                **_body_fields(message.message_body, compress),
+            )
+            for message in messages
+        ])
+        ArchivedReply.objects.bulk_create([
+            ArchivedReply(
+                id=reply.pk,
+                message_id=message.pk,
+                admin_id=reply.admin_id,
+                timestamp=reply.timestamp,
+                is_inbound=reply.is_inbound,
+                attachment=reply.attachment.name or None,
+                attachment_name=reply.attachment_name,
+                external_id=reply.external_id,
+                **_body_fields(reply.reply_body, compress),
+            )
+            for message in messages
+            for reply in message.replies.all()
+        ])
+
+        # Signals unindex and uncount the hot rows, and release their attachments,
+        # which the copies now use instead
+        storage.retain(
+            [message.attachment.name for message in messages if message.attachment]
+            + [reply.attachment.name for message in messages for reply in message.replies.all() if reply.attachment]
+        )
+        Message.objects.filter(id__in=[message.pk for message in messages]).delete()
+
+        get_search_backend().index_messages(
+            ArchivedMessage.objects.filter(id__in=[copy.pk for copy in archived]).prefetch_related('replies')
+        )
+    return len(messages)
+
+
+def _body_fields(text, compress):
+    if compress:
+        return {'body': '', 'body_compressed': zlib.compress(text.encode('utf-8'))}
+    return {'body': text, 'body_compressed': None}
@@ -0,0 +1,173 @@
+"""
+Cache backend shared by all worker processes on one host
+
+LocMemCache gives every gunicorn worker its own private cache, so rate limits,
+counters and the settings version key are not shared. SQLiteCache keeps the
+entries in a single SQLite file in WAL mode instead: readers never block
+writers, every process on the host sees the same data, and no extra service
+is needed. Entries expire by TTL and the least recently used ones are evicted
+once MAX_ENTRIES is exceeded.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'helpdesk_app.cache_backends.SQLiteCache',
+            'LOCATION': '/var/tmp/helpdesk-cache.sqlite3',
+            'OPTIONS': {'MAX_ENTRIES': 100000, 'CULL_FREQUENCY': 3},
+        }
+    }
+"""
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+# Reads refresh the LRU timestamp at most this often per key, to keep reads mostly write-free
+ACCESS_RESOLUTION = 1.0
+
+# Writes between two eviction passes
+CULL_INTERVAL = 100
+
+
+class SQLiteCache(BaseCache):
+    """Process-shared cache stored in an SQLite database in WAL mode"""
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = str(location)
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        # Connections must not cross a fork (e.g. gunicorn --preload)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL, accessed REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        # Insert, or take over the key only if the existing entry has expired
+        cursor = self._connection().execute(
+            'INSERT INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET value = excluded.value, '
+            'expires = excluded.expires, accessed = excluded.accessed '
+            'WHERE cache.expires IS NOT NULL AND cache.expires <= ?',
+            (key, self._dumps(value), self.get_backend_timeout(timeout), now, now),
+        )
+        added = cursor.rowcount > 0
+        if added:
+            self._wrote()
+        return added
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        connection = self._connection()
+        now = time.time()
+        row = connection.execute(
+            'SELECT value, expires, accessed FROM cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return default
+        value, expires, accessed = row
+        if expires is not None and expires <= now:
+            connection.execute('DELETE FROM cache WHERE key = ? AND expires <= ?', (key, now))
+            return default
+        if now - accessed > ACCESS_RESOLUTION:
+            connection.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+        return pickle.loads(value)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._connection().execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+            (key, self._dumps(value), self.get_backend_timeout(timeout), time.time()),
+        )
+        self._wrote()
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        cursor = self._connection().execute(
+            'UPDATE cache SET expires = ?, accessed = ? '
+            'WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), now, key, now),
+        )
+        return cursor.rowcount > 0
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._connection().execute('DELETE FROM cache WHERE key = ?', (key,))
+        return cursor.rowcount > 0
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._connection().execute(
+            'SELECT 1 FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (key, time.time()),
+        ).fetchone()
+        return row is not None
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        connection = self._connection()
+        now = time.time()
+        # BEGIN IMMEDIATE takes the write lock up front, so the read-modify-write
+        # is atomic across processes
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                (key, now),
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            new_value = pickle.loads(row[0]) + delta
+            connection.execute(
+                'UPDATE cache SET value = ?, accessed = ? WHERE key = ?',
+                (self._dumps(new_value), now, key),
+            )
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return new_value
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache')
+
+    def _dumps(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def _wrote(self):
+        self._writes += 1
+        if self._writes % CULL_INTERVAL == 0:
+            self._cull()
+
+    def _cull(self):
+        """Drop expired entries, then the least recently used ones over MAX_ENTRIES"""
+        connection = self._connection()
+        connection.execute('DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?', (time.time(),))
+        (count,) = connection.execute('SELECT COUNT(*) FROM cache').fetchone()
+        if count > self._max_entries:
+            # CULL_FREQUENCY=0 empties the cache, like Django's own backends
+            if self._cull_frequency == 0:
+                excess = count
+            else:
+                excess = max(count - self._max_entries, count // self._cull_frequency)
+            connection.execute(
+                'DELETE FROM cache WHERE key IN '
+                '(SELECT key FROM cache ORDER BY accessed LIMIT ?)',
+                (excess,),
+            )
@@ -0,0 +1,113 @@
+"""
+Materialized message counters
+
+The inbox badges need the total number of messages and the number per
+status. Instead of COUNT(*) queries on every page view, MessageCounter rows
+are adjusted with atomic increments whenever a message is created, deleted
+or changes status, and the whole set is served from the cache.
+
+The cached set is stored under a version key that every commit replaces.
+A reader that loaded the counts before a commit but stores them after it
+writes to the old version, which no one reads any more, so the stale counts
+can't linger until the timeout.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F
+import uuid
+
+CACHE_KEY = 'helpdesk:message_counters'
+VERSION_CACHE_KEY = 'helpdesk:message_counters:version'
+CACHE_TIMEOUT = 300
+
+TOTAL = 'total'
+
+
+def status_counter(status):
+    return f'status:{status}'
+
+
+def counter_names():
+    from .models import Message
+    return [TOTAL] + [status_counter(status) for status, label in Message.STATUS_CHOICES]
+
+
+def get_counts():
+    """
+    Return the current counts as a dict with 'total' and one key per status
+    """
+    from .models import Message, MessageCounter
+
+    # The version is read before the counters, so counts read before a
+    # commit are stored under the version that commit replaced
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        cache.add(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_CACHE_KEY)
+    key = f'{CACHE_KEY}:{version}'
+
+    counts = cache.get(key)
+    if counts is None:
+        values = dict(MessageCounter.objects.values_list('name', 'value'))
+        counts = {'total': values.get(TOTAL, 0)}
+        for status, label in Message.STATUS_CHOICES:
+            counts[status] = values.get(status_counter(status), 0)
+        cache.set(key, counts, CACHE_TIMEOUT)
+    return counts
+
+
+def adjust(deltas):
+    """
+    Apply counter deltas, e.g. {'total': 1, 'status:new': 1}
+
+    Runs inside the caller's transaction; the cached copy is dropped once
+    the transaction commits.
+    """
+    from .models import MessageCounter
+
+    for name, delta in deltas.items():
+        if delta:
+            MessageCounter.objects.filter(name=name).update(value=F('value') + delta)
+    transaction.on_commit(invalidate)
+
+
+def status_changed(old_status, new_status, count=1):
+    """Move `count` messages from one status counter to another"""
+    if old_status != new_status and count:
+        adjust({status_counter(old_status): -count, status_counter(new_status): count})
+
+
+def invalidate():
+    """Move every process to a new version of the cached counts"""
+    cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+
+
+def reconcile():
+    """
+    Recompute every counter from the messages table
+
+    Returns:
+        Dict of counter name to the drift that was corrected
+    """
+    from .models import Message, MessageCounter
+
+    with transaction.atomic():
+        # Lock the counters so concurrent increments wait for the new values
+        stored = {
+            counter.name: counter
+            for counter in MessageCounter.objects.select_for_update()
+        }
+        actual = {name: 0 for name in counter_names()}
+        for row in Message.objects.values('status').annotate(count=Count('id')).order_by():
+            actual[status_counter(row['status'])] = row['count']
+            actual[TOTAL] += row['count']
+
+        drift = {}
+        for name, value in actual.items():
+            counter = stored.get(name) or MessageCounter(name=name)
+            if counter.pk is None or counter.value != value:
+                drift[name] = value - counter.value
+                counter.value = value
+                counter.save()
+        transaction.on_commit(invalidate)
+    return drift
@@ -0,0 +1,48 @@
+"""
+Async-capable counterparts of the view decorators used by the helpdesk
+
+Django 5.0's login_required and django-ratelimit's ratelimit wrap views in
+plain functions, which would turn an async view back into a sync one.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django_ratelimit import ALL
+from django_ratelimit.core import is_ratelimited
+from functools import wraps
+
+
+def async_login_required(view):
+    """login_required for async views; loads the user without blocking the event loop"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path(), settings.LOGIN_URL)
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def async_ratelimit(key=None, rate=None, method=ALL):
+    """
+    ratelimit(block=False) for async views
+
+    Sets request.limited like django-ratelimit, and shares its counters since
+    the group is derived from the same view function.
+    """
+    methods = None if method is ALL else ([method] if isinstance(method, str) else method)
+
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            # Other methods are never counted; skip the thread hop for them
+            if methods is not None and request.method not in methods:
+                request.limited = getattr(request, 'limited', False)
+                return await view(request, *args, **kwargs)
+            limited = await sync_to_async(is_ratelimited)(
+                request=request, fn=view, key=key, rate=rate, method=method, increment=True,
+            )
+            request.limited = limited or getattr(request, 'limited', False)
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,106 @@
+"""
+Duplicate suppression for contact-form submissions
+
+A double-clicked submit button or a retrying client posts the same message
+again within seconds. Each message stores a fingerprint of its sender,
+subject and body (models.message_fingerprint); a submission whose
+fingerprint matches a message received within DUPLICATE_WINDOW_SECONDS is
+counted on that message instead of becoming a new ticket and sending the
+notification emails again.
+
+Every worker remembers the fingerprints it saved recently, so the common
+case of a quick resubmission to the same worker skips the lookup; others
+are found through the indexed fingerprint column.
+"""
+from collections import OrderedDict
+from datetime import timedelta
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import F
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+from django.utils import timezone
+
+from . import live
+from .models import Message
+
+# Fingerprints remembered per process; older ones are left to the database lookup
+RECENT_MAX = 10000
+
+_recent = OrderedDict()  # fingerprint -> (message id, time.monotonic() it stops counting)
+_lock = threading.Lock()
+
+
+def merge_duplicate(fingerprint):
+    """
+    Count a submission against a recent message with the same fingerprint
+
+    Returns:
+        The id of the message it was merged into, or None if it is new
+    """
+    window = settings.DUPLICATE_WINDOW_SECONDS
+    if window <= 0 or not fingerprint:
+        return None
+
+    message_id = _recent_message_id(fingerprint)
+    if message_id is not None and _count_duplicate(message_id):
+        return message_id
+
+    message_id = (
+        Message.objects
+        .filter(fingerprint=fingerprint, timestamp__gte=timezone.now() - timedelta(seconds=window))
+        .order_by('-timestamp')
+        .values_list('id', flat=True)
+        .first()
+    )
+    if message_id is not None and _count_duplicate(message_id):
+        return message_id
+    return None
+
+
+def remember(message):
+    """Note a newly saved message for the in-memory check"""
+    window = settings.DUPLICATE_WINDOW_SECONDS
+    if window <= 0 or not message.fingerprint:
+        return
+    with _lock:
+        _recent[message.fingerprint] = (message.pk, time.monotonic() + window)
+        _recent.move_to_end(message.fingerprint)
+        while len(_recent) > RECENT_MAX:
+            _recent.popitem(last=False)
+
+
+def clear():
+    """Forget the fingerprints remembered by this process"""
+    with _lock:
+        _recent.clear()
+
+
+def _recent_message_id(fingerprint):
+    with _lock:
+        entry = _recent.get(fingerprint)
+        if entry is None:
+            return None
+        message_id, expires = entry
+        if expires < time.monotonic():
+            del _recent[fingerprint]
+            return None
+        return message_id
+
+
+def _count_duplicate(message_id):
+    # Nothing is updated if the message has been deleted or archived meanwhile
+    counted = Message.objects.filter(pk=message_id).update(
+        duplicate_count=F('duplicate_count') + 1, updated_at=timezone.now(),
+    )
+    if counted:
+        live.notify()
+    return counted > 0
+
+
+@receiver(setting_changed)
+def _reset_recent(setting, **kwargs):
+    if setting == 'DUPLICATE_WINDOW_SECONDS':
+        clear()
@@ -0,0 +1,157 @@
+"""
+Streaming file responses with HTTP Range and conditional request support
+
+Files are read in fixed-size chunks, so a large attachment never sits in
+worker memory; under ASGI the chunks are handed over as an async iterator,
+since Django would read a sync one to the end first. When ATTACHMENT_SENDFILE_BACKEND is set, Django only checks
+permissions and the front proxy transfers the bytes (X-Accel-Redirect for
+nginx, X-Sendfile for Apache/lighttpd).
+"""
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+from urllib.parse import quote
+import mimetypes
+import os
+import re
+
+from .exports import aiter_stream
+
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Safe to show in the browser; everything else is downloaded
+INLINE_CONTENT_TYPES = {'application/pdf', 'image/jpeg', 'image/png', 'text/plain'}
+
+
+def file_iterator(file, start, length, chunk_size=CHUNK_SIZE):
+    """Yield `length` bytes of `file` from offset `start`, then close it"""
+    try:
+        file.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range Range header
+
+    Returns:
+        (start, end) inclusive byte positions, None to ignore the header
+        (unsupported syntax, e.g. multiple ranges), or False when the range
+        cannot be satisfied
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def serve_file(request, storage, name, filename=None):
+    """
+    Serve a stored file with ETag/Last-Modified, Range and optional proxy offload
+
+    Args:
+        request: The current request (GET or HEAD)
+        storage: Django storage holding the file
+        name: Name of the file in that storage
+        filename: Name offered to the browser, defaults to the stored basename
+    """
+    filename = filename or os.path.basename(name)
+    try:
+        size = storage.size(name)
+        modified = storage.get_modified_time(name)
+    except (OSError, NotImplementedError):
+        raise Http404('Attachment not found')
+
+    last_modified = int(modified.timestamp())
+    etag = f'"{size:x}-{last_modified:x}"'
+
+    # 304 Not Modified / 412 Precondition Failed
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response
+
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    backend = settings.ATTACHMENT_SENDFILE_BACKEND
+
+    if backend:
+        # The proxy serves the bytes (and handles Range itself)
+        response = HttpResponse(content_type=content_type)
+        if backend == 'nginx':
+            response['X-Accel-Redirect'] = settings.ATTACHMENT_ACCEL_PREFIX + quote(name)
+        else:
+            response['X-Sendfile'] = storage.path(name)
+    else:
+        start, end, status = 0, size - 1, 200
+        byte_range = None
+        if 'HTTP_RANGE' in request.META and _if_range_matches(request, etag, last_modified):
+            byte_range = parse_range(request.META['HTTP_RANGE'], size)
+
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        if byte_range:
+            start, end = byte_range
+            status = 206
+
+        length = end - start + 1 if size else 0
+        if request.method == 'HEAD':
+            response = HttpResponse(content_type=content_type, status=status)
+        else:
+            chunks = file_iterator(storage.open(name, 'rb'), start, length)
+            if isinstance(request, ASGIRequest):
+                chunks = aiter_stream(chunks)
+            response = StreamingHttpResponse(
+                chunks,
+                content_type=content_type,
+                status=status,
+            )
+        response['Content-Length'] = str(length)
+        if status == 206:
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'private, max-age=0, must-revalidate'
+    response['Content-Disposition'] = content_disposition_header(
+        content_type not in INLINE_CONTENT_TYPES, filename
+    )
+    return response
+
+
+def _if_range_matches(request, etag, last_modified):
+    """A Range only applies if If-Range (when sent) still matches the file"""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
@@ -1,17 +1,109 @@
-from django.core.mail import EmailMessage
+from asgiref.sync import sync_to_async
+from django.core.mail import EmailMessage, get_connection
 from django.conf import settings
+from django.db import transaction
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+from django.utils import timezone
+from . import metrics
+from .mailparse import ticket_tag
+from contextlib import contextmanager
+from datetime import timedelta
 import logging
+import smtplib
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+# How long a claimed outbox row stays invisible to other workers
+OUTBOX_LEASE_SECONDS = 300
+
+# Upper bound for the exponential retry backoff
+OUTBOX_MAX_RETRY_DELAY = 3600
+
+# Errors after which a pooled connection is dropped and the send retried once
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+class SMTPConnectionPool:
+    """
+    Per-process pool of open, authenticated mail backend connections
+    
+    Connections are handed out one at a time and returned after use, so a
+    batch of messages pays for a single connect/TLS/login handshake. Idle
+    connections older than EMAIL_POOL_MAX_IDLE seconds are closed instead of
+    reused, since SMTP servers drop quiet clients.
+    """
+    
+    def __init__(self):
+        self._idle = []
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """Return an open connection, reusing an idle one when possible"""
+        with self._lock:
+            while self._idle:
+                connection, last_used = self._idle.pop()
+                if time.monotonic() - last_used < settings.EMAIL_POOL_MAX_IDLE:
+                    return connection
+                self._close(connection)
+        
+        connection = get_connection(fail_silently=False)
+        connection.open()
+        return connection
+    
+    def release(self, connection, broken=False):
+        """Give a connection back to the pool, closing it if broken or surplus"""
+        if not broken:
+            with self._lock:
+                if len(self._idle) < settings.EMAIL_POOL_SIZE:
+                    self._idle.append((connection, time.monotonic()))
+                    return
+        self._close(connection)
+    
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        except BaseException:
+            self.release(connection, broken=True)
+            raise
+        else:
+            self.release(connection)
+    
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, last_used in idle:
+            self._close(connection)
+    
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except Exception as e:
+            logger.warning("Error closing mail connection: %s", e)
+
+
+connection_pool = SMTPConnectionPool()
+
+
+@receiver(setting_changed)
+def _reset_connection_pool(setting, **kwargs):
+    # Pooled connections were opened with the old EMAIL_* settings
+    if setting.startswith('EMAIL_'):
+        connection_pool.close_all()
+
 
 class EmailService:
-    """Service for sending emails via SMTP"""
+    """Service for sending emails via SMTP, directly or through the outbox"""
     
     @staticmethod
     def send_email(to_email, subject, html_content, attachment_path=None):
         """
-        Send email using Django's SMTP backend
+        Send email, or queue it in the outbox when EMAIL_OUTBOX_ENABLED is set
         
         Args:
             to_email: Recipient email address
@@ -21,38 +113,244 @@ class EmailService:
         
         Returns:
             Boolean indicating success
+        
+        Raises:
+            DatabaseError: Queueing in the outbox failed
         """
+        if settings.EMAIL_OUTBOX_ENABLED:
+            # A failed insert must roll back the caller's transaction rather
+            # than commit its changes without the email
+            try:
+                EmailService.queue_email(to_email, subject, html_content, attachment_path)
+            except Exception as e:
+                logger.error("Error queueing email to %s: %s", to_email, e)
+                raise
+            logger.info("Email to %s queued", to_email)
+            return True
+        
         try:
-            email = EmailMessage(
-                subject=subject,
-                body=html_content,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                to=[to_email],
-            )
-            email.content_subtype = 'html'  # Send as HTML
-            
-            # Add attachment if provided
-            if attachment_path:
-                email.attach_file(attachment_path)
-            
-            email.send()
-            
-            logger.info(f"Email sent to {to_email}")
+            EmailService.deliver(to_email, subject, html_content, attachment_path)
+            logger.info("Email sent to %s", to_email)
             return True
             
         except Exception as e:
-            logger.error(f"Error sending email to {to_email}: {str(e)}")
+            logger.error("Error sending email to %s: %s", to_email, e)
             return False
     
+    @staticmethod
+    def deliver(to_email, subject, html_content, attachment_path=None):
+        """Send email immediately over a pooled connection, raising on failure"""
+        error = EmailService.send_many([(to_email, subject, html_content, attachment_path)])[0]
+        if error is not None:
+            raise error
+    
+    @staticmethod
+    def send_many(emails):
+        """
+        Send many emails through one pooled connection
+        
+        Args:
+            emails: Iterable of (to_email, subject, html_content, attachment_path)
+                tuples; attachment_path may be omitted
+        
+        Returns:
+            List with None for each delivered email and the raised exception
+            for each failed one, in input order
+        """
+        results = []
+        connection = None
+        try:
+            with metrics.timing_email():
+                for email_args in emails:
+                    try:
+                        email = EmailService._build_message(*email_args)
+                        if connection is None:
+                            connection = connection_pool.acquire()
+                        try:
+                            connection.send_messages([email])
+                        except RECONNECT_ERRORS as e:
+                            # The server dropped us; reconnect and retry this email once
+                            logger.warning("Mail connection lost, reconnecting: %s", e)
+                            connection_pool.release(connection, broken=True)
+                            connection = None
+                            connection = connection_pool.acquire()
+                            connection.send_messages([email])
+                    except Exception as e:
+                        results.append(e)
+                    else:
+                        results.append(None)
+        except BaseException:
+            if connection is not None:
+                connection_pool.release(connection, broken=True)
+            raise
+        if connection is not None:
+            connection_pool.release(connection)
+        
+        return results
+    
+    @staticmethod
+    def _build_message(to_email, subject, html_content, attachment_path=None):
+        email = EmailMessage(
+            subject=subject,
+            body=html_content,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[to_email],
+        )
+        email.content_subtype = 'html'  # Send as HTML
+        
+        # Add attachment if provided
+        if attachment_path:
+            email.attach_file(attachment_path)
+        
+        return email
+    
+    @staticmethod
+    def queue_email(to_email, subject, html_content, attachment_path=None):
+        """Store email in the outbox for the background worker, raising on failure"""
+        from .models import OutgoingEmail
+        
+        return OutgoingEmail.objects.create(
+            to_email=to_email,
+            subject=subject,
+            html_content=html_content,
+            attachment_path=attachment_path or '',
+        )
+    
+    @staticmethod
+    def send_batch(emails):
+        """
+        Send or queue many emails at once
+        
+        With the outbox enabled the whole batch is stored with a single
+        INSERT; otherwise it goes out over one pooled connection.
+        
+        Args:
+            emails: List of (to_email, subject, html_content[, attachment_path]) tuples
+        
+        Returns:
+            Number of emails sent or queued
+        
+        Raises:
+            DatabaseError: Queueing in the outbox failed; like send_email, the
+                error reaches the caller so its transaction rolls back
+        """
+        from .models import OutgoingEmail
+        
+        if not emails:
+            return 0
+        
+        if settings.EMAIL_OUTBOX_ENABLED:
+            try:
+                OutgoingEmail.objects.bulk_create([
+                    OutgoingEmail(
+                        to_email=email[0],
+                        subject=email[1],
+                        html_content=email[2],
+                        attachment_path=(email[3] if len(email) > 3 else None) or '',
+                    )
+                    for email in emails
+                ])
+            except Exception as e:
+                logger.error("Error queueing %d emails: %s", len(emails), e)
+                raise
+            logger.info("%d emails queued", len(emails))
+            return len(emails)
+        
+        errors = EmailService.send_many(emails)
+        for email, error in zip(emails, errors):
+            if error is not None:
+                logger.error("Error sending email to %s: %s", email[0], error)
+        return errors.count(None)
+    
+    @staticmethod
+    def process_outbox(batch_size=None):
+        """
+        Deliver one batch of due emails from the outbox
+        
+        Failed sends are retried with exponential backoff and moved to the
+        dead-letter state after EMAIL_OUTBOX_MAX_ATTEMPTS attempts.
+        
+        Returns:
+            Dict with the number of sent, retried and dead emails
+        """
+        from .models import OutgoingEmail
+        
+        batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+        now = timezone.now()
+        
+        # Claim a batch; the lease keeps other workers off these rows while we send
+        with transaction.atomic():
+            batch = list(
+                OutgoingEmail.objects.select_for_update(skip_locked=True)
+                .filter(status='pending', next_attempt_at__lte=now)
+                .order_by('next_attempt_at')[:batch_size]
+            )
+            OutgoingEmail.objects.filter(pk__in=[email.pk for email in batch]).update(
+                next_attempt_at=now + timedelta(seconds=OUTBOX_LEASE_SECONDS)
+            )
+        
+        errors = EmailService.send_many(
+            (email.to_email, email.subject, email.html_content, email.attachment_path)
+            for email in batch
+        )
+        
+        result = {'sent': 0, 'retried': 0, 'dead': 0}
+        for email, error in zip(batch, errors):
+            email.attempts += 1
+            if error is not None:
+                email.last_error = str(error)
+                if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+                    email.status = 'dead'
+                    result['dead'] += 1
+                    logger.error("Email %s to %s dead-lettered: %s", email.pk, email.to_email, error)
+                else:
+                    delay = settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (email.attempts - 1)
+                    email.next_attempt_at = timezone.now() + timedelta(
+                        seconds=min(delay, OUTBOX_MAX_RETRY_DELAY)
+                    )
+                    result['retried'] += 1
+                    logger.warning("Email %s to %s failed, retrying: %s", email.pk, email.to_email, error)
+            else:
+                email.status = 'sent'
+                email.sent_at = timezone.now()
+                email.last_error = ''
+                result['sent'] += 1
+                logger.info("Email sent to %s", email.to_email)
+            
+            email.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt_at', 'sent_at'])
+        
+        return result
+    
+    @staticmethod
+    async def asend_batch(emails):
+        """
+        Async send_batch
+        
+        Queuing writes to the database, so it runs on Django's thread for sync
+        code. Direct SMTP delivery runs in a separate worker thread, so waiting
+        on the mail server holds up neither the event loop nor other queries.
+        """
+        return await sync_to_async(
+            EmailService.send_batch, thread_sensitive=settings.EMAIL_OUTBOX_ENABLED
+        )(emails)
+    
     @staticmethod
     def send_auto_response(customer_email, customer_name):
         """Send automatic confirmation email to customer"""
+        email = EmailService.compose_auto_response(customer_email, customer_name)
+        if email is None:
+            return False
+        return EmailService.send_email(*email)
+    
+    @staticmethod
+    def compose_auto_response(customer_email, customer_name):
+        """Build the auto-response email, or None when auto-responses are disabled"""
         from .models import SystemSettings
         
         settings_obj = SystemSettings.load()
         
         if not settings_obj.auto_response_enabled:
-            return False
+            return None
         
         subject = "Message Received - We'll Be In Touch Soon"
         html_content = f"""
@@ -71,17 +369,25 @@ class EmailService:
         </html>
         """
         
-        return EmailService.send_email(customer_email, subject, html_content)
+        return customer_email, subject, html_content
     
     @staticmethod
     def send_admin_notification(message_obj):
         """Notify admin of new message"""
+        email = EmailService.compose_admin_notification(message_obj)
+        if email is None:
+            return False
+        return EmailService.send_email(*email)
+    
+    @staticmethod
+    def compose_admin_notification(message_obj):
+        """Build the new-message notification, or None when notifications are disabled"""
         from .models import SystemSettings
         
         settings_obj = SystemSettings.load()
         
         if not settings_obj.admin_notification_enabled:
-            return False
+            return None
         
         subject = f"New Message: {message_obj.subject}"
         html_content = f"""
@@ -122,12 +428,18 @@ class EmailService:
         </html>
         """
         
-        return EmailService.send_email(settings.ADMIN_EMAIL, subject, html_content)
+        return settings.ADMIN_EMAIL, subject, html_content
     
     @staticmethod
     def send_reply_to_customer(message_obj, reply_obj):
         """Send admin's reply to customer"""
-        subject = f"Re: {message_obj.subject}"
+        return EmailService.send_email(*EmailService.compose_reply(message_obj, reply_obj))
+    
+    @staticmethod
+    def compose_reply(message_obj, reply_obj):
+        """Build the (to_email, subject, html_content) of a reply email"""
+        # The ticket tag threads the customer's answer back onto this message
+        subject = f"Re: {message_obj.subject} {ticket_tag(message_obj.pk)}"
         html_content = f"""
         <html>
             <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
@@ -146,4 +458,4 @@ class EmailService:
         </html>
         """
         
-        return EmailService.send_email(message_obj.sender_email, subject, html_content)
+        return message_obj.sender_email, subject, html_content
@@ -0,0 +1,150 @@
+"""
+Streaming CSV / JSON Lines export of messages and their replies
+
+Messages are read in keyset-paginated chunks with their replies prefetched
+per chunk, and the output is produced chunk by chunk (optionally gzipped on
+the fly), so memory use stays flat however large the export is. Keyset
+chunks are used rather than QuerySet.iterator() because MySQL drivers buffer
+the whole result set client-side.
+"""
+from asgiref.sync import sync_to_async
+from django.db.models import Prefetch, Q, prefetch_related_objects
+from io import StringIO
+import csv
+import json
+import zlib
+
+# Messages fetched per query
+EXPORT_CHUNK_SIZE = 1000
+
+# Output is handed out in pieces of roughly this many bytes
+OUTPUT_BUFFER_SIZE = 64 * 1024
+
+CSV_HEADER = [
+    'type', 'message_id', 'reply_id', 'timestamp', 'status', 'sender_name', 'sender_email',
+    'subject', 'author', 'body', 'attachment',
+]
+
+CONTENT_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+def iter_messages(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield messages newest first, with replies prefetched one chunk at a time"""
+    from .models import Reply
+
+    replies = Prefetch('replies', queryset=Reply.objects.select_related('admin').order_by('timestamp', 'id'))
+    queryset = queryset.order_by('-timestamp', '-id')
+    last = None
+    while True:
+        chunk = queryset
+        if last is not None:
+            # Seek past the previous chunk on the (timestamp, id) index
+            chunk = chunk.filter(Q(timestamp__lt=last.timestamp) | Q(timestamp=last.timestamp, id__lt=last.pk))
+        rows = list(chunk[:chunk_size])
+        prefetch_related_objects(rows, replies)
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1]
+
+
+def csv_lines(messages):
+    """One row per message, followed by one row per reply"""
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+
+    def line(row):
+        writer.writerow(row)
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    yield line(CSV_HEADER)
+    for message in messages:
+        yield line([
+            'message', message.pk, '', message.timestamp.isoformat(), message.status,
+            message.sender_name, message.sender_email, message.subject, '',
+            message.message_body, message.attachment.name or '',
+        ])
+        for reply in message.replies.all():
+            yield line([
+                'reply', message.pk, reply.pk, reply.timestamp.isoformat(), '', '', '', '',
+                reply.admin.username if reply.admin else '', reply.reply_body, '',
+            ])
+
+
+def jsonl_lines(messages):
+    """One JSON object per message, replies nested"""
+    for message in messages:
+        yield json.dumps({
+            'id': message.pk,
+            'timestamp': message.timestamp.isoformat(),
+            'status': message.status,
+            'sender_name': message.sender_name,
+            'sender_email': message.sender_email,
+            'subject': message.subject,
+            'body': message.message_body,
+            'attachment': message.attachment.name or None,
+            'replies': [
+                {
+                    'id': reply.pk,
+                    'timestamp': reply.timestamp.isoformat(),
+                    'author': reply.admin.username if reply.admin else None,
+                    'body': reply.reply_body,
+                }
+                for reply in message.replies.all()
+            ],
+        }, ensure_ascii=False) + '\n'
+
+
+def export_stream(queryset, output_format='csv', compress=False):
+    """
+    Encoded export of a Message queryset, as an iterator of byte chunks
+
+    Args:
+        queryset: Messages to export, e.g. from search.filter_messages()
+        output_format: 'csv' or 'jsonl'
+        compress: gzip the output on the fly
+    """
+    lines = (csv_lines if output_format == 'csv' else jsonl_lines)(iter_messages(queryset))
+    chunks = _buffered(line.encode() for line in lines)
+    return _gzip(chunks) if compress else chunks
+
+
+async def aiter_stream(chunks):
+    """
+    Serve a sync stream (an export, a file) to an async (ASGI) response
+
+    Django would otherwise read a sync iterator to the end before sending
+    anything. Every chunk is produced on the request's sync thread, which
+    owns the database connection.
+    """
+    iterator = iter(chunks)
+    get_next = sync_to_async(next)
+    while True:
+        chunk = await get_next(iterator, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def _buffered(chunks):
+    pending, size = [], 0
+    for chunk in chunks:
+        pending.append(chunk)
+        size += len(chunk)
+        if size >= OUTPUT_BUFFER_SIZE:
+            yield b''.join(pending)
+            pending, size = [], 0
+    if pending:
+        yield b''.join(pending)
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)  # gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,329 @@
+"""
+Inbound email ingestion
+
+Customer emails, new questions and answers to helpdesk replies alike, are
+read from a mailbox (a maildir, an mbox file or an IMAP folder) and stored
+in batches: a batch costs a handful of queries and one bulk INSERT per
+table, whatever its size. Mail is read and parsed one message at a time, so
+memory use depends on the batch size, not the mailbox.
+
+An email joins an existing ticket when it
+  - references (In-Reply-To / References) a ticket or reply stored earlier,
+  - carries the ticket tag of a helpdesk reply ("[#123]") and comes from
+    the ticket's sender, or
+  - is a "Re:" from the ticket's sender with the ticket's subject.
+It is then stored as an inbound Reply and the ticket is back to 'new'.
+Anything else opens a ticket. Mail already stored (by Message-ID) is
+skipped, so reading a source again is safe.
+"""
+import imaplib
+import logging
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from . import counters, live, mailparse, previews, threads
+from .models import Message, Reply, message_fingerprint, message_preview
+from .search import get_search_backend
+from .storage import attachment_storage
+
+logger = logging.getLogger(__name__)
+
+# Larger attachments are dropped, as the contact form refuses them
+MAX_ATTACHMENT_SIZE = 5 * 1024 * 1024
+
+# Message-IDs longer than the external_id column are cut to fit
+EXTERNAL_ID_LENGTH = Message._meta.get_field('external_id').max_length
+
+
+class MailSource:
+    """
+    A mailbox to ingest from
+
+    Iterating yields (key, raw message bytes) for each message waiting;
+    done() is called with the keys of each batch once it is stored.
+    """
+
+    def __iter__(self):
+        raise NotImplementedError
+
+    def done(self, keys):
+        """Mark messages as ingested, so the next read skips them"""
+
+    def close(self):
+        pass
+
+
+class MaildirSource(MailSource):
+    """New mail of a local maildir; ingested mail moves to cur/ flagged Seen"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        return mailparse.iter_maildir_new(self.path)
+
+    def done(self, keys):
+        for path in keys:
+            mailparse.mark_maildir_seen(path)
+
+
+class MboxSource(MailSource):
+    """Every message of an mbox file, which is left unchanged"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        return enumerate(mailparse.iter_mbox(self.path))
+
+
+class IMAPSource(MailSource):
+    """
+    Unseen mail of an IMAP folder; ingested mail is flagged Seen
+
+    Messages are fetched `fetch_size` at a time, without setting the Seen
+    flag, so a batch that fails to store is read again next time.
+    """
+
+    def __init__(self, host, user, password, folder='INBOX', port=993, use_ssl=True, fetch_size=100):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.folder = folder
+        self.port = port
+        self.use_ssl = use_ssl
+        self.fetch_size = fetch_size
+        self.connection = None
+
+    def __iter__(self):
+        if self.connection is None:
+            connection_class = imaplib.IMAP4_SSL if self.use_ssl else imaplib.IMAP4
+            self.connection = connection_class(self.host, self.port)
+            self.connection.login(self.user, self.password)
+        self.connection.select(self.folder)
+        status, data = self.connection.uid('SEARCH', None, 'UNSEEN')
+        uids = data[0].split() if status == 'OK' and data and data[0] else []
+        for start in range(0, len(uids), self.fetch_size):
+            status, data = self.connection.uid('FETCH', b','.join(uids[start:start + self.fetch_size]), '(BODY.PEEK[])')
+            for item in data if status == 'OK' else []:
+                # Responses are (b'<seq> (UID <uid> BODY[] {<size>}', raw) pairs between b')' lines
+                if isinstance(item, tuple):
+                    match = re.search(rb'UID (\d+)', item[0])
+                    if match:
+                        yield match.group(1), item[1]
+
+    def done(self, keys):
+        if keys:
+            self.connection.uid('STORE', b','.join(keys), '+FLAGS', r'(\Seen)')
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.logout()
+            except (imaplib.IMAP4.error, OSError):
+                pass
+            self.connection = None
+
+
+def ingest(source, batch_size=None):
+    """
+    Store everything waiting in a mail source, one batch at a time
+
+    Returns:
+        Dict with the number of 'messages' (new tickets), 'replies' (answers
+        threaded onto tickets), 'skipped' (stored before) and 'ignored'
+        (without a sender, or sent by the helpdesk itself) emails
+    """
+    batch_size = batch_size or settings.INBOUND_MAIL_BATCH_SIZE
+    totals = {'messages': 0, 'replies': 0, 'skipped': 0, 'ignored': 0}
+    keys, emails = [], []
+    for key, raw in source:
+        keys.append(key)
+        emails.append(mailparse.parse_message(raw))
+        if len(emails) >= batch_size:
+            _add(totals, ingest_emails(emails))
+            source.done(keys)
+            keys, emails = [], []
+    if emails:
+        _add(totals, ingest_emails(emails))
+        source.done(keys)
+    return totals
+
+
+def ingest_emails(emails):
+    """
+    Store one batch of emails parsed by mailparse.parse_message
+
+    Returns:
+        Dict of counts, as ingest()
+    """
+    stats = {'messages': 0, 'replies': 0, 'skipped': 0, 'ignored': 0}
+    own_addresses = {settings.DEFAULT_FROM_EMAIL.lower(), settings.ADMIN_EMAIL.lower()}
+    accepted = []
+    for email in emails:
+        # Our own mail coming back (bounces, autoreplies to it) would loop
+        if not email['sender_email'] or email['sender_email'] in own_addresses:
+            stats['ignored'] += 1
+        else:
+            email['message_id'] = email['message_id'][:EXTERNAL_ID_LENGTH]
+            accepted.append(email)
+
+    # Oldest first, so a thread started and answered within the batch links up
+    fresh = _unstored(sorted(accepted, key=lambda email: email['timestamp']))
+    stats['skipped'] = len(accepted) - len(fresh)
+    if not fresh:
+        return stats
+
+    existing = _existing_tickets(fresh)
+    new_tickets = []
+    answers = []  # (email, ticket id, or the Message-ID of a ticket opened in this batch)
+    thread_of = {}  # Message-ID of each email in the batch -> the ticket it went to
+    for email in fresh:
+        ticket = existing.get(email['message_id'])
+        if ticket is None:
+            ticket = next((thread_of[ref] for ref in email['references'] if ref in thread_of), None)
+        if ticket is None:
+            ticket = email['message_id']
+            new_tickets.append(email)
+        else:
+            answers.append((email, ticket))
+        thread_of[email['message_id']] = ticket
+
+    # Files are written before the transaction, which then stays short
+    attachments = {email['message_id']: _store_attachment(email['attachments']) for email in fresh}
+
+    with transaction.atomic():
+        Message.objects.bulk_create([
+            Message(
+                external_id=email['message_id'],
+                sender_name=email['sender_name'][:200],
+                sender_email=email['sender_email'],
+                subject=email['subject'][:300],
+                message_body=email['body'],
+                body_preview=message_preview(email['body']),
+                fingerprint=message_fingerprint(email['sender_email'], email['subject'], email['body']),
+                timestamp=email['timestamp'],
+                last_activity_at=email['timestamp'],
+                attachment=attachments[email['message_id']][0],
+                attachment_name=attachments[email['message_id']][1],
+                preview_status=previews.initial_status(attachments[email['message_id']][0]),
+            )
+            for email in new_tickets
+        ], ignore_conflicts=True)
+        # bulk_create does not return ids on every backend
+        opened = dict(
+            Message.objects.filter(external_id__in=[email['message_id'] for email in new_tickets])
+            .values_list('external_id', 'id')
+        )
+
+        replies = [
+            Reply(
+                external_id=email['message_id'],
+                message_id=opened[ticket] if isinstance(ticket, str) else ticket,
+                is_inbound=True,
+                reply_body=email['body'],
+                timestamp=email['timestamp'],
+                attachment=attachments[email['message_id']][0],
+                attachment_name=attachments[email['message_id']][1],
+            )
+            for email, ticket in answers
+        ]
+        Reply.objects.bulk_create(replies, ignore_conflicts=True)
+
+        # bulk_create skips the signals that maintain the counters, thread summaries and index
+        counters.adjust({counters.TOTAL: len(opened), counters.status_counter('new'): len(opened)})
+        answered = Message.objects.filter(id__in={reply.message_id for reply in replies})
+        threads.refresh(answered)
+        # The customer is waiting for the helpdesk again
+        counters.status_changed(
+            'replied', 'new', answered.filter(status='replied').update(status='new', updated_at=timezone.now()),
+        )
+        live.notify()
+        get_search_backend().index_messages(
+            Message.objects.filter(id__in={*opened.values(), *(reply.message_id for reply in replies)})
+            .prefetch_related('replies')
+        )
+
+    stats['messages'] = len(new_tickets)
+    stats['replies'] = len(replies)
+    logger.info(
+        "Ingested %d emails: %d new tickets, %d replies",
+        len(fresh), stats['messages'], stats['replies'],
+    )
+    return stats
+
+
+def _unstored(emails):
+    """Drop emails stored by an earlier run, or repeated within the batch"""
+    ids = {email['message_id'] for email in emails}
+    seen = set(Message.objects.filter(external_id__in=ids).values_list('external_id', flat=True))
+    seen.update(Reply.objects.filter(external_id__in=ids).values_list('external_id', flat=True))
+    fresh = []
+    for email in emails:
+        if email['message_id'] not in seen:
+            seen.add(email['message_id'])
+            fresh.append(email)
+    return fresh
+
+
+def _existing_tickets(emails):
+    """Message-ID -> id of the stored ticket each email answers, for those that answer one"""
+    references = {reference for email in emails for reference in email['references']}
+    by_reference = dict(Reply.objects.filter(external_id__in=references).values_list('external_id', 'message_id'))
+    by_reference.update(Message.objects.filter(external_id__in=references).values_list('external_id', 'id'))
+
+    tag_ids = {mailparse.tagged_ticket_id(email['subject']) for email in emails} - {None}
+    tagged = dict(Message.objects.filter(id__in=tag_ids).values_list('id', 'sender_email'))
+
+    reply_subjects = [email for email in emails if mailparse.is_reply_subject(email['subject'])]
+    by_subject = {}
+    if reply_subjects:
+        candidates = Message.objects.filter(
+            sender_email__in={email['sender_email'] for email in reply_subjects},
+            subject__in={mailparse.base_subject(email['subject']) for email in reply_subjects},
+        ).order_by('timestamp').values_list('id', 'sender_email', 'subject')
+        for pk, sender_email, subject in candidates:
+            # The newest ticket wins
+            by_subject[sender_email.lower(), subject] = pk
+
+    tickets = {}
+    for email in emails:
+        # References run oldest first, so the thread's original ticket wins
+        ticket = next((by_reference[ref] for ref in email['references'] if ref in by_reference), None)
+        if ticket is None:
+            tag = mailparse.tagged_ticket_id(email['subject'])
+            # A tag alone could be typed by anyone, so the sender has to match too
+            if tag in tagged and tagged[tag].lower() == email['sender_email']:
+                ticket = tag
+        if ticket is None and mailparse.is_reply_subject(email['subject']):
+            ticket = by_subject.get((email['sender_email'], mailparse.base_subject(email['subject'])))
+        if ticket is not None:
+            tickets[email['message_id']] = ticket
+    return tickets
+
+
+def _store_attachment(attachments):
+    """Store the first attachment and return (stored name, original filename), or (None, '')"""
+    if not attachments:
+        return None, ''
+    filename, content = attachments[0]
+    if len(content) > MAX_ATTACHMENT_SIZE:
+        logger.warning("Attachment %s of %d bytes dropped", filename, len(content))
+        return None, ''
+    try:
+        filename = get_valid_filename(os.path.basename(filename))
+    except SuspiciousFileOperation:
+        filename = 'attachment'
+    return attachment_storage.save(f'attachments/{filename}', ContentFile(content)), filename
+
+
+def _add(totals, stats):
+    for key, value in stats.items():
+        totals[key] += value
@@ -0,0 +1,171 @@
+"""
+Live inbox updates
+
+Every change to a message stamps Message.updated_at and, once committed,
+bumps a version number in the shared cache (notify()). Open inbox pages
+listen on a server-sent event stream: each worker process runs one poller
+that reads the version from the cache and wakes that process's streams only
+when it has moved, and each stream then sends the rows changed since its
+cursor. Idle inboxes therefore cost one cache read per process and poll
+interval, and no database queries.
+
+Under WSGI, where a response cannot stay open cheaply, the page polls the
+JSON changes endpoint instead.
+"""
+from datetime import timedelta
+import asyncio
+import json
+import logging
+import time
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'helpdesk:inbox_version'
+
+# Rows stamped this long before a cursor are sent again, in case their
+# transaction committed after a later one the cursor already covers; the
+# page applies the same row twice harmlessly
+CURSOR_OVERLAP = timedelta(seconds=5)
+
+# More changed rows than this and the page reloads instead of patching
+MAX_CHANGES = 100
+
+# Seconds between keep-alive comments, so proxies don't close an idle stream
+HEARTBEAT_SECONDS = 15
+
+# Milliseconds the browser waits before reconnecting a dropped stream
+RETRY_MS = 5000
+
+# Seconds between polls of the changes endpoint when the page cannot stream
+FALLBACK_POLL_SECONDS = 15
+
+_pollers = weakref.WeakKeyDictionary()  # event loop -> _Poller
+
+
+def notify():
+    """Tell open inboxes that messages changed, once the current transaction commits"""
+    transaction.on_commit(_bump_version)
+
+
+def parse_cursor(value):
+    """Cursor from its string form, or None if it isn't one"""
+    cursor = parse_datetime(value or '')
+    if cursor is None or timezone.is_naive(cursor):
+        return None
+    return cursor
+
+
+def changes_since(cursor):
+    """
+    Messages changed since a cursor, oldest change first
+
+    Returns:
+        (messages, next cursor, truncated); truncated means more than
+        MAX_CHANGES rows changed and only the first ones are returned
+    """
+    from .models import Message
+
+    changed = list(
+        Message.objects.select_related('last_responder').defer('message_body')
+        .filter(updated_at__gte=cursor - CURSOR_OVERLAP)
+        .order_by('updated_at', 'id')[:MAX_CHANGES + 1]
+    )
+    truncated = len(changed) > MAX_CHANGES
+    changed = changed[:MAX_CHANGES]
+    if changed and changed[-1].updated_at > cursor:
+        cursor = changed[-1].updated_at
+    return changed, cursor, truncated
+
+
+async def event_stream(cursor, get_changes):
+    """
+    Server-sent events carrying the inbox changes after `cursor`
+
+    Args:
+        cursor: Changes after this are sent, starting right away
+        get_changes: Sync function of a cursor returning the JSON-able
+            change set, whose 'cursor' item is the next cursor
+    """
+    poller = _poller()
+    poller.listeners += 1
+    poller.start()
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        await poller.ready.wait()
+        version = object()
+        while True:
+            # Taken before fetching, so a change during the fetch is not missed
+            changed = poller.changed
+            if version != poller.version:
+                version = poller.version
+                changes = await sync_to_async(get_changes)(cursor)
+                cursor = parse_cursor(changes['cursor'])
+                yield f"id: {changes['cursor']}\nevent: changes\ndata: {json.dumps(changes)}\n\n"
+            try:
+                await asyncio.wait_for(changed.wait(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+    finally:
+        poller.listeners -= 1
+        if not poller.listeners and poller.task is not None:
+            poller.task.cancel()
+            poller.task = None
+
+
+class _Poller:
+    """Watches the version for every stream of one event loop"""
+
+    def __init__(self):
+        self.version = None
+        self.ready = asyncio.Event()  # set once the version has been read
+        self.changed = asyncio.Event()
+        self.listeners = 0
+        self.task = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.ready = asyncio.Event()
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        try:
+            self.version = await cache.aget(VERSION_KEY)
+        finally:
+            self.ready.set()
+        while self.listeners:
+            await asyncio.sleep(settings.LIVE_INBOX_POLL_INTERVAL)
+            try:
+                version = await cache.aget(VERSION_KEY)
+            except Exception as e:
+                logger.warning("Live inbox version check failed: %s", e)
+                continue
+            if version != self.version:
+                self.version = version
+                # Wake the current waiters; later ones wait on a fresh event
+                changed, self.changed = self.changed, asyncio.Event()
+                changed.set()
+
+
+def _poller():
+    loop = asyncio.get_running_loop()
+    poller = _pollers.get(loop)
+    if poller is None:
+        poller = _pollers[loop] = _Poller()
+    return poller
+
+
+def _bump_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # Missing or evicted; start from the clock so the value is still a new one
+        if not cache.add(VERSION_KEY, time.time_ns(), timeout=None):
+            cache.incr(VERSION_KEY)
@@ -0,0 +1,95 @@
+"""
+Logging pipeline: JSON lines, written by a background thread
+
+Loggers hand records to a QueueListenerHandler, which only puts them on an
+in-memory queue; a listener thread formats them and does the file and
+console I/O. Request threads therefore never wait on the disk. Configured
+from settings.LOGGING, so this module must not import models.
+"""
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+
+# LogRecord attributes that are not `extra` fields
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record, with any `extra` fields as top-level keys"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc_info'] = record.exc_text
+        if record.stack_info:
+            entry['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class QueueListenerHandler(QueueHandler):
+    """
+    Queue records for a listener thread that passes them on to `handlers`
+
+    Args:
+        handlers: The handlers doing the actual output; in a dictConfig,
+            'cfg://handlers.<name>' references to handlers defined earlier
+            in alphabetical order
+    """
+
+    def __init__(self, handlers):
+        super().__init__(queue.SimpleQueue())
+        # dictConfig resolves cfg:// references on item access, not on iteration
+        handlers = [handlers[i] for i in range(len(handlers))]
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        self._stopped = False
+        # Drain what is still queued when the process exits
+        atexit.register(self.close)
+
+    def prepare(self, record):
+        # Only merge the message arguments here, while they still hold their
+        # logged values; JSON encoding and tracebacks are left to the listener
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+    def close(self):
+        if not self._stopped:
+            self._stopped = True
+            self.listener.stop()
+        super().close()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Pass only a fraction of records below WARNING
+
+    Args:
+        rate: Fraction of INFO/DEBUG records kept, 0.0 to 1.0
+    """
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = float(rate)
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate >= 1:
+            return True
+        return random.random() < self.rate
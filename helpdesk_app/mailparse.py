@@ -0,0 +1,163 @@
+"""
+Parsing of RFC 822 email into helpdesk ticket fields
+
+Used by the ticket importer and inbound mail ingestion. mbox and maildir
+input is read one message at a time, so memory use does not grow with the
+size of the archive.
+"""
+from django.utils import timezone
+from email import policy
+from email.parser import BytesParser
+from email.utils import getaddresses, parsedate_to_datetime
+from datetime import timezone as dt_timezone
+import hashlib
+import html
+import os
+import re
+
+MESSAGE_ID_RE = re.compile(r'<[^<>\s]+>')
+TAG_RE = re.compile(r'<[^>]*>')
+
+# "[#123]" in a subject names ticket 123; replies from the helpdesk carry it
+TICKET_TAG_RE = re.compile(r'\[#(\d+)\]')
+# "Re:", "AW:", "Fwd:" and similar, possibly repeated or numbered ("Re[2]:")
+REPLY_PREFIX_RE = re.compile(r'^(?:\s*(?:re|aw|sv|vs|antw|fwd?|wg)\s*(?:\[\d+\])?\s*:)+\s*', re.IGNORECASE)
+
+
+def parse_message(raw):
+    """
+    Extract the fields the helpdesk stores from a raw email
+
+    Args:
+        raw: The message as bytes
+
+    Returns:
+        Dict with message_id, references (oldest first), sender_name,
+        sender_email, subject, body, timestamp and attachments, a list of
+        (filename, content bytes) pairs
+    """
+    msg = BytesParser(policy=policy.default).parsebytes(raw)
+
+    sender_name, sender_email = '', ''
+    senders = getaddresses([str(msg.get('From', ''))])
+    if senders:
+        sender_name, sender_email = senders[0]
+
+    # Messages without a Message-ID get a stable one, so re-imports recognise them
+    message_id = _first_id(msg.get('Message-ID')) or f'<{hashlib.sha1(raw).hexdigest()}@import>'
+
+    references = MESSAGE_ID_RE.findall(str(msg.get('References', '')))
+    in_reply_to = _first_id(msg.get('In-Reply-To'))
+    if in_reply_to and in_reply_to not in references:
+        references.append(in_reply_to)
+
+    return {
+        'message_id': message_id,
+        'references': references,
+        'sender_name': sender_name or sender_email.split('@')[0],
+        'sender_email': sender_email.lower(),
+        'subject': str(msg.get('Subject', '')).strip() or '(no subject)',
+        'body': _body_text(msg),
+        'timestamp': _parse_date(msg.get('Date')),
+        'attachments': [
+            (part.get_filename() or 'attachment', part.get_payload(decode=True) or b'')
+            for part in msg.iter_attachments()
+        ] if msg.is_multipart() else [],
+    }
+
+
+def ticket_tag(message_id):
+    """Subject marker that threads a customer's answer onto ticket `message_id`"""
+    return f'[#{message_id}]'
+
+
+def tagged_ticket_id(subject):
+    """Ticket id from a subject's ticket tag, or None"""
+    match = TICKET_TAG_RE.search(subject)
+    return int(match.group(1)) if match else None
+
+
+def is_reply_subject(subject):
+    return bool(REPLY_PREFIX_RE.match(subject))
+
+
+def base_subject(subject):
+    """Subject without reply prefixes and ticket tag, whitespace collapsed"""
+    return ' '.join(TICKET_TAG_RE.sub('', REPLY_PREFIX_RE.sub('', subject)).split())
+
+
+def iter_mbox(path):
+    """Yield the raw bytes of each message in an mbox file, one at a time"""
+    lines = []
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.startswith(b'From ') and (not lines or lines[-1] in (b'\n', b'\r\n')):
+                if lines:
+                    yield _unescape_mbox(lines)
+                lines = []
+                continue
+            lines.append(line)
+    if lines:
+        yield _unescape_mbox(lines)
+
+
+def iter_maildir(path):
+    """Yield the raw bytes of each message in a maildir's cur/ and new/ folders"""
+    for folder in ('cur', 'new'):
+        directory = os.path.join(path, folder)
+        if not os.path.isdir(directory):
+            continue
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith('.'):
+                    with open(entry.path, 'rb') as f:
+                        yield f.read()
+
+
+def iter_maildir_new(path):
+    """Yield (file path, raw bytes) of each message not yet seen, in a maildir's new/ folder"""
+    directory = os.path.join(path, 'new')
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and not entry.name.startswith('.'):
+                with open(entry.path, 'rb') as f:
+                    yield entry.path, f.read()
+
+
+def mark_maildir_seen(path):
+    """Move a message from new/ to cur/ with the Seen flag, as mail clients do"""
+    directory, name = os.path.split(path)
+    os.replace(path, os.path.join(os.path.dirname(directory), 'cur', f'{name}:2,S'))
+
+
+def _unescape_mbox(lines):
+    # mboxrd quotes body lines starting with "From " as ">From "
+    return b''.join(line[1:] if re.match(rb'^>+From ', line) else line for line in lines)
+
+
+def _first_id(header):
+    match = MESSAGE_ID_RE.search(str(header or ''))
+    return match.group(0) if match else ''
+
+
+def _parse_date(header):
+    try:
+        value = parsedate_to_datetime(str(header))
+    except (TypeError, ValueError, IndexError):
+        return timezone.now()
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, dt_timezone.utc)
+    return value
+
+
+def _body_text(msg):
+    part = msg.get_body(preferencelist=('plain', 'html'))
+    if part is None:
+        return ''
+    try:
+        content = part.get_content()
+    except (LookupError, UnicodeDecodeError):
+        content = (part.get_payload(decode=True) or b'').decode('utf-8', 'replace')
+    if part.get_content_subtype() == 'html':
+        content = html.unescape(TAG_RE.sub('', content))
+    return content.strip()
@@ -0,0 +1,54 @@
+"""
+Move old replied messages and their replies to the archive tables
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from helpdesk_app import archive
+
+
+class Command(BaseCommand):
+    help = (
+        'Archive replied messages with no activity for --days, in batches of one transaction each. '
+        'Safe to interrupt and re-run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ARCHIVE_AFTER_DAYS,
+                            help='Archive messages idle for longer than this (default ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=settings.ARCHIVE_BATCH_SIZE,
+                            help='Messages moved per transaction')
+        parser.add_argument('--compress', action='store_true', default=settings.ARCHIVE_COMPRESS,
+                            help='zlib-compress archived bodies')
+        parser.add_argument('--no-compress', action='store_false', dest='compress')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the messages due')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        if options['days'] < 0:
+            raise CommandError('--days must not be negative')
+
+        # Fixed for the whole run, so it terminates even while new messages age in
+        cutoff = archive.cutoff_for(options['days'])
+        if options['dry_run']:
+            count = archive.archivable(cutoff).count()
+            self.stdout.write(f"{count} messages would be archived.")
+            return
+
+        started = time.perf_counter()
+        total = 0
+        while True:
+            moved = archive.archive_batch(cutoff, options['batch_size'], options['compress'])
+            if not moved:
+                break
+            total += moved
+            if options['verbosity'] >= 2:
+                self.stdout.write(f"{total} messages archived")
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Archived {total} messages in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} messages/sec)."
+        )
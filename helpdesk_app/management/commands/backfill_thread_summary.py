@@ -0,0 +1,31 @@
+"""
+Recompute the denormalized thread summary on messages
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from helpdesk_app import threads
+from helpdesk_app.models import Message
+
+
+class Command(BaseCommand):
+    help = 'Recompute reply count, last reply and last activity for every message'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Messages updated per transaction')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_id, updated = 0, 0
+        # Short transactions in id order, so the live site is never locked out for long
+        while True:
+            ids = list(
+                Message.objects.filter(id__gt=last_id).order_by('id')
+                .values_list('id', flat=True)[:chunk_size]
+            )
+            if not ids:
+                break
+            with transaction.atomic():
+                updated += threads.refresh(Message.objects.filter(id__in=ids))
+            last_id = ids[-1]
+        self.stdout.write(f"Updated the thread summary of {updated} messages.")
@@ -0,0 +1,75 @@
+"""
+Compare cache backends on the operations the helpdesk uses
+"""
+import json
+import shutil
+import tempfile
+import time
+
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+from django.core.management.commands.createcachetable import Command as CreateCacheTable
+from django.db import connection
+
+from helpdesk_app.cache_backends import SQLiteCache
+
+BENCHMARK_TABLE = 'helpdesk_benchmark_cache'
+
+
+class Command(BaseCommand):
+    help = 'Benchmark SQLiteCache against locmem, file-based and database caches (JSON output)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--operations', type=int, default=2000, help='Operations per test')
+        parser.add_argument('--keys', type=int, default=200, help='Distinct keys used')
+
+    def handle(self, *args, **options):
+        tmpdir = tempfile.mkdtemp(prefix='helpdesk-cache-bench-')
+        params = {'OPTIONS': {'MAX_ENTRIES': 100000}}
+        create_table = CreateCacheTable()
+        create_table.verbosity = 0
+        create_table.create_table('default', BENCHMARK_TABLE, dry_run=False)
+        backends = {
+            'locmem': LocMemCache('benchmark', params),
+            'sqlite_shared': SQLiteCache(f'{tmpdir}/cache.sqlite3', params),
+            'filebased': FileBasedCache(f'{tmpdir}/files', params),
+            'database': DatabaseCache(BENCHMARK_TABLE, params),
+        }
+
+        try:
+            results = {
+                name: self.run_backend(backend, options['operations'], options['keys'])
+                for name, backend in backends.items()
+            }
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(f'DROP TABLE {connection.ops.quote_name(BENCHMARK_TABLE)}')
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def run_backend(self, backend, operations, keys):
+        value = {'total': 12345, 'new': 67, 'replied': 12278}
+        backend.clear()
+
+        def timed(operation):
+            start = time.perf_counter()
+            for i in range(operations):
+                operation(f'key-{i % keys}')
+            elapsed = time.perf_counter() - start
+            return {
+                'ops_per_sec': round(operations / elapsed),
+                'mean_us': round(elapsed / operations * 1e6, 1),
+            }
+
+        result = {
+            'set': timed(lambda key: backend.set(key, value, 300)),
+            'get_hit': timed(lambda key: backend.get(key)),
+            'get_miss': timed(lambda key: backend.get(f'missing-{key}')),
+        }
+        # The rate limiter's pattern: add() a window counter, then incr() it
+        result['add_incr'] = timed(lambda key: (backend.add(f'rl-{key}', 0, 300), backend.incr(f'rl-{key}')))
+        backend.clear()
+        return result
@@ -0,0 +1,278 @@
+"""
+Compare concurrent-request throughput of the sync (WSGI) and async (ASGI) deployments
+"""
+import itertools
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.mail.backends.dummy import EmailBackend as DummyEmailBackend
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from helpdesk_app import counters
+from helpdesk_app.models import Message, message_preview
+from helpdesk_app.search import get_search_backend
+
+SERVERS = {
+    'sync': ['helpdesk.wsgi:application'],
+    'async': ['helpdesk.asgi:application', '-k', 'uvicorn.workers.UvicornWorker'],
+}
+
+BENCHMARK_USERNAME = 'benchmark-agent'
+
+CSRF_INPUT_RE = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+DATABASE_SCHEMES = {'mysql': 'mysql', 'postgresql': 'postgres'}
+
+
+def database_url(settings_dict):
+    """DATABASE_URL of a connection's database, for the servers started in other processes"""
+    if connection.vendor == 'sqlite':
+        return f"sqlite:///{settings_dict['NAME']}"
+    credentials = urllib.parse.quote(settings_dict['USER'] or '', safe='')
+    if settings_dict['PASSWORD']:
+        credentials += ':' + urllib.parse.quote(settings_dict['PASSWORD'], safe='')
+    host = settings_dict['HOST'] or 'localhost'
+    if settings_dict['PORT']:
+        host += f":{settings_dict['PORT']}"
+    return f"{DATABASE_SCHEMES[connection.vendor]}://{credentials}@{host}/{settings_dict['NAME']}"
+
+
+class SlowEmailBackend(DummyEmailBackend):
+    """Discards mail after BENCHMARK_EMAIL_LATENCY ms, standing in for a slow SMTP server"""
+
+    def send_messages(self, email_messages):
+        time.sleep(int(os.environ.get('BENCHMARK_EMAIL_LATENCY', '0')) / 1000)
+        return super().send_messages(email_messages)
+
+
+class Command(BaseCommand):
+    help = 'Load-test gunicorn sync workers against uvicorn workers on the same paths (JSON output)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', choices=['inbox', 'detail', 'contact'], default='inbox')
+        parser.add_argument('--servers', default='sync,async', help='Comma-separated: sync, async')
+        parser.add_argument('--workers', type=int, default=2, help='Worker processes per server')
+        parser.add_argument('--requests', type=int, default=400, help='Requests per server')
+        parser.add_argument('--concurrency', type=int, default=32, help='Requests in flight at once')
+        parser.add_argument('--messages', type=int, default=200, help='Messages seeded in the benchmark database')
+        parser.add_argument(
+            '--email-latency', type=int, default=0,
+            help='Send mail directly (no outbox) through a fake server taking this many ms',
+        )
+
+    def handle(self, *args, **options):
+        servers = [name.strip() for name in options['servers'].split(',') if name.strip()]
+        unknown = set(servers) - set(SERVERS)
+        if unknown:
+            raise CommandError(f"Unknown servers: {', '.join(sorted(unknown))}")
+
+        # Runs against a fresh test database on the configured engine, never the
+        # real data; the servers share it and a cache prefix of their own, and
+        # keep the mail they send in memory
+        key_prefix = f'benchmark-{os.getpid()}-{time.time_ns()}'
+        cache_settings = {
+            **settings.CACHES,
+            'default': {**settings.CACHES['default'], 'KEY_PREFIX': key_prefix},
+        }
+        setup_test_environment()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            test_settings = connection.settings_dict['TEST']
+            old_test_name = test_settings['NAME']
+            if connection.vendor == 'sqlite':
+                # The servers are other processes, so not an in-memory database
+                test_settings['NAME'] = os.path.join(tmpdir, 'benchmark.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                with override_settings(RATELIMIT_ENABLE=False, CACHES=cache_settings):
+                    results = self.run(servers, options, {
+                        'DATABASE_URL': database_url(connection.settings_dict),
+                        'CACHE_KEY_PREFIX': key_prefix,
+                        'EMAIL_BACKEND': 'django.core.mail.backends.locmem.EmailBackend',
+                    })
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                test_settings['NAME'] = old_test_name
+                teardown_test_environment()
+
+        self.stdout.write(json.dumps({
+            'path': options['path'],
+            'workers': options['workers'],
+            'concurrency': options['concurrency'],
+            'email_latency_ms': options['email_latency'],
+            'results': results,
+        }, indent=2))
+
+    def run(self, servers, options, environment):
+        self.seed(options['messages'])
+        session_key = self.login()
+        env = dict(os.environ, RATELIMIT_ENABLE='False', **environment)
+        if options['email_latency']:
+            env.update(
+                EMAIL_OUTBOX_ENABLED='False',
+                EMAIL_BACKEND=f'{__name__}.SlowEmailBackend',
+                BENCHMARK_EMAIL_LATENCY=str(options['email_latency']),
+            )
+
+        results = {}
+        for name in servers:
+            port = self.free_port()
+            process = subprocess.Popen(
+                [sys.executable, '-m', 'gunicorn', *SERVERS[name],
+                 '--workers', str(options['workers']), '--bind', f'127.0.0.1:{port}'],
+                env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            try:
+                base_url = f'http://127.0.0.1:{port}'
+                self.wait_for(base_url, process)
+                request = self.build_request(options['path'], base_url, session_key)
+                results[name] = self.run_load(request, options['requests'], options['concurrency'])
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+        return results
+
+    def seed(self, count):
+        missing = count - Message.objects.count()
+        if missing <= 0:
+            return
+        body = 'I cannot log in to my account since this morning.'
+        created = Message.objects.bulk_create([
+            Message(
+                sender_name=f'Customer {i}',
+                sender_email=f'customer{i}@example.com',
+                subject=f'Benchmark question {i}',
+                message_body=body,
+                body_preview=message_preview(body),
+            )
+            for i in range(missing)
+        ])
+        # bulk_create skips the signals that maintain these
+        get_search_backend().index_messages(created)
+        counters.reconcile()
+
+    def login(self):
+        user, created = User.objects.get_or_create(username=BENCHMARK_USERNAME, defaults={'is_staff': True})
+        if created:
+            user.set_unusable_password()
+            user.save()
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        return session.session_key
+
+    def build_request(self, path, base_url, session_key):
+        """Return a zero-argument callable performing one request, raising on errors"""
+        cookie = f'{settings.SESSION_COOKIE_NAME}={session_key}'
+
+        if path == 'inbox':
+            return lambda: self.fetch(urllib.request.Request(f'{base_url}/inbox/', headers={'Cookie': cookie}))
+
+        if path == 'detail':
+            message_id = Message.objects.order_by('-id').values_list('id', flat=True).first()
+            url = f'{base_url}/message/{message_id}/'
+            return lambda: self.fetch(urllib.request.Request(url, headers={'Cookie': cookie}))
+
+        # One CSRF cookie/token pair is valid for any number of posts
+        with urllib.request.urlopen(f'{base_url}/contact/') as response:
+            csrf_cookie = response.headers['Set-Cookie'].split(';')[0]
+            token = CSRF_INPUT_RE.search(response.read().decode()).group(1)
+        # Every post is a new ticket; a repeated one would be merged as a duplicate
+        submissions = itertools.count(1)
+
+        def body():
+            number = next(submissions)
+            return urllib.parse.urlencode({
+                'csrfmiddlewaretoken': token,
+                'sender_name': 'Load Test',
+                'sender_email': 'loadtest@example.com',
+                'subject': f'Benchmark submission #{number}',
+                'message_body': f'Submitted by benchmark_concurrency, post {number}.',
+            }).encode()
+
+        return lambda: self.fetch(urllib.request.Request(
+            f'{base_url}/contact/', data=body(),
+            headers={'Cookie': csrf_cookie, 'Referer': f'{base_url}/contact/'},
+        ))
+
+    @staticmethod
+    def fetch(request):
+        # Redirects are not followed; a 302 after POST is a success
+        opener = urllib.request.build_opener(NoRedirect)
+        try:
+            with opener.open(request, timeout=60) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            if e.code != 302:
+                raise
+
+    def run_load(self, request, total, concurrency):
+        def timed(_):
+            start = time.perf_counter()
+            try:
+                request()
+            except Exception:
+                return None
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            timings = list(pool.map(timed, range(total)))
+        elapsed = time.perf_counter() - start
+
+        latencies = sorted(t * 1000 for t in timings if t is not None)
+        result = {
+            'requests': total,
+            'errors': total - len(latencies),
+            'requests_per_sec': round(len(latencies) / elapsed, 1),
+        }
+        if latencies:
+            percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+            result.update({
+                'p50_ms': round(percentiles[49], 1),
+                'p95_ms': round(percentiles[94], 1),
+                'p99_ms': round(percentiles[98], 1),
+            })
+        return result
+
+    @staticmethod
+    def free_port():
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    @staticmethod
+    def wait_for(base_url, process, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f'Server exited with code {process.returncode}')
+            try:
+                urllib.request.urlopen(f'{base_url}/contact/', timeout=2).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f'Server at {base_url} did not start within {timeout}s')
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
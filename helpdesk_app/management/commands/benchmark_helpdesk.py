@@ -0,0 +1,231 @@
+"""
+Time the helpdesk's hot request paths against a seeded throwaway database
+"""
+import itertools
+import json
+import os
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment,
+)
+from django.urls import reverse
+from django.utils import timezone
+
+from helpdesk_app import counters, threads
+from helpdesk_app.models import Message, Reply, message_preview
+from helpdesk_app.pagination import encode_cursor
+from helpdesk_app.search import get_search_backend
+
+SEED_CHUNK_SIZE = 1000
+
+# Every seeded subject contains one topic, so searching a topic matches ~1/len(TOPICS) of the inbox
+TOPICS = ['login', 'billing', 'refund', 'shipping', 'password', 'invoice', 'upgrade', 'outage']
+
+PAGE_SIZE = 20
+
+
+class Command(BaseCommand):
+    help = 'Seed a test database and report p50/p95/p99 latency and query counts of the hot paths (JSON output)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=10000, help='Messages to seed')
+        parser.add_argument('--replies', type=int, default=10000, help='Replies spread over the messages')
+        parser.add_argument('--thread-replies', type=int, default=200,
+                            help='Replies on the thread used for the detail view')
+        parser.add_argument('--iterations', type=int, default=50, help='Timed requests per path')
+        parser.add_argument('--depths', default='1,10,100', help='Comma-separated inbox page numbers')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated data')
+
+    def handle(self, *args, **options):
+        try:
+            depths = [int(depth) for depth in options['depths'].split(',')]
+        except ValueError:
+            raise CommandError('--depths must be comma-separated page numbers')
+
+        # Runs against a fresh test database on the configured engine, never the
+        # real data, and keeps its cache entries apart from the live site's
+        cache_settings = {
+            **settings.CACHES,
+            'default': {**settings.CACHES['default'], 'KEY_PREFIX': f'benchmark-{os.getpid()}-{time.time_ns()}'},
+        }
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(RATELIMIT_ENABLE=False, CACHES=cache_settings):
+                report = self.run(options, depths)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def run(self, options, depths):
+        get_search_backend.cache_clear()
+        rng = random.Random(options['seed'])
+
+        start = time.perf_counter()
+        user, thread = self.seed(rng, options['messages'], options['replies'], options['thread_replies'])
+        seed_seconds = time.perf_counter() - start
+
+        client = Client()
+        client.force_login(user)
+        iterations = options['iterations']
+        results = {}
+
+        # Every post is a new ticket; a repeated one would be merged as a duplicate
+        submissions = itertools.count(1)
+        results['contact_post'] = self.measure(
+            lambda i: client.post(reverse('contact'), contact_data(next(submissions))), iterations, expect=302,
+        )
+
+        inbox_url = reverse('inbox')
+        ordered = Message.objects.order_by('-timestamp', '-id')
+        for depth in depths:
+            offset = (depth - 1) * PAGE_SIZE
+            if depth < 1 or offset >= options['messages']:
+                continue
+            params = {}
+            if depth > 1:
+                edge = ordered[offset - 1]
+                params['cursor'] = encode_cursor(edge.timestamp, edge.pk, 'next')
+            results[f'inbox_keyset_page_{depth}'] = self.measure(
+                lambda i: client.get(inbox_url, params), iterations,
+            )
+            with override_settings(INBOX_PAGINATION='offset'):
+                results[f'inbox_offset_page_{depth}'] = self.measure(
+                    lambda i: client.get(inbox_url, {'page': depth}), iterations,
+                )
+
+        results['search'] = self.measure(
+            lambda i: client.get(inbox_url, {'q': TOPICS[i % len(TOPICS)]}), iterations,
+        )
+        results['search_ranked'] = self.measure(
+            lambda i: client.get(inbox_url, {'q': TOPICS[i % len(TOPICS)], 'sort': 'relevance'}), iterations,
+        )
+
+        results['message_detail'] = self.measure(
+            lambda i: client.get(reverse('message_detail', args=[thread.pk])), iterations,
+        )
+
+        new_ids = list(
+            Message.objects.filter(status='new').exclude(pk=thread.pk)
+            .order_by('id').values_list('id', flat=True)[:iterations + 1]
+        )
+        if len(new_ids) > iterations:
+            results['mark_as_read'] = self.measure(
+                lambda i: client.post(reverse('mark_as_read', args=[new_ids[i]])), iterations, expect=302,
+            )
+
+        return {
+            'environment': {
+                'database': connection.vendor,
+                'cache': settings.CACHES['default']['BACKEND'],
+                'search': type(get_search_backend()).__name__,
+                'email_outbox': settings.EMAIL_OUTBOX_ENABLED,
+                'inbox_pagination': settings.INBOX_PAGINATION,
+            },
+            'seed': {
+                'messages': options['messages'],
+                'replies': options['replies'],
+                'thread_replies': options['thread_replies'],
+                'seconds': round(seed_seconds, 2),
+            },
+            'results': results,
+        }
+
+    def seed(self, rng, message_count, reply_count, thread_replies):
+        user = User.objects.create_user(username='benchmark-agent', is_staff=True)
+        now = timezone.now()
+
+        for first in range(0, message_count, SEED_CHUNK_SIZE):
+            batch = []
+            for i in range(first, min(first + SEED_CHUNK_SIZE, message_count)):
+                timestamp = now - timedelta(minutes=message_count - i)
+                body = f'Hello, I need help with my {rng.choice(TOPICS)} request. ' * 3
+                batch.append(Message(
+                    sender_name=f'Customer {i}',
+                    sender_email=f'customer{i}@example.com',
+                    subject=f'Question about {rng.choice(TOPICS)} #{i}',
+                    message_body=body,
+                    body_preview=message_preview(body),
+                    status='replied' if rng.random() < 0.7 else 'new',
+                    timestamp=timestamp,
+                    last_activity_at=timestamp,
+                ))
+            Message.objects.bulk_create(batch)
+
+        thread = Message.objects.create(
+            sender_name='Long Thread', sender_email='thread@example.com',
+            subject='A very long conversation', message_body='This thread has many replies.',
+        )
+
+        message_ids = list(Message.objects.exclude(pk=thread.pk).values_list('id', flat=True))
+        replies = [
+            Reply(message_id=rng.choice(message_ids), admin=user, reply_body='Thanks, we are looking into it.')
+            for _ in range(reply_count if message_ids else 0)
+        ]
+        replies += [
+            Reply(message=thread, admin=user, reply_body=f'Follow-up number {i}.')
+            for i in range(thread_replies)
+        ]
+        Reply.objects.bulk_create(replies, batch_size=SEED_CHUNK_SIZE)
+
+        # bulk_create skips the signals that maintain all of these
+        threads.refresh(Message.objects.all())
+        get_search_backend().rebuild()
+        counters.reconcile()
+        return user, thread
+
+    def measure(self, request, iterations, expect=200):
+        """Time `request(i)` for each iteration after one warm-up call"""
+        self.check_response(request(0), expect)
+
+        timings, queries = [], []
+        for i in range(iterations):
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = request(i)
+                timings.append((time.perf_counter() - start) * 1000)
+            self.check_response(response, expect)
+            queries.append(len(captured))
+
+        timings.sort()
+        return {
+            'iterations': iterations,
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'mean_ms': round(statistics.fmean(timings), 2),
+            'queries': round(statistics.median(queries)),
+            'max_queries': max(queries),
+        }
+
+    @staticmethod
+    def check_response(response, expect):
+        if response.status_code != expect:
+            raise CommandError(f'{response.request["PATH_INFO"]} returned {response.status_code}, expected {expect}')
+
+
+def percentile(sorted_values, percent):
+    """Nearest-rank percentile of an already sorted list"""
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def contact_data(number):
+    """Contact form post number `number`, distinct from every other one"""
+    return {
+        'sender_name': 'Benchmark Customer',
+        'sender_email': 'customer@example.com',
+        'subject': f'Cannot reach the billing page #{number}',
+        'message_body': f'The billing page shows error {number} since this morning.',
+    }
@@ -0,0 +1,125 @@
+"""
+Measure what writing the request log costs the request thread
+"""
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+from logging.handlers import RotatingFileHandler
+
+from django.core.management.base import BaseCommand, CommandError
+
+from helpdesk_app.log import JSONFormatter, QueueListenerHandler, SamplingFilter
+
+
+class SlowDiskMixin:
+    """Sleeps on every flush, standing in for a slow or contended disk"""
+
+    latency = 0.0
+
+    def flush(self):
+        super().flush()
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class SlowFileHandler(SlowDiskMixin, logging.FileHandler):
+    pass
+
+
+class SlowRotatingFileHandler(SlowDiskMixin, RotatingFileHandler):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the per-request logging overhead of a plain FileHandler (the old setup) '
+        'with the queued JSON pipeline, optionally sampled (JSON output)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20000, help='Request log lines per setup')
+        parser.add_argument('--sample-rate', type=float, default=0.1,
+                            help='Sampling rate for the sampled setup')
+        parser.add_argument('--disk-latency', type=float, default=0,
+                            help='Milliseconds added to every write, to simulate a slow disk')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('--requests must be at least 1')
+        if not 0 <= options['sample_rate'] <= 1:
+            raise CommandError('--sample-rate must be between 0 and 1')
+
+        SlowDiskMixin.latency = options['disk_latency'] / 1000
+        results = {}
+        with tempfile.TemporaryDirectory() as tmp:
+            logger = self.file_logger(os.path.join(tmp, 'file.log'))
+            try:
+                results['file_handler'] = self.run(logger, options['requests'], structured=False)
+            finally:
+                logger.handlers[0].close()
+            for name, rate in (('queue_json', 1.0), ('queue_json_sampled', options['sample_rate'])):
+                handler = QueueListenerHandler([self.rotating_handler(os.path.join(tmp, f'{name}.log'))])
+                logger = self.isolated_logger(f'benchmark.{name}', handler)
+                logger.addFilter(SamplingFilter(rate))
+                try:
+                    results[name] = self.run(logger, options['requests'], structured=True)
+                    drain_start = time.perf_counter()
+                finally:
+                    handler.close()
+                results[name]['drain_ms'] = round((time.perf_counter() - drain_start) * 1000, 1)
+                results[name]['sample_rate'] = rate
+
+        self.stdout.write(json.dumps({
+            'requests': options['requests'],
+            'disk_latency_ms': options['disk_latency'],
+            'results': results,
+        }, indent=2))
+
+    @staticmethod
+    def isolated_logger(name, handler):
+        logger = logging.getLogger(name)
+        logger.handlers = [handler]
+        logger.filters = []
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        return logger
+
+    def file_logger(self, path):
+        handler = SlowFileHandler(path)
+        handler.setFormatter(logging.Formatter('{levelname} {asctime} {module} {message}', style='{'))
+        return self.isolated_logger('benchmark.file_handler', handler)
+
+    @staticmethod
+    def rotating_handler(path):
+        handler = SlowRotatingFileHandler(path, maxBytes=10 * 1024 * 1024, backupCount=2, encoding='utf-8')
+        handler.setFormatter(JSONFormatter())
+        return handler
+
+    @staticmethod
+    def run(logger, count, structured):
+        """Time each request log call as seen by the caller"""
+        timings = []
+        for i in range(count):
+            path = f'/message/{i}/'
+            start = time.perf_counter()
+            if structured:
+                logger.info('%s %s %s', 'GET', path, 200, extra={
+                    'method': 'GET', 'path': path, 'view': 'message_detail', 'status': 200,
+                    'remote_addr': '127.0.0.1', 'duration_ms': 12.5, 'queries': 4,
+                })
+            else:
+                logger.info(f"GET {path} from 127.0.0.1")
+            timings.append((time.perf_counter() - start) * 1_000_000)
+        for handler in logger.handlers:
+            handler.flush()
+
+        timings.sort()
+        return {
+            'p50_us': round(timings[len(timings) // 2], 2),
+            'p99_us': round(timings[min(len(timings) - 1, len(timings) * 99 // 100)], 2),
+            'max_us': round(timings[-1], 2),
+            'mean_us': round(statistics.fmean(timings), 2),
+        }
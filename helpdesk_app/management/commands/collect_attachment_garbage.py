@@ -0,0 +1,30 @@
+"""
+Delete attachment files that no message or reply uses any more
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from helpdesk_app import storage
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete stored attachment files unused for longer than --grace-hours, and files left '
+        'without a record by interrupted uploads. Safe to run while the site is up.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=settings.ATTACHMENT_GC_GRACE_HOURS,
+                            help='Keep unused files this long (default ATTACHMENT_GC_GRACE_HOURS)')
+
+    def handle(self, *args, **options):
+        if options['grace_hours'] < 0:
+            raise CommandError('--grace-hours must not be negative')
+
+        result = storage.collect_garbage(timedelta(hours=options['grace_hours']))
+        self.stdout.write(
+            f"Deleted {result['deleted']} unused and {result['orphans']} orphaned attachment files; "
+            f"recounted {result['recounted']} still in use."
+        )
@@ -0,0 +1,39 @@
+"""
+Stream messages and their replies to a CSV or JSON Lines file
+"""
+import sys
+
+from django.core.management.base import BaseCommand
+
+from helpdesk_app import exports
+from helpdesk_app.models import Message
+from helpdesk_app.search import filter_messages
+
+
+class Command(BaseCommand):
+    help = 'Export messages and replies with the inbox filters (q, status), in constant memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--q', default='', help='Full-text search, as in the inbox')
+        parser.add_argument('--status', default='', choices=['', *dict(Message.STATUS_CHOICES)])
+        parser.add_argument('--format', choices=list(exports.CONTENT_TYPES), default='csv')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip')
+        parser.add_argument('--output', '-o', default='-', help='Output file (default: stdout)')
+
+    def handle(self, *args, **options):
+        queryset = filter_messages(Message.objects.all(), options['q'], options['status'])
+        stream = exports.export_stream(queryset, options['format'], options['gzip'])
+
+        if options['output'] == '-':
+            output = getattr(self.stdout._out, 'buffer', sys.stdout.buffer)
+            for chunk in stream:
+                output.write(chunk)
+            output.flush()
+            return
+
+        written = 0
+        with open(options['output'], 'wb') as output:
+            for chunk in stream:
+                output.write(chunk)
+                written += len(chunk)
+        self.stdout.write(f"Wrote {written} bytes to {options['output']}")
@@ -0,0 +1,265 @@
+"""
+Bulk import historical tickets from a CSV file, an mbox file or a maildir
+"""
+import csv
+import os
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile, File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.text import get_valid_filename
+
+from helpdesk_app import counters, live, mailparse, previews, threads
+from helpdesk_app.models import Message, Reply, message_fingerprint, message_preview
+from helpdesk_app.search import get_search_backend
+from helpdesk_app.storage import attachment_storage
+
+CSV_COLUMNS = 'id, parent_id, sender_name, sender_email, subject, body, status, timestamp, admin, attachment'
+
+
+class Command(BaseCommand):
+    help = (
+        'Import tickets in chunks with bulk_create. Input is streamed, and rows '
+        'imported by an earlier (possibly interrupted) run are skipped. '
+        f'CSV columns: {CSV_COLUMNS}; rows with a parent_id are replies.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file, mbox file or maildir directory')
+        parser.add_argument('--format', choices=['csv', 'mbox', 'maildir'],
+                            help='Input format (default: guessed from the path)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows per bulk_create')
+        parser.add_argument('--staff-address', action='append', default=[],
+                            help='Extra sender address whose emails are helpdesk replies (repeatable)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        self.verbosity = options['verbosity']
+        if not os.path.exists(path):
+            raise CommandError(f'{path} does not exist')
+        input_format = options['format'] or self.guess_format(path)
+        self.chunk_size = options['chunk_size']
+        if self.chunk_size < 1:
+            raise CommandError('--chunk-size must be at least 1')
+
+        # Staff by username and lowercased email, for reply authors
+        self.staff = {}
+        for pk, username, email in User.objects.filter(is_staff=True).values_list('pk', 'username', Lower('email')):
+            self.staff[username] = pk
+            if email:
+                self.staff[email] = pk
+        self.staff_addresses = {
+            address.lower() for address in
+            [settings.DEFAULT_FROM_EMAIL, settings.ADMIN_EMAIL, *options['staff_address']]
+        } | {key for key in self.staff if '@' in key}
+
+        if input_format == 'csv':
+            read = lambda: self.read_csv(path)
+        else:
+            iterate = mailparse.iter_mbox if input_format == 'mbox' else mailparse.iter_maildir
+            read = lambda: (self.email_record(raw) for raw in iterate(path))
+
+        # Tickets first, then a second pass for replies, so every parent exists
+        # whatever order the archive is in
+        started = time.perf_counter()
+        self.stats = {'messages': 0, 'replies': 0, 'skipped': 0, 'orphaned': 0}
+        for chunk in self.chunks(record for record in read() if record['parent_ids'] is None):
+            self.import_messages(chunk)
+        for chunk in self.chunks(record for record in read() if record['parent_ids'] is not None):
+            self.import_replies(chunk, mark_replied=input_format != 'csv')
+
+        # bulk_create skips the signals that maintain these
+        if self.stats['messages'] or self.stats['replies']:
+            get_search_backend().rebuild()
+            counters.reconcile()
+
+        elapsed = time.perf_counter() - started
+        imported = self.stats['messages'] + self.stats['replies']
+        self.stdout.write(
+            f"Imported {self.stats['messages']} messages and {self.stats['replies']} replies "
+            f"in {elapsed:.1f}s ({imported / max(elapsed, 1e-9):.0f} rows/sec); "
+            f"{self.stats['skipped']} already imported, {self.stats['orphaned']} replies without a ticket."
+        )
+
+    @staticmethod
+    def guess_format(path):
+        if os.path.isdir(path):
+            return 'maildir'
+        if path.lower().endswith('.csv'):
+            return 'csv'
+        return 'mbox'
+
+    def chunks(self, records):
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def read_csv(self, path):
+        base_dir = os.path.dirname(os.path.abspath(path))
+        name = os.path.basename(path)
+        with open(path, newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                row = {key.strip(): (value or '').strip() for key, value in row.items() if key}
+                timestamp = parse_datetime(row.get('timestamp', '')) if row.get('timestamp') else None
+                if timestamp is not None and timezone.is_naive(timestamp):
+                    timestamp = timezone.make_aware(timestamp)
+                attachment = None
+                if row.get('attachment'):
+                    attachment = (os.path.basename(row['attachment']),
+                                  os.path.join(base_dir, row['attachment']))
+                yield {
+                    # Rows without an id are keyed by position, which is stable across runs
+                    'external_id': f"csv:{row['id']}" if row.get('id') else f'csv:{name}:{reader.line_num}',
+                    'parent_ids': [f"csv:{row['parent_id']}"] if row.get('parent_id') else None,
+                    'sender_name': row.get('sender_name', ''),
+                    'sender_email': row.get('sender_email', ''),
+                    'subject': row.get('subject', ''),
+                    'body': row.get('body', ''),
+                    'status': row.get('status') or 'new',
+                    'timestamp': timestamp or timezone.now(),
+                    'admin': row.get('admin', ''),
+                    'attachment': attachment,
+                }
+
+    def email_record(self, raw):
+        email = mailparse.parse_message(raw)
+        # Only emails sent by the helpdesk in reply to a ticket become replies;
+        # anything else, customer follow-ups included, is a ticket of its own
+        is_reply = email['references'] and email['sender_email'] in self.staff_addresses
+        return {
+            'external_id': email['message_id'],
+            'parent_ids': email['references'] if is_reply else None,
+            'sender_name': email['sender_name'],
+            'sender_email': email['sender_email'],
+            'subject': email['subject'],
+            'body': email['body'],
+            'status': 'new',
+            'timestamp': email['timestamp'],
+            'admin': email['sender_email'],
+            'attachment': email['attachments'][0] if email['attachments'] else None,
+        }
+
+    def new_records(self, model, chunk):
+        """Drop records imported by an earlier run, or repeated within the chunk"""
+        ids = {record['external_id'] for record in chunk}
+        seen = set(model.objects.filter(external_id__in=ids).values_list('external_id', flat=True))
+        records = []
+        for record in chunk:
+            if record['external_id'] in seen:
+                self.stats['skipped'] += 1
+                continue
+            seen.add(record['external_id'])
+            records.append(record)
+        return records
+
+    @staticmethod
+    def bulk_insert(model, rows):
+        """
+        bulk_create() the rows, skipping conflicts, and return how many were inserted
+
+        ignore_conflicts silently drops rows a concurrent run inserted after
+        new_records() checked, so the rows present are counted before and after.
+        """
+        if not rows:
+            return 0
+        present = model.objects.filter(external_id__in=[row.external_id for row in rows])
+        before = present.count()
+        model.objects.bulk_create(rows, ignore_conflicts=True)
+        return present.count() - before
+
+    def import_messages(self, chunk):
+        with transaction.atomic():
+            messages = []
+            for record in self.new_records(Message, chunk):
+                attachment, attachment_name = self.store_attachment(record['attachment'])
+                subject = record['subject'][:300]
+                messages.append(Message(
+                    external_id=record['external_id'],
+                    sender_name=record['sender_name'][:200],
+                    sender_email=record['sender_email'],
+                    subject=subject,
+                    message_body=record['body'],
+                    # Lets a resubmission through the contact form be merged into it
+                    fingerprint=message_fingerprint(record['sender_email'], subject, record['body']),
+                    body_preview=message_preview(record['body']),
+                    status=record['status'] if record['status'] in dict(Message.STATUS_CHOICES) else 'new',
+                    timestamp=record['timestamp'],
+                    last_activity_at=record['timestamp'],
+                    attachment=attachment,
+                    attachment_name=attachment_name,
+                    preview_status=previews.initial_status(attachment),
+                ))
+            inserted = self.bulk_insert(Message, messages)
+            live.notify()
+        self.stats['messages'] += inserted
+        self.stats['skipped'] += len(messages) - inserted
+        self.progress()
+
+    def import_replies(self, chunk, mark_replied):
+        with transaction.atomic():
+            records = self.new_records(Reply, chunk)
+            references = {reference for record in records for reference in record['parent_ids']}
+            parents = dict(
+                Message.objects.filter(external_id__in=references).values_list('external_id', 'id')
+            )
+
+            replies = []
+            for record in records:
+                # References run oldest first, so the thread's original ticket wins
+                parent_id = next((parents[ref] for ref in record['parent_ids'] if ref in parents), None)
+                if parent_id is None:
+                    self.stats['orphaned'] += 1
+                    continue
+                replies.append(Reply(
+                    external_id=record['external_id'],
+                    message_id=parent_id,
+                    admin_id=self.staff.get(record['admin']) or self.staff.get(record['admin'].lower()),
+                    reply_body=record['body'],
+                    timestamp=record['timestamp'],
+                ))
+            inserted = self.bulk_insert(Reply, replies)
+
+            touched = Message.objects.filter(id__in={reply.message_id for reply in replies})
+            threads.refresh(touched)
+            if mark_replied:
+                touched.exclude(status='replied').update(status='replied', updated_at=timezone.now())
+        self.stats['replies'] += inserted
+        self.stats['skipped'] += len(replies) - inserted
+        self.progress()
+
+    def store_attachment(self, attachment):
+        """Store an attachment and return (stored name, original filename), or (None, '')"""
+        if attachment is None:
+            return None, ''
+        filename, source = attachment
+        try:
+            filename = get_valid_filename(os.path.basename(filename))
+        except SuspiciousFileOperation:
+            filename = 'attachment'
+        if isinstance(source, bytes):
+            return attachment_storage.save(f'attachments/{filename}', ContentFile(source)), filename
+        if not os.path.isfile(source):
+            self.stderr.write(f'Attachment not found, skipped: {source}')
+            return None, ''
+        with open(source, 'rb') as f:
+            return attachment_storage.save(f'attachments/{filename}', File(f)), filename
+
+    def progress(self):
+        if self.verbosity >= 2:
+            self.stdout.write(
+                f"{self.stats['messages']} messages, {self.stats['replies']} replies, "
+                f"{self.stats['skipped']} skipped"
+            )
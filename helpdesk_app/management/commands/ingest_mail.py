@@ -0,0 +1,71 @@
+"""
+Worker that turns inbound customer email into tickets and replies
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from helpdesk_app import inbound
+
+
+class Command(BaseCommand):
+    help = (
+        'Ingest customer email from a maildir, an mbox file or the INBOUND_IMAP_* mailbox in batches. '
+        'Answers to helpdesk replies are threaded onto their tickets; everything else opens a ticket.'
+    )
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument('--maildir', help='Maildir to read new/ from; ingested mail moves to cur/')
+        source.add_argument('--mbox', help='mbox file to read (left unchanged)')
+        source.add_argument('--imap', action='store_true', help='Read unseen mail from INBOUND_IMAP_HOST')
+        parser.add_argument('--batch-size', type=int, default=settings.INBOUND_MAIL_BATCH_SIZE,
+                            help='Emails stored per transaction')
+        parser.add_argument('--watch', action='store_true', help='Keep polling the mailbox for new mail')
+        parser.add_argument('--poll-interval', type=float, default=settings.INBOUND_MAIL_POLL_INTERVAL,
+                            help='Seconds between polls with --watch')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        source = self.get_source(options)
+
+        try:
+            while True:
+                close_old_connections()
+                started = time.perf_counter()
+                stats = inbound.ingest(source, options['batch_size'])
+                elapsed = time.perf_counter() - started
+                stored = stats['messages'] + stats['replies']
+                if stored or not options['watch']:
+                    self.stdout.write(
+                        f"Ingested {stats['messages']} messages and {stats['replies']} replies "
+                        f"in {elapsed:.1f}s ({stored / max(elapsed, 1e-9):.0f} emails/sec); "
+                        f"{stats['skipped']} already stored, {stats['ignored']} ignored."
+                    )
+                if not options['watch']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('Mail ingestion stopped.')
+        finally:
+            source.close()
+
+    @staticmethod
+    def get_source(options):
+        if options['maildir']:
+            return inbound.MaildirSource(options['maildir'])
+        if options['mbox']:
+            return inbound.MboxSource(options['mbox'])
+        if not settings.INBOUND_IMAP_HOST:
+            raise CommandError('Set INBOUND_IMAP_HOST (and INBOUND_IMAP_USER/PASSWORD) to read from IMAP')
+        return inbound.IMAPSource(
+            settings.INBOUND_IMAP_HOST,
+            settings.INBOUND_IMAP_USER,
+            settings.INBOUND_IMAP_PASSWORD,
+            folder=settings.INBOUND_IMAP_FOLDER,
+            port=settings.INBOUND_IMAP_PORT,
+            use_ssl=settings.INBOUND_IMAP_SSL,
+        )
@@ -0,0 +1,85 @@
+"""
+Move attachments stored under their upload names into content-addressed storage
+"""
+import os
+
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from helpdesk_app import previews, storage
+from helpdesk_app.models import ArchivedMessage, ArchivedReply, Message, Reply
+
+
+class Command(BaseCommand):
+    help = (
+        'Rename attachments saved before content-addressed storage to the hash of their content, '
+        'storing identical files once, then delete the old files. Safe to interrupt and re-run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows read per query')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        self.moved = {}  # old name -> stored name
+        self.stats = {'attachments': 0, 'missing': 0}
+        for model in (Message, Reply, ArchivedMessage, ArchivedReply):
+            self.migrate(model, options['batch_size'])
+
+        # Only once every row using them points at the stored copy
+        for name in self.moved:
+            storage.attachment_storage.delete(name)
+            if previews.preview_kind(name):
+                storage.attachment_storage.delete(previews.preview_name(name))
+
+        self.stdout.write(
+            f"Moved {self.stats['attachments']} attachments into {len(set(self.moved.values()))} stored files; "
+            f"{self.stats['missing']} files were missing."
+        )
+
+    def migrate(self, model, batch_size):
+        last_id = 0
+        while True:
+            rows = list(
+                model.objects.filter(pk__gt=last_id).exclude(attachment='').exclude(attachment__isnull=True)
+                .order_by('pk').values_list('pk', 'attachment', 'attachment_name')[:batch_size]
+            )
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            for pk, name, filename in rows:
+                if not storage.is_blob_name(name):
+                    self.migrate_row(model, pk, name, filename)
+
+    def migrate_row(self, model, pk, name, filename):
+        with transaction.atomic():
+            stored = self.moved.get(name)
+            if stored is not None:
+                storage.retain([stored])
+            else:
+                try:
+                    with storage.attachment_storage.open(name, 'rb') as source:
+                        stored = storage.attachment_storage.save(name, File(source))
+                except FileNotFoundError:
+                    self.stderr.write(f'Attachment not found, left as is: {name}')
+                    self.stats['missing'] += 1
+                    return
+                self.moved[name] = stored
+                self.move_preview(name, stored)
+
+            model.objects.filter(pk=pk, attachment=name).update(
+                attachment=stored, attachment_name=filename or os.path.basename(name),
+            )
+        self.stats['attachments'] += 1
+
+    def move_preview(self, name, stored):
+        """Keep a rendered preview, which belongs next to the stored file now"""
+        if not previews.preview_kind(name):
+            return
+        old, new = previews.preview_name(name), previews.preview_name(stored)
+        files = storage.attachment_storage
+        if files.exists(old) and not files.exists(new):
+            os.replace(files.path(old), files.path(new))
@@ -0,0 +1,63 @@
+"""
+Background worker that renders attachment thumbnails and excerpts
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from helpdesk_app import previews
+
+
+class Command(BaseCommand):
+    help = 'Render pending attachment previews in a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.ATTACHMENT_PREVIEW_WORKERS,
+            help='Number of processes decoding images',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.ATTACHMENT_PREVIEW_BATCH_SIZE,
+            help='Number of attachments rendered per batch',
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=settings.ATTACHMENT_PREVIEW_POLL_INTERVAL,
+            help='Seconds to sleep when nothing is pending',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Render the currently pending previews and exit',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        executor = ProcessPoolExecutor(max_workers=options['workers'])
+
+        try:
+            while True:
+                close_old_connections()
+                try:
+                    result = previews.process_pending(executor, batch_size)
+                except BrokenProcessPool:
+                    # A process died (e.g. killed for memory); its batch is marked failed
+                    executor.shutdown(cancel_futures=True)
+                    executor = ProcessPoolExecutor(max_workers=options['workers'])
+                    continue
+                processed = sum(result.values())
+
+                if processed:
+                    self.stdout.write(f"ready={result['ready']} failed={result['failed']}")
+
+                # A full batch means more may be waiting; otherwise idle
+                if processed < batch_size:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('Preview worker stopped.')
+        finally:
+            executor.shutdown(cancel_futures=True)
@@ -0,0 +1,50 @@
+"""
+Background worker that drains the email outbox
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from helpdesk_app.email_service import EmailService
+
+
+class Command(BaseCommand):
+    help = 'Send queued outbox emails in batches, retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.EMAIL_OUTBOX_BATCH_SIZE,
+            help='Number of emails claimed per batch',
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=settings.EMAIL_OUTBOX_POLL_INTERVAL,
+            help='Seconds to sleep when the outbox is empty',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Drain the currently due emails and exit',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        try:
+            while True:
+                close_old_connections()
+                result = EmailService.process_outbox(batch_size)
+                processed = sum(result.values())
+
+                if processed:
+                    self.stdout.write(
+                        f"sent={result['sent']} retried={result['retried']} dead={result['dead']}"
+                    )
+
+                # A full batch means more may be waiting; otherwise idle
+                if processed < batch_size:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('Outbox worker stopped.')
@@ -0,0 +1,15 @@
+"""
+Rebuild the inbox full-text search index from the database
+"""
+from django.core.management.base import BaseCommand
+
+from helpdesk_app.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the message search index (after bulk imports or restores)'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.rebuild()
+        self.stdout.write(f"Search index rebuilt using {type(backend).__name__}.")
@@ -0,0 +1,18 @@
+"""
+Repair drift in the materialized message counters
+"""
+from django.core.management.base import BaseCommand
+
+from helpdesk_app import counters
+
+
+class Command(BaseCommand):
+    help = 'Recompute the message counters from the messages table'
+
+    def handle(self, *args, **options):
+        drift = counters.reconcile()
+        if not drift:
+            self.stdout.write('Message counters are in sync.')
+            return
+        for name, delta in sorted(drift.items()):
+            self.stdout.write(f"{name}: corrected by {delta:+d}")
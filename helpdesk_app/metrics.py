@@ -0,0 +1,190 @@
+"""
+In-process request metrics, exposed in the Prometheus text format
+
+RequestMetricsMiddleware opens a RequestStats for each request; database
+queries, template rendering and email delivery add to it while the request
+runs, and the totals go into histograms labelled by the resolved view name.
+Every worker process keeps its own histograms, so a scraper sees one worker
+per scrape.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from bisect import bisect_left
+from collections import defaultdict
+import threading
+import time
+
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates, Template
+
+# Seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Queries per request
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+_current = ContextVar('helpdesk_request_stats', default=None)
+
+
+class RequestStats:
+    """What one request spent its time on"""
+
+    def __init__(self):
+        self.queries = []  # (sql, seconds)
+        self.template_seconds = 0.0
+        self.email_seconds = 0.0
+
+    @property
+    def query_seconds(self):
+        return sum(seconds for sql, seconds in self.queries)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with one series per label value, safe across threads"""
+
+    def __init__(self, name, documentation, buckets, label='view'):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.label = label
+        self._lock = threading.Lock()
+        self._series = {}  # label value -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, label_value, value):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        with self._lock:
+            snapshot = {label: list(series) for label, series in self._series.items()}
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for label_value, series in sorted(snapshot.items()):
+            label = f'{self.label}="{_escape(label_value)}"'
+            cumulative = 0
+            for bound, count in zip([*self.buckets, '+Inf'], series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label}}} {series[-1]}')
+            lines.append(f'{self.name}_count{{{label}}} {cumulative}')
+        return '\n'.join(lines)
+
+
+REQUEST_SECONDS = Histogram(
+    'helpdesk_request_duration_seconds', 'Wall time to produce the response', DURATION_BUCKETS,
+)
+DB_QUERIES = Histogram(
+    'helpdesk_db_queries_per_request', 'Database queries run per request', QUERY_COUNT_BUCKETS,
+)
+DB_SECONDS = Histogram(
+    'helpdesk_db_duration_seconds', 'Time spent in database queries per request', DURATION_BUCKETS,
+)
+TEMPLATE_SECONDS = Histogram(
+    'helpdesk_template_render_seconds', 'Time spent rendering templates per request', DURATION_BUCKETS,
+)
+EMAIL_SECONDS = Histogram(
+    'helpdesk_email_send_seconds', 'Time spent sending email per request', DURATION_BUCKETS,
+)
+
+HISTOGRAMS = [REQUEST_SECONDS, DB_QUERIES, DB_SECONDS, TEMPLATE_SECONDS, EMAIL_SECONDS]
+
+
+@contextmanager
+def collect():
+    """Record everything inside the block into a new RequestStats"""
+    stats = RequestStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def observe_request(view_name, seconds, stats):
+    REQUEST_SECONDS.observe(view_name, seconds)
+    DB_QUERIES.observe(view_name, len(stats.queries))
+    DB_SECONDS.observe(view_name, stats.query_seconds)
+    TEMPLATE_SECONDS.observe(view_name, stats.template_seconds)
+    EMAIL_SECONDS.observe(view_name, stats.email_seconds)
+
+
+@contextmanager
+def timing_email():
+    """Count the block as email delivery time of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = _current.get()
+        if stats is not None:
+            stats.email_seconds += time.perf_counter() - start
+
+
+def query_breakdown(stats, limit=5):
+    """
+    The statements a request spent most database time on
+
+    Returns:
+        List of (sql, executions, total seconds), slowest total first
+    """
+    totals = defaultdict(lambda: [0, 0.0])
+    for sql, seconds in stats.queries:
+        totals[sql][0] += 1
+        totals[sql][1] += seconds
+    ranked = sorted(totals.items(), key=lambda item: item[1][1], reverse=True)
+    return [(sql, count, seconds) for sql, (count, seconds) in ranked[:limit]]
+
+
+def render():
+    """All histograms in the Prometheus text exposition format"""
+    return '\n'.join(histogram.render() for histogram in HISTOGRAMS) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries.append((sql, time.perf_counter() - start))
+
+
+@receiver(connection_created)
+def _instrument_connection(sender, connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats = _current.get()
+            if stats is not None:
+                stats.template_seconds += time.perf_counter() - start
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """Django template backend that adds render time to the request metrics"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
@@ -1,11 +1,20 @@
 """
-Middleware for additional security and logging
+Middleware for additional security, metrics and logging
 """
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
 from django.utils.deprecation import MiddlewareMixin
+from whitenoise.middleware import WhiteNoiseMiddleware
+from . import metrics
+from .exports import aiter_stream
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+# One line per request; sampled by REQUEST_LOG_SAMPLE_RATE (see settings.LOGGING)
+request_logger = logging.getLogger('helpdesk_app.requests')
+
 
 class SecurityHeadersMiddleware(MiddlewareMixin):
     """Add security headers to all responses"""
@@ -32,9 +41,104 @@ class SecurityHeadersMiddleware(MiddlewareMixin):
         return response
 
 
-class RequestLoggingMiddleware(MiddlewareMixin):
-    """Log all incoming requests"""
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoiseMiddleware that runs natively under both WSGI and ASGI
+    
+    WhiteNoise 6.6 is sync-only, and a single sync-only middleware makes
+    Django run the whole chain, async views included, in a thread per request.
+    Under ASGI the file is handed to the server chunk by chunk as it is read.
+    """
+    
+    sync_capable = True
+    async_capable = True
+    
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+    
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+    
+    async def __acall__(self, request):
+        if self.autorefresh:
+            # Looks files up on disk
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            response = self.serve(static_file, request)
+            # WhiteNoise streams the file with a sync iterator, which Django
+            # would read to the end in a thread before sending anything
+            response.streaming_content = aiter_stream(response.streaming_content)
+            return response
+        return await self.get_response(request)
+
+
+class RequestMetricsMiddleware:
+    """
+    Record wall, database, template and email time per request
+    
+    Totals are aggregated per resolved view name into the histograms served
+    at /metrics, and written to the request log. Requests slower than
+    SLOW_REQUEST_THRESHOLD_MS are also logged as warnings, with the statements
+    they spent most database time on.
+    """
     
-    def process_request(self, request):
-        logger.info(f"{request.method} {request.path} from {request.META.get('REMOTE_ADDR')}")
-        return None
+    sync_capable = True
+    async_capable = True
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+    
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with metrics.collect() as stats:
+            start = time.perf_counter()
+            response = self.get_response(request)
+            self.record(request, response, time.perf_counter() - start, stats)
+        return response
+    
+    async def __acall__(self, request):
+        with metrics.collect() as stats:
+            start = time.perf_counter()
+            response = await self.get_response(request)
+            self.record(request, response, time.perf_counter() - start, stats)
+        return response
+    
+    def record(self, request, response, seconds, stats):
+        match = request.resolver_match
+        view_name = match.view_name if match else 'unresolved'
+        metrics.observe_request(view_name, seconds, stats)
+        
+        fields = {
+            'method': request.method,
+            'path': request.path,
+            'view': view_name,
+            'status': response.status_code,
+            'remote_addr': request.META.get('REMOTE_ADDR'),
+            'duration_ms': round(seconds * 1000, 1),
+            'queries': len(stats.queries),
+            'db_ms': round(stats.query_seconds * 1000, 1),
+            'template_ms': round(stats.template_seconds * 1000, 1),
+            'email_ms': round(stats.email_seconds * 1000, 1),
+        }
+        request_logger.info("%s %s %s", request.method, request.path, response.status_code, extra=fields)
+        
+        if seconds * 1000 >= settings.SLOW_REQUEST_THRESHOLD_MS:
+            fields['slow_queries'] = [
+                {'sql': sql[:300], 'count': count, 'total_ms': round(total * 1000, 1)}
+                for sql, count, total in metrics.query_breakdown(stats)
+            ]
+            logger.warning(
+                "Slow request: %s %s (%s) took %.0fms",
+                request.method, request.path, view_name, seconds * 1000, extra=fields,
+            )
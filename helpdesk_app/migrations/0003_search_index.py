@@ -0,0 +1,56 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute(
+                    "CREATE VIRTUAL TABLE helpdesk_app_message_fts USING fts5("
+                    "sender_name, sender_email, subject, message_body, replies, "
+                    "tokenize='unicode61')"
+                )
+            except OperationalError:
+                # SQLite built without FTS5; the in-process index is used instead
+                return
+            cursor.execute(
+                "INSERT INTO helpdesk_app_message_fts "
+                "(rowid, sender_name, sender_email, subject, message_body, replies) "
+                "SELECT m.id, m.sender_name, m.sender_email, m.subject, m.message_body, "
+                "COALESCE((SELECT group_concat(r.reply_body, ' ') FROM helpdesk_app_reply r "
+                "WHERE r.message_id = m.id), '') "
+                "FROM helpdesk_app_message m"
+            )
+    
+    elif connection.vendor == 'mysql':
+        schema_editor.execute(
+            "ALTER TABLE helpdesk_app_message ADD FULLTEXT INDEX helpdesk_message_fulltext "
+            "(sender_name, sender_email, subject, message_body)"
+        )
+        schema_editor.execute(
+            "ALTER TABLE helpdesk_app_reply ADD FULLTEXT INDEX helpdesk_reply_fulltext (reply_body)"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    
+    if connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS helpdesk_app_message_fts")
+    elif connection.vendor == 'mysql':
+        schema_editor.execute("ALTER TABLE helpdesk_app_message DROP INDEX helpdesk_message_fulltext")
+        schema_editor.execute("ALTER TABLE helpdesk_app_reply DROP INDEX helpdesk_reply_fulltext")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helpdesk_app', '0002_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
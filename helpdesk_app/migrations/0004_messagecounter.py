@@ -0,0 +1,37 @@
+# Generated by Django 5.0.1 on 2026-10-18 19:21
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def seed_counters(apps, schema_editor):
+    Message = apps.get_model('helpdesk_app', 'Message')
+    MessageCounter = apps.get_model('helpdesk_app', 'MessageCounter')
+    
+    counts = {'total': 0, 'status:new': 0, 'status:replied': 0}
+    for row in Message.objects.values('status').annotate(count=Count('id')).order_by():
+        counts[f"status:{row['status']}"] = row['count']
+        counts['total'] += row['count']
+    
+    MessageCounter.objects.bulk_create([
+        MessageCounter(name=name, value=value) for name, value in counts.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helpdesk_app', '0003_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
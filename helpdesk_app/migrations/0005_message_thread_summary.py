@@ -0,0 +1,60 @@
+# Generated by Django 5.0.1 on 2026-10-18 19:27
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_thread_summary(apps, schema_editor):
+    Message = apps.get_model('helpdesk_app', 'Message')
+    Reply = apps.get_model('helpdesk_app', 'Reply')
+    
+    replies = Reply.objects.filter(message=OuterRef('pk')).order_by()
+    latest = replies.order_by('-timestamp', '-id')
+    reply_count = replies.values('message').annotate(count=Count('id')).values('count')
+    
+    Message.objects.update(
+        reply_count=Coalesce(Subquery(reply_count[:1]), 0),
+        last_reply_at=Subquery(latest.values('timestamp')[:1]),
+        last_responder=Subquery(latest.values('admin')[:1]),
+        last_activity_at=Coalesce(Subquery(latest.values('timestamp')[:1]), F('timestamp')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helpdesk_app', '0004_messagecounter'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='last_reply_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='last_responder',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['-last_activity_at'], name='helpdesk_ap_last_ac_42ac18_idx'),
+        ),
+        migrations.RunPython(backfill_thread_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.1 on 2026-10-18 19:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helpdesk_app', '0005_message_thread_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='external_id',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='reply',
+            name='external_id',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.0.1 on 2026-10-18 19:42
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_search_index(apps, schema_editor):
+    # SQLite shares the message FTS table: archived rows keep their message ids
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute(
+            "ALTER TABLE helpdesk_app_archivedmessage ADD FULLTEXT INDEX helpdesk_archivedmessage_fulltext "
+            "(sender_name, sender_email, subject, body)"
+        )
+        schema_editor.execute(
+            "ALTER TABLE helpdesk_app_archivedreply ADD FULLTEXT INDEX helpdesk_archivedreply_fulltext (body)"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helpdesk_app', '0006_external_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('sender_name', models.CharField(max_length=200)),
+                ('sender_email', models.EmailField(max_length=254)),
+                ('subject', models.CharField(max_length=300)),
+                ('body', models.TextField(blank=True)),
+                ('body_compressed', models.BinaryField(blank=True, null=True)),
+                ('timestamp', models.DateTimeField()),
+                ('status', models.CharField(choices=[('new', 'New'), ('replied', 'Replied')], default='replied', max_length=20)),
+                ('attachment', models.FileField(blank=True, null=True, upload_to='attachments/')),
+                ('reply_count', models.PositiveIntegerField(default=0)),
+                ('last_reply_at', models.DateTimeField(blank=True, null=True)),
+                ('last_activity_at', models.DateTimeField()),
+                ('external_id', models.CharField(blank=True, max_length=255, null=True, unique=True)),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_responder', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-timestamp'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedReply',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('body', models.TextField(blank=True)),
+                ('body_compressed', models.BinaryField(blank=True, null=True)),
+                ('timestamp', models.DateTimeField()),
+                ('external_id', models.CharField(blank=True, max_length=255, null=True, unique=True)),
+                ('admin', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='helpdesk_app.archivedmessage')),
+            ],
+            options={
+                'verbose_name_plural': 'Archived replies',
+                'ordering': ['-timestamp'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivedmessage',
+            index=models.Index(fields=['-timestamp'], name='helpdesk_ap_timesta_4180f0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedmessage',
+            index=models.Index(fields=['sender_email'], name='helpdesk_ap_sender__163346_idx'),
+        ),
+        migrations.RunPython(create_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.0.1 on 2026-10-18 19:57
+
+from django.db import migrations, models
+from django.db.models.functions import Substr
+
+from helpdesk_app.models import PREVIEW_SCAN_LENGTH, message_preview
+
+BACKFILL_CHUNK_SIZE = 1000
+
+
+def backfill_body_preview(apps, schema_editor):
+    Message = apps.get_model('helpdesk_app', 'Message')
+
+    last_id = 0
+    while True:
+        # One character past the scanned prefix tells message_preview the body goes on
+        chunk = list(
+            Message.objects.filter(id__gt=last_id).order_by('id')
+            .annotate(head=Substr('message_body', 1, PREVIEW_SCAN_LENGTH + 1))
+            .values_list('id', 'head')[:BACKFILL_CHUNK_SIZE]
+        )
+        if not chunk:
+            return
+        Message.objects.bulk_update(
+            [Message(id=pk, body_preview=message_preview(head or '')) for pk, head in chunk],
+            ['body_preview'],
+        )
+        last_id = chunk[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helpdesk_app', '0007_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='body_preview',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.RunPython(backfill_body_preview, migrations.RunPython.noop),
+    ]
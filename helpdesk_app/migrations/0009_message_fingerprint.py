@@ -0,0 +1,27 @@
+# Generated by Django 5.0.1 on 2026-10-18 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helpdesk_app', '0008_message_body_preview'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='duplicate_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['fingerprint', '-timestamp'], name='helpdesk_ap_fingerp_a1c5b7_idx'),
+        ),
+    ]
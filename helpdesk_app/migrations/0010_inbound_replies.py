@@ -0,0 +1,33 @@
+# Generated by Django 5.0.1 on 2026-10-18 20:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helpdesk_app', '0009_message_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedreply',
+            name='attachment',
+            field=models.FileField(blank=True, null=True, upload_to='attachments/'),
+        ),
+        migrations.AddField(
+            model_name='archivedreply',
+            name='is_inbound',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='reply',
+            name='attachment',
+            field=models.FileField(blank=True, null=True, upload_to='attachments/'),
+        ),
+        migrations.AddField(
+            model_name='reply',
+            name='is_inbound',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.1 on 2026-10-18 20:15
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_updated_at(apps, schema_editor):
+    Message = apps.get_model('helpdesk_app', 'Message')
+    Message.objects.update(updated_at=F('last_activity_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helpdesk_app', '0010_inbound_replies'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['updated_at'], name='helpdesk_ap_updated_74b25a_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.1 on 2026-10-18 20:21
+
+from django.conf import settings
+from django.db import migrations, models
+
+from helpdesk_app.previews import IMAGE_EXTENSIONS, TEXT_EXTENSIONS
+
+
+def queue_existing_attachments(apps, schema_editor):
+    Message = apps.get_model('helpdesk_app', 'Message')
+
+    previewable = models.Q()
+    for extension in IMAGE_EXTENSIONS | TEXT_EXTENSIONS:
+        previewable |= models.Q(attachment__iendswith=extension)
+    Message.objects.filter(previewable).update(preview_status='pending')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helpdesk_app', '0011_message_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedmessage',
+            name='preview_status',
+            field=models.CharField(blank=True, choices=[('', 'None'), ('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='preview_status',
+            field=models.CharField(blank=True, choices=[('', 'None'), ('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('preview_status', 'pending')), fields=['id'], name='message_preview_pending_idx'),
+        ),
+        migrations.RunPython(queue_existing_attachments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.0.1 on 2026-10-18 20:27
+
+import django.utils.timezone
+import helpdesk_app.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helpdesk_app', '0012_attachment_previews'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedmessage',
+            name='attachment_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='archivedreply',
+            name='attachment_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='attachment_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='reply',
+            name='attachment_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='archivedmessage',
+            name='attachment',
+            field=models.FileField(blank=True, null=True, storage=helpdesk_app.storage.get_attachment_storage, upload_to='attachments/'),
+        ),
+        migrations.AlterField(
+            model_name='archivedreply',
+            name='attachment',
+            field=models.FileField(blank=True, null=True, storage=helpdesk_app.storage.get_attachment_storage, upload_to='attachments/'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='attachment',
+            field=models.FileField(blank=True, null=True, storage=helpdesk_app.storage.get_attachment_storage, upload_to='attachments/'),
+        ),
+        migrations.AlterField(
+            model_name='reply',
+            name='attachment',
+            field=models.FileField(blank=True, null=True, storage=helpdesk_app.storage.get_attachment_storage, upload_to='attachments/'),
+        ),
+        migrations.CreateModel(
+            name='StoredBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('ref_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('released_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('ref_count__lte', 0)), fields=['name'], name='storedblob_unused_idx')],
+            },
+        ),
+    ]
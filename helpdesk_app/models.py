@@ -1,6 +1,99 @@
-from django.db import models
+from django.db import models, transaction
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.utils import timezone
+from django.utils.text import Truncator
+import hashlib
+import os
+import time
+import uuid
+import zlib
+
+from .previews import initial_status
+from .storage import get_attachment_storage, release as release_attachments
+
+# Inbox snippet: the first words of the body, capped in characters
+PREVIEW_WORDS = 15
+PREVIEW_MAX_LENGTH = 255
+
+# Only this much of the body is looked at, however long it is
+PREVIEW_SCAN_LENGTH = 1000
+
+
+def message_preview(text):
+    """Short plain-text snippet of a message body, as shown in the inbox"""
+    preview = Truncator(text[:PREVIEW_SCAN_LENGTH]).words(PREVIEW_WORDS)
+    if len(text) > PREVIEW_SCAN_LENGTH and not preview.endswith('…'):
+        preview += '…'
+    return Truncator(preview).chars(PREVIEW_MAX_LENGTH)
+
+
+def message_fingerprint(sender_email, subject, body):
+    """
+    Hash identifying a submission regardless of case and whitespace
+    
+    Two contact-form posts with the same fingerprint are the same message
+    sent twice (see dedup.py).
+    """
+    normalized = '\x00'.join(
+        ' '.join(value.split()).casefold() for value in (sender_email, subject, body)
+    )
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def attachment_filename(attachment, current=''):
+    """
+    Original filename of an attachment field's file
+    
+    Stored files are named after their content (see storage.py), so the
+    uploaded file's own name is kept next to it; `current` is kept unless a
+    new file is being uploaded.
+    """
+    if not attachment:
+        return ''
+    if not attachment._committed:
+        return os.path.basename(attachment.name)
+    return current
+
+
+class MessageQuerySet(models.QuerySet):
+    def set_status(self, status):
+        """
+        Change the status of every message in the queryset with one UPDATE
+        
+        Keeps the message counters and live inboxes in step, which a plain
+        update() would not.
+        
+        Returns:
+            Number of messages whose status changed
+        """
+        from . import counters, live
+        
+        with transaction.atomic():
+            # Lock the rows so the counter deltas match what the UPDATE changes
+            locked = list(self.exclude(status=status).select_for_update().values_list('id', 'status'))
+            if not locked:
+                return 0
+            updated = Message.objects.filter(id__in=[pk for pk, old in locked]).update(
+                status=status, updated_at=timezone.now(),
+            )
+            live.notify()
+            
+            previous = {}
+            for pk, old_status in locked:
+                previous[old_status] = previous.get(old_status, 0) + 1
+            for old_status, count in previous.items():
+                counters.status_changed(old_status, status, count)
+        return updated
+
+
+PREVIEW_STATUS_CHOICES = [
+    ('', 'None'),
+    ('pending', 'Pending'),
+    ('ready', 'Ready'),
+    ('failed', 'Failed'),
+]
 
 
 class Message(models.Model):
@@ -14,9 +107,34 @@ class Message(models.Model):
     sender_email = models.EmailField()
     subject = models.CharField(max_length=300)
     message_body = models.TextField()
+    # Derived from message_body on save, so lists can leave the body unloaded
+    body_preview = models.CharField(max_length=PREVIEW_MAX_LENGTH, blank=True, default='')
     timestamp = models.DateTimeField(default=timezone.now)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='new')
-    attachment = models.FileField(upload_to='attachments/', blank=True, null=True)
+    attachment = models.FileField(upload_to='attachments/', storage=get_attachment_storage, blank=True, null=True)
+    attachment_name = models.CharField(max_length=255, blank=True, default='')
+    # Thumbnail or excerpt of the attachment, rendered in the background (see previews.py)
+    preview_status = models.CharField(max_length=10, choices=PREVIEW_STATUS_CHOICES, blank=True, default='')
+    
+    # Thread summary, maintained from Reply signals (see threads.py)
+    reply_count = models.PositiveIntegerField(default=0)
+    last_reply_at = models.DateTimeField(blank=True, null=True)
+    last_responder = models.ForeignKey(
+        User, on_delete=models.SET_NULL, blank=True, null=True, related_name='+'
+    )
+    last_activity_at = models.DateTimeField(default=timezone.now)
+    
+    # Last change of any kind, for live inbox updates (see live.py)
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    # Content hash of sender, subject and body, and how often it was resubmitted (see dedup.py)
+    fingerprint = models.CharField(max_length=64, blank=True, default='')
+    duplicate_count = models.PositiveIntegerField(default=0)
+    
+    # Id in the system the ticket was imported from (e.g. its Message-ID)
+    external_id = models.CharField(max_length=255, unique=True, blank=True, null=True)
+    
+    objects = MessageQuerySet.as_manager()
     
     class Meta:
         ordering = ['-timestamp']
@@ -24,18 +142,72 @@ class Message(models.Model):
             models.Index(fields=['-timestamp']),
             models.Index(fields=['status']),
             models.Index(fields=['sender_email']),
+            models.Index(fields=['-last_activity_at']),
+            models.Index(fields=['fingerprint', '-timestamp']),
+            models.Index(fields=['updated_at']),
+            models.Index(
+                fields=['id'], condition=models.Q(preview_status='pending'), name='message_preview_pending_idx',
+            ),
         ]
     
     def __str__(self):
         return f"{self.sender_name} - {self.subject}"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored status so status changes can be detected on save
+        if 'status' in field_names:
+            instance._loaded_status = instance.status
+        if 'attachment' in field_names:
+            instance._loaded_attachment = instance.attachment.name
+        return instance
+    
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.last_reply_at is None:
+            self.last_activity_at = self.timestamp
+        if not self.get_deferred_fields() & {'sender_email', 'subject', 'message_body'}:
+            self.body_preview = message_preview(self.message_body)
+            self.fingerprint = message_fingerprint(self.sender_email, self.subject, self.message_body)
+        update_fields = kwargs.get('update_fields')
+        replaced = None
+        # A new attachment waits for the preview worker
+        if (
+            'attachment' not in self.get_deferred_fields()
+            and self.attachment.name != getattr(self, '_loaded_attachment', None)
+            and (update_fields is None or 'attachment' in update_fields)
+        ):
+            replaced = getattr(self, '_loaded_attachment', None)
+            self.attachment_name = attachment_filename(self.attachment, self.attachment_name)
+            self.preview_status = initial_status(self.attachment.name)
+            if update_fields is not None:
+                update_fields = {*update_fields, 'attachment_name', 'preview_status'}
+        self.updated_at = timezone.now()
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'updated_at'}
+        # post_save handlers update counters in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if replaced:
+                release_attachments([replaced])
+        self._loaded_attachment = self.attachment.name
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
 
 
 class Reply(models.Model):
-    """Model for admin replies to customer messages"""
+    """Model for admin replies to customer messages, and customers' emailed follow-ups"""
     message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='replies')
     admin = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     reply_body = models.TextField()
     timestamp = models.DateTimeField(default=timezone.now)
+    # Sent by the customer and received by mail (see inbound.py); admin is then empty
+    is_inbound = models.BooleanField(default=False)
+    attachment = models.FileField(upload_to='attachments/', storage=get_attachment_storage, blank=True, null=True)
+    attachment_name = models.CharField(max_length=255, blank=True, default='')
+    external_id = models.CharField(max_length=255, unique=True, blank=True, null=True)
     
     class Meta:
         ordering = ['-timestamp']
@@ -43,16 +215,39 @@ class Reply(models.Model):
     
     def __str__(self):
         return f"Reply to {self.message.subject}"
+    
+    def save(self, *args, **kwargs):
+        self.attachment_name = attachment_filename(self.attachment, self.attachment_name)
+        # post_save handlers update the message's thread summary in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
 
 
 class SystemSettings(models.Model):
-    """Model for system configuration"""
+    """
+    Model for system configuration
+    
+    load() keeps the singleton in memory per process. Every save bumps a
+    version key in the shared cache; workers re-check that key at most every
+    SYSTEM_SETTINGS_CACHE_TTL seconds and only reload from the database when
+    it changed. Writes that bypass save() (e.g. QuerySet.update) must call
+    invalidate_cache() themselves.
+    """
+    VERSION_CACHE_KEY = 'helpdesk:system_settings:version'
+    
     auto_response_enabled = models.BooleanField(default=True)
     auto_response_message = models.TextField(
         default="Thank you for contacting us. We have received your message and will respond shortly."
     )
     admin_notification_enabled = models.BooleanField(default=True)
     
+    # (instance, version, monotonic time of the last version check)
+    _cached = None
+    
     class Meta:
         verbose_name = 'System Settings'
         verbose_name_plural = 'System Settings'
@@ -63,9 +258,163 @@ class SystemSettings(models.Model):
     def save(self, *args, **kwargs):
         # Ensure only one instance exists
         self.pk = 1
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            transaction.on_commit(SystemSettings.invalidate_cache)
+        SystemSettings._cached = None
     
     @classmethod
     def load(cls):
+        cached = cls._cached
+        now = time.monotonic()
+        if cached is not None and now - cached[2] < settings.SYSTEM_SETTINGS_CACHE_TTL:
+            return cached[0]
+        
+        # Cheap shared-cache lookup; only reload when another process saved
+        version = cache.get(cls.VERSION_CACHE_KEY)
+        if cached is not None and version is not None and version == cached[1]:
+            cls._cached = (cached[0], version, now)
+            return cached[0]
+        
+        if version is None:
+            cache.add(cls.VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+            version = cache.get(cls.VERSION_CACHE_KEY)
         obj, created = cls.objects.get_or_create(pk=1)
+        cls._cached = (obj, version, now)
         return obj
+    
+    @classmethod
+    def invalidate_cache(cls):
+        """Force every worker to reload the settings on its next version check"""
+        cache.set(cls.VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+        cls._cached = None
+
+
+class OutgoingEmail(models.Model):
+    """Model for queued outgoing emails, drained by the outbox worker"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('dead', 'Dead Letter'),
+    ]
+    
+    to_email = models.EmailField()
+    subject = models.CharField(max_length=500)
+    html_content = models.TextField()
+    attachment_path = models.CharField(max_length=500, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        verbose_name = 'Outgoing Email'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.to_email} - {self.subject}"
+
+
+class MessageCounter(models.Model):
+    """Materialized message counts, kept in sync by signals (see counters.py)"""
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
+class StoredBlob(models.Model):
+    """An attachment file stored by content hash, and how many attachments use it (see storage.py)"""
+    name = models.CharField(max_length=100, unique=True)
+    size = models.BigIntegerField()
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    # When the last use went away, for the garbage collector's grace period
+    released_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['name'], condition=models.Q(ref_count__lte=0), name='storedblob_unused_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} ({self.ref_count})"
+
+
+class ArchivedMessage(models.Model):
+    """
+    Replied message moved out of the hot table once it went quiet (see archive.py)
+    
+    Keeps the original id, so links and search index entries stay valid.
+    The body is stored in `body`, or zlib-compressed in `body_compressed`.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    sender_name = models.CharField(max_length=200)
+    sender_email = models.EmailField()
+    subject = models.CharField(max_length=300)
+    body = models.TextField(blank=True)
+    body_compressed = models.BinaryField(blank=True, null=True)
+    timestamp = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=Message.STATUS_CHOICES, default='replied')
+    attachment = models.FileField(upload_to='attachments/', storage=get_attachment_storage, blank=True, null=True)
+    attachment_name = models.CharField(max_length=255, blank=True, default='')
+    preview_status = models.CharField(max_length=10, choices=PREVIEW_STATUS_CHOICES, blank=True, default='')
+    reply_count = models.PositiveIntegerField(default=0)
+    last_reply_at = models.DateTimeField(blank=True, null=True)
+    last_responder = models.ForeignKey(
+        User, on_delete=models.SET_NULL, blank=True, null=True, related_name='+'
+    )
+    last_activity_at = models.DateTimeField()
+    external_id = models.CharField(max_length=255, unique=True, blank=True, null=True)
+    archived_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['-timestamp']),
+            models.Index(fields=['sender_email']),
+        ]
+    
+    def __str__(self):
+        return f"{self.sender_name} - {self.subject}"
+    
+    @property
+    def message_body(self):
+        return _stored_text(self.body, self.body_compressed)
+
+
+class ArchivedReply(models.Model):
+    """Reply of an archived message, keeping its original id"""
+    id = models.BigIntegerField(primary_key=True)
+    message = models.ForeignKey(ArchivedMessage, on_delete=models.CASCADE, related_name='replies')
+    admin = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='+')
+    body = models.TextField(blank=True)
+    body_compressed = models.BinaryField(blank=True, null=True)
+    timestamp = models.DateTimeField()
+    is_inbound = models.BooleanField(default=False)
+    attachment = models.FileField(upload_to='attachments/', storage=get_attachment_storage, blank=True, null=True)
+    attachment_name = models.CharField(max_length=255, blank=True, default='')
+    external_id = models.CharField(max_length=255, unique=True, blank=True, null=True)
+    
+    class Meta:
+        ordering = ['-timestamp']
+        verbose_name_plural = 'Archived replies'
+    
+    def __str__(self):
+        return f"Reply to {self.message.subject}"
+    
+    @property
+    def reply_body(self):
+        return _stored_text(self.body, self.body_compressed)
+
+
+def _stored_text(text, compressed):
+    if compressed is not None:
+        return zlib.decompress(bytes(compressed)).decode('utf-8')
+    return text
@@ -0,0 +1,143 @@
+"""
+Cached, conditionally served public pages (home and the contact form)
+
+Anonymous visitors without a session all see the same page, so it is
+rendered once per release and kept in memory and in the shared cache.
+Responses carry an ETag (and Last-Modified where valid) and unchanged pages
+are answered with 304 Not Modified.
+
+The contact page holds a CSRF token, which differs per visitor: its shell is
+rendered with a placeholder that is swapped for the visitor's token on the
+way out. Its ETag includes the visitor's CSRF secret, so a browser never
+revalidates a page whose token no longer matches its cookie.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.test.signals import setting_changed
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+import functools
+import hashlib
+import os
+import time
+
+CSRF_PLACEHOLDER = 'PAGECACHECSRFTOKENPLACEHOLDER'
+
+# Pages rendered or fetched by this process, by cache key
+_pages = {}
+
+
+def is_cacheable(request):
+    """
+    True for a GET/HEAD without session or message cookies
+
+    Such a visitor is anonymous and has no flash messages waiting, which is
+    exactly what the cached pages show.
+    """
+    return (
+        request.method in ('GET', 'HEAD')
+        and settings.SESSION_COOKIE_NAME not in request.COOKIES
+        and CookieStorage.cookie_name not in request.COOKIES
+    )
+
+
+def serve(request, template_name, get_context=dict, csrf=False):
+    """
+    Response for a cacheable request, rendering the page on first use
+
+    Args:
+        request: Request that passed is_cacheable()
+        template_name: Template of the page
+        get_context: Returns the template context; only called to render
+        csrf: The page contains {% csrf_token %}
+    """
+    page = _pages.get(_key(template_name)) or _load(request, template_name, get_context, csrf)
+    return _respond(request, page, csrf)
+
+
+async def aserve(request, template_name, get_context=dict, csrf=False):
+    """serve() for async views; only a first render leaves the event loop"""
+    page = _pages.get(_key(template_name))
+    if page is None:
+        page = await sync_to_async(_load)(request, template_name, get_context, csrf)
+    return _respond(request, page, csrf)
+
+
+def clear():
+    """Forget the pages rendered by this process (the shared cache is keyed by release)"""
+    _pages.clear()
+
+
+@functools.lru_cache(maxsize=None)
+def _template_version():
+    # Without RELEASE_VERSION, any change to a template file counts as a new release
+    digest = hashlib.sha256()
+    for directory in settings.TEMPLATES[0]['DIRS']:
+        for root, dirs, files in sorted(os.walk(directory)):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                digest.update(f'{path}:{os.stat(path).st_mtime_ns}'.encode())
+    return digest.hexdigest()[:16]
+
+
+def _key(template_name):
+    return f'helpdesk:page:{settings.RELEASE_VERSION or _template_version()}:{template_name}'
+
+
+def _load(request, template_name, get_context, csrf):
+    key = _key(template_name)
+    page = cache.get(key)
+    if page is None:
+        context = get_context()
+        if csrf:
+            context['csrf_token'] = CSRF_PLACEHOLDER
+        content = render_to_string(template_name, context, request).encode()
+        page = {
+            'content': content,
+            'etag': hashlib.sha256(content).hexdigest()[:32],
+            'last_modified': time.time(),
+        }
+        cache.set(key, page, settings.PAGE_CACHE_TIMEOUT)
+    _pages[key] = page
+    return page
+
+
+def _respond(request, page, csrf):
+    content = page['content']
+    if csrf:
+        token = get_token(request)
+        # The ETag has to change whenever the token would; the cookie secret decides that
+        etag = quote_etag(hashlib.sha256(f"{page['etag']}:{request.META['CSRF_COOKIE']}".encode()).hexdigest()[:32])
+        last_modified = None
+    else:
+        etag = quote_etag(page['etag'])
+        last_modified = int(page['last_modified'])
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        if csrf:
+            content = content.replace(CSRF_PLACEHOLDER.encode(), token.encode())
+        response = HttpResponse(content)
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # Browsers revalidate every time; logged-in visitors get a different page
+    if csrf:
+        patch_cache_control(response, no_cache=True, private=True)
+    else:
+        patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ['Cookie'])
+    return response
+
+
+@receiver(setting_changed)
+def _reset_pages(setting, **kwargs):
+    if setting in ('RELEASE_VERSION', 'TEMPLATES', 'CACHES'):
+        _pages.clear()
+        _template_version.cache_clear()
@@ -0,0 +1,174 @@
+"""
+Keyset (cursor) pagination for message lists
+
+Pages are addressed by an opaque cursor holding the (timestamp, id) of the
+row at the page edge, so fetching any page is a single indexed range scan
+with LIMIT, no matter how deep it is, and no COUNT(*) is needed.
+"""
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+import base64
+import json
+
+
+def encode_cursor(value, pk, direction):
+    payload = json.dumps({'v': value.isoformat(), 'id': pk, 'd': direction})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (value, pk, direction), or None for a missing or malformed cursor"""
+    if not cursor:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        value = parse_datetime(payload['v'])
+        pk = int(payload['id'])
+        direction = payload['d']
+    except (ValueError, TypeError, KeyError):
+        return None
+    if value is None or direction not in ('next', 'prev'):
+        return None
+    return value, pk, direction
+
+
+def approximate_count(queryset):
+    """
+    Estimate the number of rows in a queryset
+
+    Unfiltered querysets use the table statistics kept by MySQL and
+    PostgreSQL, which are cheap but can be off by a few percent. Anything
+    else falls back to an exact COUNT(*).
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+
+    if not queryset.query.where:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'mysql':
+                cursor.execute(
+                    "SELECT TABLE_ROWS FROM information_schema.TABLES "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+                    [table],
+                )
+                row = cursor.fetchone()
+                if row and row[0] is not None:
+                    return row[0]
+            elif connection.vendor == 'postgresql':
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [table])
+                row = cursor.fetchone()
+                if row and row[0] >= 0:
+                    return row[0]
+
+    return queryset.count()
+
+
+class KeysetPage:
+    """One page of a KeysetPaginator, iterable like a Django Page"""
+
+    def __init__(self, object_list, paginator, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __repr__(self):
+        return f'<KeysetPage of {len(self)} objects>'
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset newest-first on (field, id)
+
+    Cursors point at the boundary row rather than a position, so rows
+    inserted while someone is paging never shift or duplicate later pages.
+    """
+
+    def __init__(self, queryset, per_page, field='timestamp'):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.field = field
+
+    def get_page(self, cursor=None):
+        position = decode_cursor(cursor)
+        rows = list(self._page_queryset(position))
+        if position is not None and not rows:
+            # The cursor points past either end (e.g. rows were deleted)
+            return self.get_page()
+        return self._build_page(rows, position)
+
+    async def aget_page(self, cursor=None):
+        """get_page for async views, fetching rows with the async ORM"""
+        position = decode_cursor(cursor)
+        rows = [row async for row in self._page_queryset(position)]
+        if position is not None and not rows:
+            return await self.aget_page()
+        return self._build_page(rows, position)
+
+    def _page_queryset(self, position):
+        """The page's rows plus one, to tell whether another page follows"""
+        field = self.field
+        if position is None:
+            return self.queryset.order_by(f'-{field}', '-id')[:self.per_page + 1]
+
+        value, pk, direction = position
+        if direction == 'next':
+            return (
+                self.queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': pk}))
+                .order_by(f'-{field}', '-id')[:self.per_page + 1]
+            )
+        # Walk backwards in ascending order; _build_page flips the page
+        return (
+            self.queryset.filter(Q(**{f'{field}__gt': value}) | Q(**{field: value, 'id__gt': pk}))
+            .order_by(field, 'id')[:self.per_page + 1]
+        )
+
+    def _build_page(self, rows, position):
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if position is None:
+            has_next, has_previous = more, False
+        elif position[2] == 'next':
+            has_next, has_previous = more, True
+        else:
+            has_next, has_previous = True, more
+            rows = rows[::-1]
+
+        field = self.field
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = encode_cursor(getattr(rows[-1], field), rows[-1].pk, 'next')
+        if rows and has_previous:
+            previous_cursor = encode_cursor(getattr(rows[0], field), rows[0].pk, 'prev')
+
+        return KeysetPage(rows, self, next_cursor, previous_cursor)
+
+    @cached_property
+    def approximate_total(self):
+        return approximate_count(self.queryset)
+
+
+class ApproximateCountPaginator(Paginator):
+    """Paginator that uses table statistics instead of COUNT(*) where it can"""
+
+    @cached_property
+    def count(self):
+        return approximate_count(self.object_list)
@@ -0,0 +1,219 @@
+"""
+Attachment previews
+
+Image attachments get a small JPEG thumbnail and text attachments an excerpt
+of their first page, stored next to the original (photo.png ->
+photo.png.thumb.jpg). Decoding an image costs far more CPU than serving a
+request, so none of it happens in the web process: a saved message is only
+marked 'pending', and the process_attachment_previews worker renders pending
+attachments in a pool of processes. The detail page then shows the stored
+thumbnail, or the excerpt from the cache.
+
+render() runs in the pool and only needs the attachment bytes, so the pool
+processes never touch Django or the database.
+"""
+from concurrent.futures.process import BrokenProcessPool
+from hashlib import sha1
+import io
+import logging
+import os
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+
+from .storage import attachment_storage
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'}
+TEXT_EXTENSIONS = {'.txt', '.csv', '.log'}
+
+# Thumbnails fit in this box
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_QUALITY = 80
+
+# Images over this many pixels are refused rather than decoded
+MAX_IMAGE_PIXELS = 50_000_000
+
+# Larger attachments are not previewed
+MAX_SOURCE_SIZE = 20 * 1024 * 1024
+
+# The "first page" of a text attachment
+EXCERPT_LINES = 40
+EXCERPT_CHARS = 3000
+
+EXCERPT_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def preview_kind(name):
+    """'image', 'text', or None if the attachment gets no preview"""
+    extension = os.path.splitext(name or '')[1].lower()
+    if extension in IMAGE_EXTENSIONS:
+        return 'image'
+    if extension in TEXT_EXTENSIONS:
+        return 'text'
+    return None
+
+
+def initial_status(name):
+    """preview_status of a newly stored attachment"""
+    return 'pending' if preview_kind(name) else ''
+
+
+def preview_name(name):
+    """Storage name of an attachment's preview, next to the attachment"""
+    return f"{name}.thumb.jpg" if preview_kind(name) == 'image' else f"{name}.preview.txt"
+
+
+def render(kind, content):
+    """
+    Render the preview of an attachment; runs in a pool process
+
+    Returns:
+        The preview file's bytes: a JPEG for images, UTF-8 text otherwise
+    """
+    if kind == 'image':
+        return _thumbnail(content)
+    return _excerpt(content).encode('utf-8')
+
+
+def describe(message):
+    """
+    The attachment preview shown on a message's detail page
+
+    Returns:
+        None without a preview, else a dict with the 'kind', the 'status'
+        and, for ready text previews, the 'excerpt'
+    """
+    kind = preview_kind(message.attachment.name)
+    if kind is None or not message.preview_status:
+        return None
+    preview = {'kind': kind, 'status': message.preview_status}
+    if kind == 'text' and message.preview_status == 'ready':
+        preview['excerpt'] = excerpt(message.attachment.name)
+    return preview
+
+
+def excerpt(name):
+    """Stored excerpt of a text attachment, through the cache"""
+    key = _excerpt_key(name)
+    text = cache.get(key)
+    if text is None:
+        try:
+            with attachment_storage.open(preview_name(name), 'rb') as preview:
+                text = preview.read().decode('utf-8')
+        except OSError:
+            return ''
+        cache.set(key, text, EXCERPT_CACHE_TIMEOUT)
+    return text
+
+
+def process_pending(executor, batch_size=None):
+    """
+    Render one batch of pending previews in the executor's processes
+
+    Args:
+        executor: concurrent.futures executor running render()
+        batch_size: Attachments per batch (default ATTACHMENT_PREVIEW_BATCH_SIZE)
+
+    Returns:
+        Dict with the number of 'ready' and 'failed' previews
+
+    Raises:
+        BrokenProcessPool: A pool process died; the batch is marked failed,
+            since the attachment that killed it can't be told apart
+    """
+    from .models import Message
+
+    batch_size = batch_size or settings.ATTACHMENT_PREVIEW_BATCH_SIZE
+    pending = list(
+        Message.objects.filter(preview_status='pending').order_by('id')
+        .values_list('id', 'attachment')[:batch_size]
+    )
+
+    # Everything is submitted first so the pool works on the batch in parallel
+    jobs = []
+    for pk, name in pending:
+        kind = preview_kind(name)
+        # Identical attachments share one stored file (see storage.py), and its preview
+        if attachment_storage.exists(preview_name(name)):
+            jobs.append((pk, name, kind, None))
+            continue
+        try:
+            content = _read_source(name, kind)
+            jobs.append((pk, name, kind, executor.submit(render, kind, content)))
+        except (OSError, ValueError) as e:
+            jobs.append((pk, name, kind, e))
+
+    result = {'ready': 0, 'failed': 0}
+    broken = None
+    for pk, name, kind, job in jobs:
+        try:
+            if isinstance(job, Exception):
+                raise job
+            if job is not None:
+                data = job.result()
+                _store(preview_name(name), data)
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                broken = e
+            status = 'failed'
+            logger.warning("Preview of %s (message %s) failed: %s", name, pk, e)
+        else:
+            status = 'ready'
+            if kind == 'text' and job is not None:
+                cache.set(_excerpt_key(name), data.decode('utf-8'), EXCERPT_CACHE_TIMEOUT)
+        # Unless the attachment was replaced meanwhile
+        Message.objects.filter(pk=pk, attachment=name, preview_status='pending').update(preview_status=status)
+        result[status] += 1
+    if broken is not None:
+        raise broken
+    return result
+
+
+def _read_source(name, kind):
+    with attachment_storage.open(name, 'rb') as source:
+        if kind == 'text':
+            # Enough bytes for the excerpt in any UTF-8 text
+            return source.read(EXCERPT_CHARS * 4)
+        content = source.read(MAX_SOURCE_SIZE + 1)
+    if len(content) > MAX_SOURCE_SIZE:
+        raise ValueError(f"larger than {MAX_SOURCE_SIZE} bytes")
+    return content
+
+
+def _store(name, data):
+    # Kept next to the attachment under its own name, not by content hash
+    attachment_storage.save_derived(name, ContentFile(data))
+
+
+def _excerpt_key(name):
+    return f"helpdesk:preview:{sha1(name.encode('utf-8')).hexdigest()}"
+
+
+def _thumbnail(content):
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(content)) as image:
+        # Only the header has been read so far
+        if image.width * image.height > MAX_IMAGE_PIXELS:
+            raise ValueError(f"{image.width}x{image.height} image is too large")
+        # JPEGs decode straight at a reduced scale, far cheaper than at full size
+        image.draft('RGB', (THUMBNAIL_SIZE[0] * 2, THUMBNAIL_SIZE[1] * 2))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(THUMBNAIL_SIZE)
+        if image.mode != 'RGB':
+            # Transparency becomes white rather than black
+            image = image.convert('RGBA')
+            flat = Image.new('RGB', image.size, 'white')
+            flat.paste(image, mask=image.getchannel('A'))
+            image = flat
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+    return output.getvalue()
+
+
+def _excerpt(content):
+    text = content.decode('utf-8', 'replace')
+    return '\n'.join(text.splitlines()[:EXCERPT_LINES])[:EXCERPT_CHARS]
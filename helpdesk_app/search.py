@@ -0,0 +1,407 @@
+"""
+Full-text search backends for the inbox
+
+Every backend filters a Message (or ArchivedMessage) queryset by a free-text
+query, matching all query words as prefixes across the sender, subject, body
+and reply text. Archived messages keep their ids, so they share the index.
+The backend is picked from HELPDESK_SEARCH_BACKEND, or from the database
+vendor when that setting is empty.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, FloatField, Q, When
+from django.db.models.expressions import RawSQL
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+from django.utils.module_loading import import_string
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from datetime import timedelta
+import functools
+import logging
+import math
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Rows fetched per query while (re)building an index
+INDEX_CHUNK_SIZE = 2000
+
+# The in-process index re-reads rows stamped this long before the last one it
+# saw, in case their transaction committed late (or another host's clock lags)
+CATCH_UP_OVERLAP = timedelta(seconds=5)
+
+
+def tokenize(text):
+    """Split text into lowercase word tokens"""
+    return [token.lower() for token in TOKEN_RE.findall(text or '')]
+
+
+def reply_text(message):
+    """All reply bodies of a message, live or archived, as one string"""
+    return ' '.join(reply.reply_body for reply in message.replies.all())
+
+
+def iter_archived_chunks(chunk_size=INDEX_CHUNK_SIZE):
+    """Yield archived messages, replies prefetched, in chunks of ascending id"""
+    from .models import ArchivedMessage
+
+    last_id = 0
+    while True:
+        chunk = list(
+            ArchivedMessage.objects.filter(id__gt=last_id).order_by('id')
+            .prefetch_related('replies')[:chunk_size]
+        )
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1].pk
+
+
+class BaseSearchBackend:
+    """Interface shared by all search backends"""
+
+    def filter(self, queryset, query, rank=False):
+        """
+        Restrict a Message queryset to rows matching every word of the query
+
+        Args:
+            queryset: Message or ArchivedMessage queryset to filter
+            query: Free-text search query; each word is matched as a prefix
+            rank: Order the results by relevance, best match first
+        """
+        raise NotImplementedError
+
+    def index_message(self, message, replies=True):
+        """
+        Add or refresh a message in the index
+
+        Args:
+            message: The message to index
+            replies: False when only the message itself changed, so the
+                reply text already indexed is kept rather than read again
+        """
+
+    def index_messages(self, messages):
+        """Refresh many messages, e.g. after bulk_create bypassed the signals"""
+        for message in messages:
+            self.index_message(message)
+
+    def remove_message(self, message_id):
+        """Drop a message from the index"""
+
+    def rebuild(self):
+        """Rebuild the whole index from the database"""
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    """SQLite FTS5 virtual table keyed by message id, ranked with bm25"""
+
+    table = 'helpdesk_app_message_fts'
+
+    def filter(self, queryset, query, rank=False):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset.none()
+
+        # Every word must match, each as a prefix
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        queryset = queryset.filter(
+            id__in=RawSQL(f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s", [match])
+        )
+        if rank:
+            outer_table = connection.ops.quote_name(queryset.model._meta.db_table)
+            queryset = queryset.annotate(search_rank=RawSQL(
+                f"SELECT -bm25({self.table}) FROM {self.table} "
+                f"WHERE {self.table} MATCH %s AND rowid = {outer_table}.id",
+                [match],
+                output_field=FloatField(),
+            )).order_by('-search_rank', '-timestamp')
+        return queryset
+
+    def index_message(self, message, replies=True):
+        if not replies:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {self.table} SET sender_name = %s, sender_email = %s, subject = %s, "
+                    f"message_body = %s WHERE rowid = %s",
+                    [message.sender_name, message.sender_email, message.subject,
+                     message.message_body, message.pk],
+                )
+                if cursor.rowcount:
+                    return
+        self.index_messages([message])
+
+    def index_messages(self, messages):
+        rows = [
+            (message.pk, message.sender_name, message.sender_email,
+             message.subject, message.message_body, reply_text(message))
+            for message in messages
+        ]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {self.table} WHERE rowid = %s", [row[:1] for row in rows])
+            cursor.executemany(
+                f"INSERT INTO {self.table} "
+                f"(rowid, sender_name, sender_email, subject, message_body, replies) "
+                f"VALUES (%s, %s, %s, %s, %s, %s)",
+                rows,
+            )
+
+    def remove_message(self, message_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid = %s", [message_id])
+
+    def rebuild(self):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+            cursor.execute(
+                f"INSERT INTO {self.table} "
+                f"(rowid, sender_name, sender_email, subject, message_body, replies) "
+                f"SELECT m.id, m.sender_name, m.sender_email, m.subject, m.message_body, "
+                f"COALESCE((SELECT group_concat(r.reply_body, ' ') FROM helpdesk_app_reply r "
+                f"WHERE r.message_id = m.id), '') "
+                f"FROM helpdesk_app_message m"
+            )
+            # Archived bodies may be compressed, so these go through Python
+            for chunk in iter_archived_chunks():
+                self.index_messages(chunk)
+
+
+class MySQLFullTextBackend(BaseSearchBackend):
+    """
+    InnoDB FULLTEXT indexes in boolean mode
+
+    MySQL maintains the indexes itself, so there is nothing to do on save.
+    Words shorter than innodb_ft_min_token_size are ignored by MySQL, and
+    so are compressed archive bodies.
+    """
+
+    # Indexed columns, and the reply table and column, per message table
+    message_columns = {
+        'helpdesk_app_message': ('sender_name', 'sender_email', 'subject', 'message_body'),
+        'helpdesk_app_archivedmessage': ('sender_name', 'sender_email', 'subject', 'body'),
+    }
+    reply_columns = {
+        'helpdesk_app_message': ('helpdesk_app_reply', 'reply_body'),
+        'helpdesk_app_archivedmessage': ('helpdesk_app_archivedreply', 'body'),
+    }
+
+    def filter(self, queryset, query, rank=False):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset.none()
+
+        against = ' '.join(f'+{token}*' for token in tokens)
+        qn = connection.ops.quote_name
+        db_table = queryset.model._meta.db_table
+        table = qn(db_table)
+        columns = ', '.join(f'{table}.{qn(column)}' for column in self.message_columns[db_table])
+        reply_table, reply_column = self.reply_columns[db_table]
+
+        match = f"MATCH ({columns}) AGAINST (%s IN BOOLEAN MODE)"
+
+        # Each branch is a lookup on its own FULLTEXT index; MATCH under an OR
+        # would scan the table. The derived table makes MySQL run the UNION
+        # once rather than as a dependent subquery per row.
+        queryset = queryset.filter(id__in=RawSQL(
+            f"SELECT id FROM ("
+            f"SELECT id FROM {table} WHERE {match} "
+            f"UNION SELECT message_id FROM {qn(reply_table)} "
+            f"WHERE MATCH ({qn(reply_column)}) AGAINST (%s IN BOOLEAN MODE)"
+            f") AS search_matches",
+            [against, against],
+        ))
+        if rank:
+            # Only computed for the matching rows; reply-only matches rank 0
+            queryset = queryset.annotate(
+                search_rank=RawSQL(match, [against], output_field=FloatField()),
+            ).order_by('-search_rank', '-timestamp')
+        return queryset
+
+
+class InvertedIndexBackend(BaseSearchBackend):
+    """
+    In-process inverted index, used when the database has no full-text support
+
+    The index is built on first use and kept up to date from model signals.
+    Messages added or changed by other processes (replies included, which
+    stamp their message) are picked up on the next search by re-reading the
+    rows whose updated_at is past the last one seen. Messages deleted
+    elsewhere stay in the index, which is harmless: search results are
+    filtered against the table.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = defaultdict(dict)  # token -> {message_id: term frequency}
+        self._documents = {}  # message_id -> set of tokens
+        self._reply_tokens = {}  # message_id -> Counter of the reply tokens
+        self._sorted_tokens = None
+        self._last_seen = None  # latest updated_at read from the table
+        self._built = False
+
+    def filter(self, queryset, query, rank=False):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset.none()
+
+        scores = self._search(tokens)
+        queryset = queryset.filter(id__in=list(scores))
+        if rank and scores:
+            queryset = queryset.annotate(search_rank=Case(
+                *[When(id=message_id, then=score) for message_id, score in scores.items()],
+                default=0.0,
+                output_field=FloatField(),
+            )).order_by('-search_rank', '-timestamp')
+        return queryset
+
+    def index_message(self, message, replies=True):
+        tokens = tokenize(self._message_text(message))
+        reply_tokens = None
+        if replies or message.pk not in self._reply_tokens:
+            reply_tokens = tokenize(reply_text(message))
+        # Only touch the shared index once the data is really there
+        transaction.on_commit(lambda: self._add(message.pk, tokens, reply_tokens))
+
+    def remove_message(self, message_id):
+        transaction.on_commit(lambda: self._remove(message_id))
+
+    def rebuild(self):
+        with self._lock:
+            self._postings.clear()
+            self._documents.clear()
+            self._reply_tokens.clear()
+            self._sorted_tokens = None
+            self._last_seen = None
+            self._built = True
+            for chunk in iter_archived_chunks():
+                for message in chunk:
+                    self._add_from_database(message)
+            self._catch_up()
+
+    def _search(self, tokens):
+        with self._lock:
+            if not self._built:
+                self.rebuild()
+            else:
+                self._catch_up()
+
+            if self._sorted_tokens is None:
+                self._sorted_tokens = sorted(self._postings)
+
+            total = max(len(self._documents), 1)
+            scores = None
+            for token in tokens:
+                # Union of every indexed word starting with this token
+                matches = defaultdict(float)
+                position = bisect_left(self._sorted_tokens, token)
+                while (position < len(self._sorted_tokens)
+                       and self._sorted_tokens[position].startswith(token)):
+                    postings = self._postings[self._sorted_tokens[position]]
+                    idf = math.log(1 + total / len(postings))
+                    for message_id, frequency in postings.items():
+                        matches[message_id] += frequency * idf
+                    position += 1
+
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {
+                        message_id: score + matches[message_id]
+                        for message_id, score in scores.items() if message_id in matches
+                    }
+                if not scores:
+                    return {}
+            return scores
+
+    def _catch_up(self):
+        from .models import Message
+
+        queryset = Message.objects.order_by('updated_at', 'id').prefetch_related('replies')
+        if self._last_seen is not None:
+            queryset = queryset.filter(updated_at__gte=self._last_seen - CATCH_UP_OVERLAP)
+        position = None
+        while True:
+            chunk = queryset
+            if position is not None:
+                chunk = chunk.filter(Q(updated_at__gt=position[0]) | Q(updated_at=position[0], id__gt=position[1]))
+            chunk = list(chunk[:INDEX_CHUNK_SIZE])
+            if not chunk:
+                return
+            for message in chunk:
+                self._add_from_database(message)
+            position = (chunk[-1].updated_at, chunk[-1].pk)
+            if self._last_seen is None or position[0] > self._last_seen:
+                self._last_seen = position[0]
+
+    def _add_from_database(self, message):
+        self._add(message.pk, tokenize(self._message_text(message)), tokenize(reply_text(message)))
+
+    @staticmethod
+    def _message_text(message):
+        return ' '.join([message.sender_name, message.sender_email, message.subject, message.message_body])
+
+    def _add(self, message_id, tokens, reply_tokens=None):
+        """Index a message's tokens; reply_tokens None keeps the replies indexed before"""
+        with self._lock:
+            if reply_tokens is None:
+                replies = self._reply_tokens.get(message_id, Counter())
+            else:
+                replies = Counter(reply_tokens)
+            self._remove(message_id)
+            frequencies = Counter(tokens) + replies
+            for token, frequency in frequencies.items():
+                if token not in self._postings:
+                    self._sorted_tokens = None
+                self._postings[token][message_id] = frequency
+            self._documents[message_id] = set(frequencies)
+            self._reply_tokens[message_id] = replies
+
+    def _remove(self, message_id):
+        with self._lock:
+            self._reply_tokens.pop(message_id, None)
+            for token in self._documents.pop(message_id, ()):
+                postings = self._postings[token]
+                postings.pop(message_id, None)
+                if not postings:
+                    del self._postings[token]
+                    self._sorted_tokens = None
+
+
+def _fts_table_exists():
+    return SQLiteFTSBackend.table in connection.introspection.table_names()
+
+
+def filter_messages(queryset, search_query='', status='', rank=False):
+    """Apply the inbox filters shared by the inbox and exports: search (q) and status"""
+    if search_query:
+        queryset = get_search_backend().filter(queryset, search_query, rank=rank)
+    if status:
+        queryset = queryset.filter(status=status)
+    return queryset
+
+
+@functools.lru_cache(maxsize=None)
+def get_search_backend():
+    """Return the configured search backend, shared by the whole process"""
+    if settings.HELPDESK_SEARCH_BACKEND:
+        return import_string(settings.HELPDESK_SEARCH_BACKEND)()
+
+    if connection.vendor == 'mysql':
+        return MySQLFullTextBackend()
+    if connection.vendor == 'sqlite' and _fts_table_exists():
+        return SQLiteFTSBackend()
+
+    logger.info("No database full-text support, using the in-process search index")
+    return InvertedIndexBackend()
+
+
+@receiver(setting_changed)
+def _reset_search_backend(setting, **kwargs):
+    if setting in ('HELPDESK_SEARCH_BACKEND', 'DATABASES'):
+        get_search_backend.cache_clear()
@@ -0,0 +1,87 @@
+"""
+Model signal handlers that keep derived data in sync with messages
+"""
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import counters, live, storage, threads
+from .models import ArchivedMessage, ArchivedReply, Message, Reply
+from .search import get_search_backend
+
+
+@receiver(post_save, sender=Message)
+def index_message(sender, instance, created=False, raw=False, **kwargs):
+    if not raw:
+        # New messages are indexed whole; later saves keep the indexed reply
+        # text, since reply changes reindex the message themselves (below)
+        get_search_backend().index_message(instance, replies=created)
+
+
+@receiver(post_delete, sender=Message)
+def unindex_message(sender, instance, **kwargs):
+    get_search_backend().remove_message(instance.pk)
+
+
+def _deleted_with_message(kwargs):
+    """True when a reply is deleted by cascade from its message(s)"""
+    origin = kwargs.get('origin')
+    if isinstance(origin, QuerySet):
+        return origin.model is Message
+    return isinstance(origin, Message)
+
+
+@receiver([post_save, post_delete], sender=Reply)
+def reindex_replied_message(sender, instance, raw=False, **kwargs):
+    if raw or _deleted_with_message(kwargs):
+        return
+    message = Message.objects.filter(pk=instance.message_id).first()
+    if message is not None:
+        get_search_backend().index_message(message)
+
+
+@receiver([post_save, post_delete], sender=Message)
+def notify_live_inboxes(sender, raw=False, **kwargs):
+    if not raw:
+        live.notify()
+
+
+@receiver(post_save, sender=Message)
+def count_message(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        counters.adjust({counters.TOTAL: 1, counters.status_counter(instance.status): 1})
+    else:
+        old_status = getattr(instance, '_loaded_status', None)
+        # Unknown when the instance was loaded without its status; reconcile fixes that
+        if old_status is not None:
+            counters.status_changed(old_status, instance.status)
+    instance._loaded_status = instance.status
+
+
+@receiver(post_delete, sender=Message)
+def uncount_message(sender, instance, **kwargs):
+    status = getattr(instance, '_loaded_status', instance.status)
+    counters.adjust({counters.TOTAL: -1, counters.status_counter(status): -1})
+
+
+@receiver(post_save, sender=Reply)
+def summarize_new_reply(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        threads.reply_added(instance)
+
+
+@receiver(post_delete, sender=Reply)
+def summarize_deleted_reply(sender, instance, **kwargs):
+    if not _deleted_with_message(kwargs):
+        threads.refresh(Message.objects.filter(pk=instance.message_id))
+
+
+@receiver(post_delete, sender=Message)
+@receiver(post_delete, sender=Reply)
+@receiver(post_delete, sender=ArchivedMessage)
+@receiver(post_delete, sender=ArchivedReply)
+def release_attachment(sender, instance, **kwargs):
+    if instance.attachment:
+        storage.release([instance.attachment.name])
@@ -0,0 +1,223 @@
+"""
+Content-addressed attachment storage
+
+Attachments are stored under the SHA-256 of their content, sharded by its
+first bytes (attachments/3f/a2/3fa2...e9.png), so no directory grows past a
+few hundred entries and an identical file uploaded twice is stored once.
+The original filename lives on the row (attachment_name).
+
+Each stored file has a StoredBlob row counting the attachments that use it:
+saving counts one more, deleting a message or reply counts one less. A
+blob nobody uses is only removed by collect_garbage() once it has stayed
+unused for ATTACHMENT_GC_GRACE_HOURS, after checking no row points at it,
+so an upload racing with the release of the same content is safe.
+"""
+from collections import Counter
+from datetime import timedelta
+import hashlib
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+BLOB_PREFIX = 'attachments'
+
+# attachments/<2 hex>/<2 hex>/<64 hex><extension>
+BLOB_NAME_RE = re.compile(r'^attachments/([0-9a-f]{2})/([0-9a-f]{2})/(\1\2[0-9a-f]{60})(\.[a-z0-9]{1,10})?$')
+EXTENSION_RE = re.compile(r'^\.[a-z0-9]{1,10}$')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage naming each file after the hash of its content"""
+
+    def save(self, name, content, max_length=None):
+        if content is None:
+            raise ValueError('Content to store can not be None')
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in content.chunks():
+            digest.update(chunk)
+            size += len(chunk)
+        name = blob_name(digest.hexdigest(), name)
+
+        acquired = _acquire(name)
+        if not acquired or not self.exists(name):
+            self._write(name, content)
+        if not acquired:
+            _register(name, size)
+        return name
+
+    def save_derived(self, name, content):
+        """Store a file made from a stored one (its preview) under `name`, outside the counts"""
+        self._write(name, content)
+        return name
+
+    def _write(self, name, content):
+        path = self.path(name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Written aside, then renamed into place: a concurrent upload of the
+        # same content just replaces it with identical bytes
+        handle, temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(handle, 'wb') as output:
+                for chunk in content.chunks():
+                    output.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temp_path, self.file_permissions_mode)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+
+attachment_storage = ContentAddressedStorage()
+
+
+def get_attachment_storage():
+    """Storage of attachment fields (a callable, so migrations don't freeze it)"""
+    return attachment_storage
+
+
+def blob_name(digest, filename):
+    """Storage name of content with this SHA-256, keeping the file's extension"""
+    extension = os.path.splitext(filename or '')[1].lower()
+    if not EXTENSION_RE.match(extension):
+        extension = ''
+    return f'{BLOB_PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def is_blob_name(name):
+    return bool(name and BLOB_NAME_RE.match(name))
+
+
+def retain(names):
+    """Count one more use of each stored file named (e.g. rows copied elsewhere)"""
+    from .models import StoredBlob
+
+    for name, uses in Counter(names).items():
+        if is_blob_name(name):
+            StoredBlob.objects.filter(name=name).update(ref_count=F('ref_count') + uses, released_at=None)
+
+
+def release(names):
+    """Count one use less of each stored file named; unused ones wait for collect_garbage()"""
+    from .models import StoredBlob
+
+    now = timezone.now()
+    for name, uses in Counter(names).items():
+        if is_blob_name(name):
+            StoredBlob.objects.filter(name=name).update(ref_count=F('ref_count') - uses, released_at=now)
+
+
+def collect_garbage(grace=None, batch_size=500):
+    """
+    Delete stored files no attachment uses any more
+
+    Removes blobs unused for longer than `grace`, with their previews, and
+    files under the blob directories that have no StoredBlob row (left by
+    an upload whose transaction rolled back). Blobs that turn out to be
+    referenced after all get their count corrected instead.
+
+    Returns:
+        Dict with the number of 'deleted' blobs, 'recounted' blobs and
+        'orphans' (files without a row) removed
+    """
+    from .models import StoredBlob
+
+    if grace is None:
+        grace = timedelta(hours=settings.ATTACHMENT_GC_GRACE_HOURS)
+    cutoff = timezone.now() - grace
+    result = {'deleted': 0, 'recounted': 0, 'orphans': 0}
+
+    last_name = ''
+    while True:
+        names = list(
+            StoredBlob.objects.filter(ref_count__lte=0, released_at__lt=cutoff, name__gt=last_name)
+            .order_by('name').values_list('name', flat=True)[:batch_size]
+        )
+        if not names:
+            break
+        last_name = names[-1]
+        with transaction.atomic():
+            # A concurrent upload re-acquiring a blob waits for this transaction
+            names = list(
+                StoredBlob.objects.select_for_update()
+                .filter(name__in=names, ref_count__lte=0).values_list('name', flat=True)
+            )
+            uses = reference_counts(names)
+            for name, count in uses.items():
+                StoredBlob.objects.filter(name=name).update(ref_count=count, released_at=None)
+            unused = [name for name in names if name not in uses]
+            # Deleted while the rows are locked, so an upload of the same
+            # content either re-acquires a blob before this or writes it anew after
+            _delete_files(unused)
+            StoredBlob.objects.filter(name__in=unused).delete()
+        result['recounted'] += len(uses)
+        result['deleted'] += len(unused)
+
+    result['orphans'] = _delete_orphan_files(cutoff)
+    return result
+
+
+def reference_counts(names):
+    """Name -> number of messages and replies, hot or archived, using each stored file named"""
+    from .models import ArchivedMessage, ArchivedReply, Message, Reply
+
+    counts = {}
+    for model in (Message, Reply, ArchivedMessage, ArchivedReply):
+        rows = (
+            model.objects.filter(attachment__in=names).order_by()
+            .values_list('attachment').annotate(uses=Count('pk'))
+        )
+        for name, uses in rows:
+            counts[name] = counts.get(name, 0) + uses
+    return counts
+
+
+def _acquire(name):
+    """Count one more use of an existing blob; False if there is none"""
+    from .models import StoredBlob
+
+    return StoredBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1, released_at=None) > 0
+
+
+def _register(name, size):
+    from .models import StoredBlob
+
+    _, created = StoredBlob.objects.get_or_create(name=name, defaults={'size': size, 'ref_count': 1})
+    if not created:
+        # Registered meanwhile by a concurrent upload of the same content
+        _acquire(name)
+
+
+def _delete_files(names):
+    from .previews import preview_kind, preview_name
+
+    for name in names:
+        attachment_storage.delete(name)
+        if preview_kind(name):
+            attachment_storage.delete(preview_name(name))
+
+
+def _delete_orphan_files(cutoff):
+    from .models import StoredBlob
+
+    deleted = 0
+    root = attachment_storage.path(BLOB_PREFIX)
+    for directory, _, filenames in os.walk(root):
+        prefix = os.path.relpath(directory, attachment_storage.location).replace(os.sep, '/')
+        names = [f'{prefix}/{filename}' for filename in filenames if is_blob_name(f'{prefix}/{filename}')]
+        if not names:
+            continue
+        known = set(StoredBlob.objects.filter(name__in=names).values_list('name', flat=True))
+        for name in names:
+            if name not in known and attachment_storage.get_modified_time(name) < cutoff:
+                _delete_files([name])
+                deleted += 1
+    return deleted
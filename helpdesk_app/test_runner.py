@@ -0,0 +1,86 @@
+"""
+Test runner for `manage.py test` (settings.TEST_RUNNER)
+
+The suite runs against the configured cache backend, but a file-based one
+(the default SQLiteCache) is moved to a temporary file, one per parallel
+worker: tests clear the cache constantly, and must neither wipe the file that
+running servers share nor each other's entries.
+
+It also keeps the JSON log pipeline quiet while the suite runs, so the
+console shows test results rather than one log line per request. Records
+still reach the loggers, so assertLogs sees all of them.
+"""
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+from django.test import runner
+from django.test.utils import override_settings
+
+# Cache backends whose LOCATION is a path on disk
+FILE_CACHE_BACKENDS = {
+    'helpdesk_app.cache_backends.SQLiteCache',
+    'django.core.cache.backends.filebased.FileBasedCache',
+}
+
+# Temporary directory of the run, inherited by parallel workers
+CACHE_DIR_VARIABLE = 'HELPDESK_TEST_CACHE_DIR'
+
+# Loggers whose handlers are silenced during the run
+QUIET_LOGGERS = ('django', 'helpdesk_app')
+
+
+def isolate_cache(filename):
+    """
+    Move a file-based default cache to `filename` in the run's directory
+
+    Returns:
+        The enabled override_settings, or None for other backends
+    """
+    default = settings.CACHES['default']
+    if default['BACKEND'] not in FILE_CACHE_BACKENDS:
+        return None
+    location = os.path.join(os.environ[CACHE_DIR_VARIABLE], filename)
+    override = override_settings(CACHES={**settings.CACHES, 'default': {**default, 'LOCATION': location}})
+    override.enable()
+    return override
+
+
+def silence_logs():
+    """Raise the quiet loggers' handlers above CRITICAL; returns their previous levels"""
+    handlers = {handler: handler.level for name in QUIET_LOGGERS for handler in logging.getLogger(name).handlers}
+    for handler in handlers:
+        handler.setLevel(logging.CRITICAL + 1)
+    return handlers
+
+
+def _init_worker(*args, **kwargs):
+    runner._init_worker(*args, **kwargs)
+    isolate_cache(f'cache-{runner._worker_id}.sqlite3')
+    # Spawned workers have configured logging again from the settings
+    silence_logs()
+
+
+class ParallelTestSuite(runner.ParallelTestSuite):
+    init_worker = _init_worker
+
+
+class HelpdeskTestRunner(runner.DiscoverRunner):
+    parallel_test_suite = ParallelTestSuite
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._cache_dir = tempfile.TemporaryDirectory()
+        os.environ[CACHE_DIR_VARIABLE] = self._cache_dir.name
+        self._cache_override = isolate_cache('cache.sqlite3')
+        self._handler_levels = silence_logs()
+
+    def teardown_test_environment(self, **kwargs):
+        for handler, level in self._handler_levels.items():
+            handler.setLevel(level)
+        if self._cache_override is not None:
+            self._cache_override.disable()
+        del os.environ[CACHE_DIR_VARIABLE]
+        self._cache_dir.cleanup()
+        super().teardown_test_environment(**kwargs)
@@ -1,6 +1,49 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import json
+import logging
+import os
+import re
+import socketserver
+import sys
+import tempfile
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core import signals
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import DatabaseError, connection, transaction
 from django.contrib.auth.models import User
-from .models import Message, Reply, SystemSettings
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.utils import timezone
+from datetime import timedelta
+from django.urls import reverse
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.core.management import call_command
+from .models import (
+    ArchivedMessage, ArchivedReply, Message, Reply, StoredBlob, SystemSettings, OutgoingEmail, MessageCounter,
+    message_fingerprint, message_preview,
+)
+from .cache_backends import SQLiteCache
+from .email_service import EmailService, connection_pool
+from . import archive, counters, dedup, exports, inbound, live, mailparse, metrics, pagecache, previews, storage, views
+from .log import JSONFormatter, QueueListenerHandler, SamplingFilter
+from .middleware import AsyncWhiteNoiseMiddleware
+from .pagination import KeysetPaginator, approximate_count
+from .management.commands import import_tickets
+from .search import InvertedIndexBackend, MySQLFullTextBackend, SQLiteFTSBackend, get_search_backend
 
 
 class MessageModelTest(TestCase):
@@ -41,7 +84,2114 @@ class ReplyModelTest(TestCase):
 
 
 class SystemSettingsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        SystemSettings.invalidate_cache()
+    
     def test_settings_singleton(self):
         settings1 = SystemSettings.load()
         settings2 = SystemSettings.load()
         self.assertEqual(settings1.id, settings2.id)
+    
+    def test_load_is_cached_in_process(self):
+        SystemSettings.load()
+        with self.assertNumQueries(0):
+            SystemSettings.load()
+    
+    def test_save_is_picked_up_by_other_workers(self):
+        stale = SystemSettings.load()
+        
+        # Another worker saves; its commit bumps the shared version key
+        with self.captureOnCommitCallbacks(execute=True):
+            SystemSettings(auto_response_enabled=False).save()
+        SystemSettings._cached = (stale, 'old-version', 0)
+        
+        self.assertFalse(SystemSettings.load().auto_response_enabled)
+    
+    def test_warm_contact_post_issues_no_settings_queries(self):
+        data = {
+            'sender_name': 'John Doe',
+            'sender_email': 'john@example.com',
+            'subject': 'Need help',
+            'message_body': 'My account is locked out.',
+        }
+        self.client.post(reverse('contact'), data)
+        
+        # A different submission, so it is created rather than merged as a duplicate
+        data['subject'] = 'Still need help'
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('contact'), data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Message.objects.count(), 2)
+        self.assertFalse([q for q in queries if 'systemsettings' in q['sql']])
+
+
+class EmailOutboxTest(TestCase):
+    def setUp(self):
+        cache.clear()
+    
+    def test_contact_submission_queues_emails(self):
+        response = self.client.post(reverse('contact'), {
+            'sender_name': 'John Doe',
+            'sender_email': 'john@example.com',
+            'subject': 'Need help',
+            'message_body': 'My account is locked out.',
+        })
+        self.assertRedirects(response, reverse('contact'))
+        self.assertEqual(Message.objects.count(), 1)
+        self.assertEqual(OutgoingEmail.objects.filter(status='pending').count(), 2)
+        self.assertEqual(len(mail.outbox), 0)
+        
+        result = EmailService.process_outbox()
+        self.assertEqual(result, {'sent': 2, 'retried': 0, 'dead': 0})
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertFalse(OutgoingEmail.objects.exclude(status='sent').exists())
+    
+    def test_failed_queueing_rolls_back_the_submission(self):
+        with mock.patch.object(
+            OutgoingEmail.objects, 'bulk_create', side_effect=DatabaseError('disk full'),
+        ), self.assertLogs('helpdesk_app', 'ERROR'):
+            response = self.client.post(reverse('contact'), {
+                'sender_name': 'John Doe',
+                'sender_email': 'john@example.com',
+                'subject': 'Need help',
+                'message_body': 'My account is locked out.',
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Message.objects.exists())
+
+    def test_failed_queueing_raises(self):
+        with mock.patch.object(
+            OutgoingEmail.objects, 'create', side_effect=DatabaseError('disk full'),
+        ), self.assertLogs('helpdesk_app.email_service', 'ERROR'):
+            with self.assertRaises(DatabaseError):
+                EmailService.send_email('jane@example.com', 'Hello', '<p>Hi</p>')
+
+    @override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+    def test_failed_delivery_is_retried_then_dead_lettered(self):
+        email = EmailService.queue_email('jane@example.com', 'Hello', '<p>Hi</p>')
+        
+        with mock.patch(
+            'django.core.mail.backends.locmem.EmailBackend.send_messages',
+            side_effect=OSError('connection refused'),
+        ):
+            self.assertEqual(EmailService.process_outbox()['retried'], 1)
+            email.refresh_from_db()
+            self.assertEqual(email.status, 'pending')
+            self.assertEqual(email.attempts, 1)
+            self.assertIn('connection refused', email.last_error)
+            
+            # Not due yet because of the backoff
+            self.assertEqual(EmailService.process_outbox()['retried'], 0)
+            
+            OutgoingEmail.objects.update(next_attempt_at=email.created_at)
+            self.assertEqual(EmailService.process_outbox()['dead'], 1)
+        
+        email.refresh_from_db()
+        self.assertEqual(email.status, 'dead')
+    
+    @override_settings(EMAIL_OUTBOX_ENABLED=False)
+    def test_direct_send_when_outbox_disabled(self):
+        self.assertTrue(EmailService.send_email('jane@example.com', 'Hello', '<p>Hi</p>'))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertFalse(OutgoingEmail.objects.exists())
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept mail from smtplib"""
+    
+    def handle(self):
+        self.server.connections += 1
+        self.wfile.write(b'220 localhost ESMTP\r\n')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            command = line[:4].upper()
+            if command == b'DATA':
+                self.wfile.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+                data = b''.join(iter(self.rfile.readline, b'.\r\n'))
+                self.server.messages.append(data)
+                self.wfile.write(b'250 OK\r\n')
+                if len(self.server.messages) == self.server.drop_after:
+                    break
+            elif command == b'QUIT':
+                self.wfile.write(b'221 Bye\r\n')
+                break
+            else:
+                self.wfile.write(b'250 OK\r\n')
+
+
+class SMTPConnectionPoolTest(TestCase):
+    def setUp(self):
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _SMTPHandler)
+        self.server.daemon_threads = True
+        self.server.connections = 0
+        self.server.messages = []
+        self.server.drop_after = None
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        
+        settings_override = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1',
+            EMAIL_PORT=self.server.server_address[1],
+            EMAIL_USE_TLS=False,
+            EMAIL_HOST_USER='',
+            EMAIL_HOST_PASSWORD='',
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+    
+    def tearDown(self):
+        connection_pool.close_all()
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def _emails(self, count):
+        return [(f'user{i}@example.com', f'Subject {i}', '<p>Hello</p>') for i in range(count)]
+    
+    def test_send_many_reuses_one_connection(self):
+        self.assertEqual(EmailService.send_many(self._emails(5)), [None] * 5)
+        self.assertEqual(EmailService.send_many(self._emails(3)), [None] * 3)
+        self.assertEqual(len(self.server.messages), 8)
+        self.assertEqual(self.server.connections, 1)
+    
+    def test_reconnects_after_server_disconnect(self):
+        self.server.drop_after = 2
+        self.assertEqual(EmailService.send_many(self._emails(4)), [None] * 4)
+        self.assertEqual(len(self.server.messages), 4)
+        self.assertEqual(self.server.connections, 2)
+
+
+class SearchBackendTestMixin:
+    def setUp(self):
+        self.user = User.objects.create_user(username='agent', password='testpass')
+        self.printer = Message.objects.create(
+            sender_name="Alice Smith",
+            sender_email="alice@example.com",
+            subject="Printer jammed",
+            message_body="The office printer keeps jamming on page two."
+        )
+        self.invoice = Message.objects.create(
+            sender_name="Bob Jones",
+            sender_email="bob@example.com",
+            subject="Invoice question",
+            message_body="Why was I charged twice for the printer toner? Printer printer."
+        )
+    
+    def search(self, query, rank=False):
+        return list(self.backend.filter(Message.objects.all(), query, rank=rank))
+    
+    def test_prefix_match_across_fields(self):
+        self.assertEqual(self.search('jam'), [self.printer])
+        self.assertEqual(self.search('alice print'), [self.printer])
+        self.assertEqual(self.search('bob@example'), [self.invoice])
+        self.assertEqual(self.search('nothing'), [])
+    
+    def test_index_follows_replies_and_deletes(self):
+        Reply.objects.create(message=self.printer, admin=self.user, reply_body="Try the firmware update.")
+        self.assertEqual(self.search('firmware'), [self.printer])
+        
+        self.printer.delete()
+        self.assertEqual(self.search('printer'), [self.invoice])
+    
+    def test_relevance_ranking(self):
+        self.assertEqual(self.search('printer', rank=True), [self.invoice, self.printer])
+    
+    def test_message_save_keeps_indexed_replies(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Reply.objects.create(message=self.printer, admin=self.user, reply_body="Try the firmware update.")
+        self.search('printer')  # build the index
+        
+        self.printer.subject = "Printer fixed"
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            self.printer.save()
+        self.assertFalse([q for q in queries if 'FROM "helpdesk_app_reply"' in q['sql']])
+        self.assertEqual(self.search('fixed firmware'), [self.printer])
+
+
+class SQLiteFTSBackendTest(SearchBackendTestMixin, TestCase):
+    def setUp(self):
+        self.backend = get_search_backend()
+        if not isinstance(self.backend, SQLiteFTSBackend):
+            self.skipTest('SQLite FTS5 is not the active search backend')
+        super().setUp()
+    
+    def test_inbox_search_uses_index(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('inbox'), {'q': 'jam'})
+        self.assertEqual(list(response.context['page_obj']), [self.printer])
+
+
+@override_settings(HELPDESK_SEARCH_BACKEND='helpdesk_app.search.InvertedIndexBackend')
+class InvertedIndexBackendTest(SearchBackendTestMixin, TestCase):
+    def setUp(self):
+        self.backend = get_search_backend()
+        self.assertIsInstance(self.backend, InvertedIndexBackend)
+        with self.captureOnCommitCallbacks(execute=True):
+            super().setUp()
+    
+    def test_index_follows_replies_and_deletes(self):
+        self.search('printer')  # build the index
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            Reply.objects.create(message=self.printer, admin=self.user, reply_body="Try the firmware update.")
+        self.assertEqual(self.search('firmware'), [self.printer])
+        
+        printer_id = self.printer.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            self.printer.delete()
+        self.assertEqual(list(self.backend._search(['printer'])), [self.invoice.pk])
+        self.assertNotIn(printer_id, self.backend._search(['firmware']))
+    
+    def test_catches_up_on_changes_from_other_processes(self):
+        self.search('printer')  # build the index
+        
+        # Written without signals, as by another worker process
+        Message.objects.filter(pk=self.invoice.pk).update(subject="Refund request", updated_at=timezone.now())
+        Reply.objects.bulk_create([Reply(message=self.printer, admin=self.user, reply_body="Firmware fixed it.")])
+        Message.objects.filter(pk=self.printer.pk).update(updated_at=timezone.now())
+        
+        self.assertEqual(self.search('refund'), [self.invoice])
+        self.assertEqual(self.search('firmware'), [self.printer])
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        # Pairs of messages share a timestamp, so the id tie-breaker matters
+        Message.objects.bulk_create([
+            Message(
+                sender_name=f"Sender {i}",
+                sender_email=f"sender{i}@example.com",
+                subject=f"Subject {i}",
+                message_body="Message body for pagination.",
+                timestamp=now - timedelta(minutes=i // 2),
+            )
+            for i in range(25)
+        ])
+        self.expected = list(Message.objects.order_by('-timestamp', '-id'))
+    
+    def walk(self, paginator):
+        seen, page = [], paginator.get_page()
+        while True:
+            seen.extend(page)
+            if not page.has_next():
+                return seen, page
+            page = paginator.get_page(page.next_cursor)
+    
+    def test_pages_cover_every_row_once(self):
+        seen, last_page = self.walk(KeysetPaginator(Message.objects.all(), 10))
+        self.assertEqual(seen, self.expected)
+        
+        previous = KeysetPaginator(Message.objects.all(), 10).get_page(last_page.previous_cursor)
+        self.assertEqual(list(previous), self.expected[10:20])
+    
+    def test_cursor_is_stable_under_inserts(self):
+        paginator = KeysetPaginator(Message.objects.all(), 10)
+        first = paginator.get_page()
+        Message.objects.create(
+            sender_name="Late", sender_email="late@example.com",
+            subject="Arrived while paging", message_body="A brand new message.",
+        )
+        self.assertEqual(list(paginator.get_page(first.next_cursor)), self.expected[10:20])
+    
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        page = KeysetPaginator(Message.objects.all(), 10).get_page('not-a-cursor')
+        self.assertEqual(list(page), self.expected[:10])
+        self.assertFalse(page.has_previous())
+    
+    def test_approximate_count(self):
+        self.assertEqual(approximate_count(Message.objects.all()), 25)
+        self.assertEqual(KeysetPaginator(Message.objects.all(), 10).approximate_total, 25)
+    
+    def test_inbox_cursor_links(self):
+        user = User.objects.create_user(username='agent', password='testpass')
+        self.client.force_login(user)
+        response = self.client.get(reverse('inbox'), {'status': 'new'})
+        page_obj = response.context['page_obj']
+        self.assertEqual(list(page_obj), self.expected[:20])
+        self.assertContains(response, f'?cursor={page_obj.next_cursor}&status=new')
+        
+        response = self.client.get(reverse('inbox'), {'status': 'new', 'cursor': page_obj.next_cursor})
+        self.assertEqual(list(response.context['page_obj']), self.expected[20:])
+
+
+class MessageCountersTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='agent', password='testpass')
+    
+    def create_message(self, **kwargs):
+        return Message.objects.create(
+            sender_name="Counter Test",
+            sender_email="counter@example.com",
+            subject="Counting",
+            message_body="Please count this message.",
+            **kwargs
+        )
+    
+    def test_counters_follow_create_status_change_and_delete(self):
+        first = self.create_message()
+        self.create_message()
+        self.create_message(status='replied')
+        self.assertEqual(counters.get_counts(), {'total': 3, 'new': 2, 'replied': 1})
+        
+        # The cached counts are dropped when the transaction commits
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('mark_as_read', args=[first.id]))
+        self.assertEqual(counters.get_counts(), {'total': 3, 'new': 1, 'replied': 2})
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.get(pk=first.pk).delete()
+        self.assertEqual(counters.get_counts(), {'total': 2, 'new': 1, 'replied': 1})
+    
+    def test_inbox_reads_counts_from_cache(self):
+        self.create_message()
+        self.client.force_login(self.user)
+        self.client.get(reverse('inbox'))  # warm the cache
+        
+        with self.assertNumQueries(0):
+            self.assertEqual(counters.get_counts()['new'], 1)
+        response = self.client.get(reverse('inbox'))
+        self.assertEqual(response.context['total_messages'], 1)
+        self.assertEqual(response.context['new_messages'], 1)
+    
+    def test_late_write_back_of_stale_counts_is_discarded(self):
+        self.create_message()
+        counters.invalidate()
+        
+        # A reader loads the counts, then a message commits before it stores them
+        set_counts = cache.set
+        
+        def commit_then_set(key, value, *args, **kwargs):
+            if isinstance(value, dict):
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.create_message()
+            set_counts(key, value, *args, **kwargs)
+        
+        with mock.patch.object(cache, 'set', side_effect=commit_then_set):
+            self.assertEqual(counters.get_counts()['total'], 1)
+        self.assertEqual(counters.get_counts()['total'], 2)
+    
+    def test_reconcile_repairs_drift(self):
+        self.create_message()
+        MessageCounter.objects.filter(name='total').update(value=42)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(counters.reconcile(), {'total': -41})
+        self.assertEqual(counters.get_counts()['total'], 1)
+        self.assertEqual(counters.reconcile(), {})
+
+
+class SQLiteCacheTest(TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.location = f'{tmpdir.name}/cache.sqlite3'
+        self.cache = SQLiteCache(self.location, {})
+    
+    def test_get_set_delete(self):
+        self.cache.set('counts', {'new': 3})
+        self.assertEqual(self.cache.get('counts'), {'new': 3})
+        self.assertTrue(self.cache.has_key('counts'))
+        self.assertTrue(self.cache.delete('counts'))
+        self.assertIsNone(self.cache.get('counts'))
+    
+    def test_expired_entries_are_misses(self):
+        self.cache.set('short', 1, timeout=0)
+        self.assertIsNone(self.cache.get('short'))
+        self.assertTrue(self.cache.add('short', 2))
+        self.assertFalse(self.cache.add('short', 3))
+        self.assertEqual(self.cache.get('short'), 2)
+    
+    def test_incr_is_shared_between_processes(self):
+        # Two backend instances on one file stand in for two gunicorn workers
+        other_worker = SQLiteCache(self.location, {})
+        self.cache.add('ratelimit', 0, 60)
+        self.assertFalse(other_worker.add('ratelimit', 0, 60))
+        self.cache.incr('ratelimit')
+        self.assertEqual(other_worker.incr('ratelimit', 5), 6)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+    
+    def test_least_recently_used_entries_are_culled(self):
+        small = SQLiteCache(self.location, {'OPTIONS': {'MAX_ENTRIES': 50, 'CULL_FREQUENCY': 2}})
+        for i in range(100):
+            small.set(f'key-{i}', i)
+        self.assertFalse(small.has_key('key-0'))
+        self.assertTrue(small.has_key('key-99'))
+
+
+class AttachmentDownloadTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        
+        self.content = bytes(range(256)) * 1024
+        self.message = Message.objects.create(
+            sender_name="Jane Doe",
+            sender_email="jane@example.com",
+            subject="Manual",
+            message_body="See the attached manual.",
+            attachment=SimpleUploadedFile('manual.pdf', self.content),
+        )
+        self.url = reverse('attachment_download', args=[self.message.id])
+        self.user = User.objects.create_user(username='agent', password='testpass')
+        self.client.force_login(self.user)
+    
+    def test_streams_whole_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+    
+    def test_range_requests(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+        
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-10:])
+        
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        
+        # A stale If-Range gets the full file instead of a partial one
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+    
+    def test_conditional_get(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+    
+    @override_settings(ATTACHMENT_SENDFILE_BACKEND='nginx', ATTACHMENT_ACCEL_PREFIX='/protected/')
+    def test_offload_to_proxy(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected/{self.message.attachment.name}')
+        self.assertEqual(response.content, b'')
+    
+    def test_requires_login(self):
+        self.client.logout()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+    
+    async def test_streams_under_asgi_handler(self):
+        await self.async_client.aforce_login(self.user)
+        cookie = f'{settings.SESSION_COOKIE_NAME}={self.async_client.cookies[settings.SESSION_COOKIE_NAME].value}'
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': self.url, 'query_string': b'',
+            'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 5000),
+        }
+        requested = asyncio.Event()
+        
+        async def receive():
+            if not requested.is_set():
+                requested.set()
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await asyncio.Future()
+        
+        sent = []
+        
+        async def send(event):
+            sent.append(event)
+        
+        # As the test client does, keep the test's database connection open
+        signals.request_started.disconnect(close_old_connections)
+        signals.request_finished.disconnect(close_old_connections)
+        try:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                await ASGIHandler()(scope, receive, send)
+        finally:
+            signals.request_started.connect(close_old_connections)
+            signals.request_finished.connect(close_old_connections)
+        
+        self.assertEqual(sent[0]['status'], 200)
+        # The file was read chunk by chunk, not into memory before sending
+        self.assertEqual([str(warning.message) for warning in caught if 'synchronous' in str(warning.message)], [])
+        bodies = [event.get('body', b'') for event in sent if event['type'] == 'http.response.body']
+        self.assertGreater(len(bodies), 1)
+        self.assertEqual(b''.join(bodies), self.content)
+
+
+class BulkInboxActionsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='agent', password='testpass')
+        self.client.force_login(self.user)
+        self.selected = [
+            Message.objects.create(
+                sender_name=f"Sender {i}",
+                sender_email=f"sender{i}@example.com",
+                subject="Outage",
+                message_body="The service is down again.",
+            )
+            for i in range(3)
+        ]
+        self.other = Message.objects.create(
+            sender_name="Other", sender_email="other@example.com",
+            subject="Unrelated", message_body="A different question.",
+        )
+        self.ids = [message.id for message in self.selected]
+    
+    def test_bulk_status_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('bulk_update_status'), {'message_ids': self.ids, 'status': 'replied'})
+        updates = [q for q in queries if q['sql'].startswith('UPDATE "helpdesk_app_message"')]
+        self.assertEqual(len(updates), 1)
+        
+        self.assertEqual(Message.objects.filter(status='replied').count(), 3)
+        self.assertEqual(Message.objects.get(pk=self.other.pk).status, 'new')
+        counters.invalidate()
+        self.assertEqual(counters.get_counts(), {'total': 4, 'new': 1, 'replied': 3})
+    
+    def test_bulk_reply(self):
+        response = self.client.post(reverse('bulk_reply'), {
+            'message_ids': self.ids,
+            'reply_body': 'We are working on the outage now.',
+        })
+        self.assertRedirects(response, reverse('inbox'))
+        
+        self.assertEqual(Reply.objects.filter(message__in=self.ids, admin=self.user).count(), 3)
+        self.assertEqual(Message.objects.filter(status='replied').count(), 3)
+        queued = OutgoingEmail.objects.order_by('to_email')
+        self.assertEqual([email.to_email for email in queued], [m.sender_email for m in self.selected])
+        self.assertEqual([email.subject for email in queued], [f'Re: Outage [#{m.pk}]' for m in self.selected])
+        self.assertEqual(list(get_search_backend().filter(Message.objects.all(), 'working outage')),
+                         list(Message.objects.filter(id__in=self.ids)))
+    
+    def test_bulk_reply_updates_thread_summary(self):
+        self.client.post(reverse('bulk_reply'), {
+            'message_ids': self.ids,
+            'reply_body': 'We are working on the outage now.',
+        })
+        for message in Message.objects.filter(id__in=self.ids):
+            self.assertEqual(message.reply_count, 1)
+            self.assertEqual(message.last_responder, self.user)
+            self.assertEqual(message.last_activity_at, message.last_reply_at)
+    
+    @override_settings(EMAIL_OUTBOX_ENABLED=False)
+    def test_bulk_reply_sends_after_commit_without_outbox(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(reverse('bulk_reply'), {
+                'message_ids': self.ids,
+                'reply_body': 'We are working on the outage now.',
+            })
+            # Nothing goes out while the transaction holds the rows
+            self.assertEqual(mail.outbox, [])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(sorted(email.to[0] for email in mail.outbox), [m.sender_email for m in self.selected])
+    
+    def test_bulk_reply_query_count_does_not_grow(self):
+        data = {'reply_body': 'We are working on the outage now.'}
+        with CaptureQueriesContext(connection) as few:
+            self.client.post(reverse('bulk_reply'), {**data, 'message_ids': self.ids[:1]})
+        with CaptureQueriesContext(connection) as many:
+            self.client.post(reverse('bulk_reply'), {**data, 'message_ids': self.ids[1:]})
+        self.assertEqual(len(few), len(many))
+    
+    def test_bulk_reply_validates_body(self):
+        self.client.post(reverse('bulk_reply'), {'message_ids': self.ids, 'reply_body': 'short'})
+        self.assertFalse(Reply.objects.exists())
+        self.assertFalse(OutgoingEmail.objects.exists())
+
+
+class ThreadSummaryTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', password='testpass')
+        self.bob = User.objects.create_user(username='bob', password='testpass')
+        self.message = Message.objects.create(
+            sender_name="Jane Doe", sender_email="jane@example.com",
+            subject="Question", message_body="I have a question.",
+        )
+    
+    def test_new_message_has_empty_summary(self):
+        self.assertEqual(self.message.reply_count, 0)
+        self.assertIsNone(self.message.last_reply_at)
+        self.assertEqual(self.message.last_activity_at, self.message.timestamp)
+    
+    def test_reply_updates_summary(self):
+        Reply.objects.create(message=self.message, admin=self.alice, reply_body="First answer.")
+        latest = Reply.objects.create(message=self.message, admin=self.bob, reply_body="Second answer.")
+        # The in-memory parent is kept current as well
+        self.assertEqual(self.message.reply_count, 2)
+        
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.reply_count, 2)
+        self.assertEqual(self.message.last_reply_at, latest.timestamp)
+        self.assertEqual(self.message.last_responder, self.bob)
+        self.assertEqual(self.message.last_activity_at, latest.timestamp)
+    
+    def test_older_reply_does_not_move_last_reply(self):
+        latest = Reply.objects.create(message=self.message, admin=self.alice, reply_body="Answer.")
+        Reply.objects.create(
+            message=self.message, admin=self.bob, reply_body="Imported.",
+            timestamp=latest.timestamp - timedelta(days=1),
+        )
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.reply_count, 2)
+        self.assertEqual(self.message.last_responder, self.alice)
+    
+    def test_deleting_reply_recomputes_summary(self):
+        first = Reply.objects.create(message=self.message, admin=self.alice, reply_body="First answer.")
+        Reply.objects.create(message=self.message, admin=self.bob, reply_body="Second answer.").delete()
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.reply_count, 1)
+        self.assertEqual(self.message.last_responder, self.alice)
+        self.assertEqual(self.message.last_reply_at, first.timestamp)
+        
+        first.delete()
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.reply_count, 0)
+        self.assertIsNone(self.message.last_responder)
+        self.assertEqual(self.message.last_activity_at, self.message.timestamp)
+    
+    def test_backfill_command(self):
+        Reply.objects.bulk_create([
+            Reply(message=self.message, admin=self.alice, reply_body="Bulk answer."),
+            Reply(message=self.message, admin=self.bob, reply_body="Another bulk answer."),
+        ])
+        call_command('backfill_thread_summary', chunk_size=1, stdout=mock.MagicMock())
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.reply_count, 2)
+        self.assertIsNotNone(self.message.last_reply_at)
+    
+    def test_detail_view_query_count_is_fixed(self):
+        self.client.force_login(self.alice)
+        url = reverse('message_detail', args=[self.message.id])
+        Reply.objects.create(message=self.message, admin=self.alice, reply_body="First answer.")
+        with CaptureQueriesContext(connection) as one_reply:
+            self.client.get(url)
+        for i in range(5):
+            Reply.objects.create(message=self.message, admin=self.bob, reply_body=f"Answer {i}.")
+        with CaptureQueriesContext(connection) as many_replies:
+            self.client.get(url)
+        self.assertEqual(len(one_reply), len(many_replies))
+    
+    def test_inbox_sorts_by_activity(self):
+        older = Message.objects.create(
+            sender_name="Old", sender_email="old@example.com",
+            subject="Old thread", message_body="Asked a while ago.",
+            timestamp=timezone.now() - timedelta(days=3),
+        )
+        Reply.objects.create(message=older, admin=self.alice, reply_body="Finally answered.")
+        self.client.force_login(self.alice)
+        
+        response = self.client.get(reverse('inbox'), {'sort': 'activity'})
+        self.assertEqual([m.pk for m in response.context['page_obj']], [older.pk, self.message.pk])
+        self.assertContains(response, 'last by alice')
+
+
+class AsyncViewsTest(TestCase):
+    contact_data = {
+        'sender_name': 'John Doe',
+        'sender_email': 'john@example.com',
+        'subject': 'Need help',
+        'message_body': 'My account is locked out.',
+    }
+    
+    def setUp(self):
+        cache.clear()
+        SystemSettings.invalidate_cache()
+        self.user = User.objects.create_user(username='agent', password='testpass')
+        self.message = Message.objects.create(
+            sender_name="Jane Doe", sender_email="jane@example.com",
+            subject="Question", message_body="I have a question.",
+        )
+    
+    def test_views_are_async(self):
+        for view in (views.contact_view, views.inbox_view, views.message_detail_view):
+            self.assertTrue(iscoroutinefunction(view), view.__name__)
+    
+    async def test_inbox_requires_login(self):
+        response = await self.async_client.get(reverse('inbox'))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith('/login/'))
+    
+    async def test_inbox(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('inbox'), {'q': 'question'})
+        self.assertContains(response, 'Jane Doe')
+        self.assertEqual(response.context['total_messages'], 1)
+    
+    async def test_reply(self):
+        await self.async_client.aforce_login(self.user)
+        url = reverse('message_detail', args=[self.message.id])
+        response = await self.async_client.post(url, {'reply_body': 'Here is the answer you need.'})
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        
+        response = await self.async_client.get(url)
+        self.assertContains(response, 'Here is the answer you need.')
+        message = await Message.objects.aget(pk=self.message.pk)
+        self.assertEqual(message.status, 'replied')
+        self.assertEqual(await OutgoingEmail.objects.filter(to_email='jane@example.com').acount(), 1)
+    
+    async def test_contact_queues_emails_with_message(self):
+        response = await self.async_client.post(reverse('contact'), self.contact_data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(await Message.objects.filter(sender_email='john@example.com').acount(), 1)
+        self.assertEqual(await OutgoingEmail.objects.acount(), 2)
+    
+    @override_settings(EMAIL_OUTBOX_ENABLED=False)
+    async def test_contact_sends_after_commit_without_outbox(self):
+        response = await self.async_client.post(reverse('contact'), self.contact_data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(sorted(email.to[0] for email in mail.outbox), ['admin@example.com', 'john@example.com'])
+    
+    @override_settings(WHITENOISE_USE_FINDERS=True)
+    async def test_static_files_are_streamed_asynchronously(self):
+        async def get_response(request):
+            self.fail('the static file was not served')
+        
+        with warnings.catch_warnings():
+            # No collectstatic has been run; the finders serve the files
+            warnings.simplefilter('ignore')
+            middleware = AsyncWhiteNoiseMiddleware(get_response)
+        response = await middleware(RequestFactory().get('/static/admin/css/base.css'))
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        with open(finders.find('admin/css/base.css'), 'rb') as f:
+            self.assertEqual(b''.join([chunk async for chunk in response]), f.read())
+    
+    async def test_contact_is_rate_limited(self):
+        for i in range(5):
+            await self.async_client.post(reverse('contact'), {**self.contact_data, 'subject': f'Need help {i}'})
+        response = await self.async_client.post(reverse('contact'), {**self.contact_data, 'subject': 'Need help 5'})
+        self.assertContains(response, 'Too many requests')
+        self.assertEqual(await Message.objects.filter(sender_email='john@example.com').acount(), 5)
+
+
+class ImportTicketsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=os.path.join(self.tmp.name, 'media'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.agent = User.objects.create_user(username='agent', email='agent@example.com', is_staff=True)
+    
+    def run_import(self, *args):
+        output = tempfile.SpooledTemporaryFile(mode='w+')
+        call_command('import_tickets', *args, stdout=output)
+        output.seek(0)
+        return output.read()
+    
+    def write(self, name, content, mode='w'):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, mode) as f:
+            f.write(content)
+        return path
+    
+    def test_csv_import_links_replies_and_resumes(self):
+        self.write('manual.pdf', b'%PDF-1.4 manual', mode='wb')
+        path = self.write('tickets.csv', (
+            'id,parent_id,sender_name,sender_email,subject,body,status,timestamp,admin,attachment\n'
+            '2,1,,,,We reset your password.,,2023-01-02T10:00:00,agent,\n'
+            '1,,Jane Doe,jane@example.com,Locked out,I cannot log in.,replied,2023-01-01T09:00:00,,manual.pdf\n'
+            '3,,John Roe,john@example.com,Billing,Wrong invoice amount.,new,2023-01-03T09:00:00,,\n'
+        ))
+        output = self.run_import(path, '--chunk-size', '1')
+        self.assertIn('Imported 2 messages and 1 replies', output)
+        self.assertIn('rows/sec', output)
+        
+        ticket = Message.objects.get(external_id='csv:1')
+        self.assertEqual(ticket.status, 'replied')
+        self.assertEqual(ticket.fingerprint, message_fingerprint('jane@example.com', 'Locked out', 'I cannot log in.'))
+        self.assertEqual(ticket.attachment_name, 'manual.pdf')
+        self.assertEqual(ticket.attachment.read(), b'%PDF-1.4 manual')
+        reply = ticket.replies.get()
+        self.assertEqual(reply.admin, self.agent)
+        self.assertEqual(ticket.reply_count, 1)
+        self.assertEqual(ticket.last_reply_at, reply.timestamp)
+        
+        counters.invalidate()
+        self.assertEqual(counters.get_counts(), {'total': 2, 'new': 1, 'replied': 1})
+        self.assertEqual(list(get_search_backend().filter(Message.objects.all(), 'reset password')), [ticket])
+        
+        # A second run (e.g. after an interruption) only skips
+        output = self.run_import(path)
+        self.assertIn('Imported 0 messages and 0 replies', output)
+        self.assertIn('3 already imported', output)
+        self.assertEqual(Message.objects.count(), 2)
+        self.assertEqual(Reply.objects.count(), 1)
+    
+    def test_counts_only_inserted_rows(self):
+        path = self.write('tickets.csv', (
+            'id,parent_id,sender_name,sender_email,subject,body,status,timestamp,admin,attachment\n'
+            '1,,Jane Doe,jane@example.com,Locked out,I cannot log in.,new,2023-01-01T09:00:00,,\n'
+            '2,1,,,,We reset your password.,,2023-01-02T10:00:00,agent,\n'
+        ))
+        self.run_import(path)
+        
+        # As if a concurrent run inserted the rows after the already-imported check
+        with mock.patch.object(import_tickets.Command, 'new_records', lambda self, model, chunk: list(chunk)):
+            output = self.run_import(path)
+        self.assertIn('Imported 0 messages and 0 replies', output)
+        self.assertIn('2 already imported', output)
+    
+    def test_mbox_import_threads_staff_replies(self):
+        path = self.write('archive.mbox', (
+            'From jane@example.com Mon Jan  2 10:00:00 2023\n'
+            'From: Agent <agent@example.com>\n'
+            'To: jane@example.com\n'
+            'Subject: Re: Printer is broken\n'
+            'Message-ID: <reply-1@helpdesk>\n'
+            'In-Reply-To: <ticket-1@example.com>\n'
+            'References: <ticket-1@example.com>\n'
+            'Date: Mon, 02 Jan 2023 10:00:00 +0000\n'
+            '\n'
+            'Please restart it.\n'
+            '>From the manual: hold the power button.\n'
+            '\n'
+            'From jane@example.com Mon Jan  1 09:00:00 2023\n'
+            'From: Jane Doe <Jane@Example.com>\n'
+            'To: support@example.com\n'
+            'Subject: Printer is broken\n'
+            'Message-ID: <ticket-1@example.com>\n'
+            'Date: Sun, 01 Jan 2023 09:00:00 +0000\n'
+            'MIME-Version: 1.0\n'
+            'Content-Type: multipart/mixed; boundary="b"\n'
+            '\n'
+            '--b\n'
+            'Content-Type: text/plain\n'
+            '\n'
+            'It prints blank pages.\n'
+            '--b\n'
+            'Content-Type: text/plain\n'
+            'Content-Disposition: attachment; filename="../../error.log"\n'
+            '\n'
+            'paper jam\n'
+            '--b--\n'
+        ))
+        output = self.run_import(path)
+        self.assertIn('Imported 1 messages and 1 replies', output)
+        
+        ticket = Message.objects.get()
+        self.assertEqual(ticket.external_id, '<ticket-1@example.com>')
+        self.assertEqual(ticket.sender_email, 'jane@example.com')
+        self.assertEqual(ticket.message_body, 'It prints blank pages.')
+        self.assertEqual(ticket.status, 'replied')
+        self.assertEqual(ticket.attachment_name, 'error.log')
+        reply = ticket.replies.get()
+        self.assertEqual(reply.admin, self.agent)
+        self.assertIn('\nFrom the manual', reply.reply_body)
+    
+    def test_maildir_import(self):
+        for folder in ('cur', 'new', 'tmp'):
+            os.makedirs(os.path.join(self.tmp.name, 'maildir', folder))
+        self.write('maildir/new/1', (
+            'From: John Roe <john@example.com>\n'
+            'Subject: Refund\n'
+            'Message-ID: <refund@example.com>\n'
+            'Content-Type: text/html\n'
+            '\n'
+            '<p>Please refund order &amp; shipping.</p>\n'
+        ))
+        self.run_import(os.path.join(self.tmp.name, 'maildir'))
+        ticket = Message.objects.get()
+        self.assertEqual(ticket.subject, 'Refund')
+        self.assertEqual(ticket.message_body, 'Please refund order & shipping.')
+
+
+class ExportMessagesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user(username='lead', password='testpass', is_staff=True)
+        now = timezone.now()
+        self.messages = [
+            Message.objects.create(
+                sender_name=f"Sender {i}", sender_email=f"sender{i}@example.com",
+                subject=f"Printer {i}" if i % 2 else f"Billing {i}",
+                message_body="Details, with a comma and \"quotes\".",
+                timestamp=now - timedelta(minutes=i),
+            )
+            for i in range(5)
+        ]
+        Reply.objects.create(message=self.messages[1], admin=self.staff, reply_body="Try turning it off and on.")
+        self.messages[1].status = 'replied'
+        self.messages[1].save()
+        self.client.force_login(self.staff)
+    
+    def test_requires_staff(self):
+        self.client.force_login(User.objects.create_user(username='agent', password='testpass'))
+        response = self.client.get(reverse('export_messages'))
+        self.assertEqual(response.status_code, 302)
+    
+    def test_csv_export(self):
+        response = self.client.get(reverse('export_messages'))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment; filename="messages-', response['Content-Disposition'])
+        
+        rows = list(csv.DictReader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual([row['type'] for row in rows], ['message', 'message', 'reply', 'message', 'message', 'message'])
+        self.assertEqual(rows[0]['body'], 'Details, with a comma and "quotes".')
+        self.assertEqual(rows[2]['message_id'], str(self.messages[1].pk))
+        self.assertEqual(rows[2]['author'], 'lead')
+    
+    def test_filters_match_inbox(self):
+        response = self.client.get(reverse('export_messages'), {'format': 'jsonl', 'q': 'printer', 'status': 'new'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [self.messages[3].pk])
+        
+        response = self.client.get(reverse('export_messages'), {'format': 'jsonl', 'status': 'replied'})
+        (line,) = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(json.loads(line)['replies'][0]['body'], 'Try turning it off and on.')
+    
+    def test_gzip_export(self):
+        response = self.client.get(reverse('export_messages'), {'format': 'jsonl', 'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertTrue(response['Content-Disposition'].endswith('.jsonl.gz"'))
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(len(lines), 5)
+    
+    def test_rejects_unknown_format(self):
+        response = self.client.get(reverse('export_messages'), {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_reads_in_fixed_size_chunks(self):
+        with CaptureQueriesContext(connection) as queries:
+            ids = [message.pk for message in exports.iter_messages(Message.objects.all(), chunk_size=2)]
+        self.assertEqual(ids, [message.pk for message in self.messages])
+        # Three chunks: a message query each, plus a replies query for each non-empty chunk
+        self.assertEqual(len(queries), 6)
+    
+    async def test_streams_asynchronously_under_asgi(self):
+        await self.async_client.aforce_login(self.staff)
+        response = await self.async_client.get(reverse('export_messages'), {'format': 'jsonl'})
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(len(content.decode().splitlines()), 5)
+    
+    def test_command_writes_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'export.csv.gz')
+            call_command('export_messages', '--gzip', '--status', 'replied', '-o', path, stdout=mock.MagicMock())
+            with gzip.open(path, 'rt') as f:
+                rows = list(csv.DictReader(f))
+        self.assertEqual([row['type'] for row in rows], ['message', 'reply'])
+
+
+class ArchiveTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='admin', password='testpass', is_staff=True)
+        old = timezone.now() - timedelta(days=400)
+        self.old = Message.objects.create(
+            sender_name="Old Customer", sender_email="old@example.com",
+            subject="Printer jammed", message_body="The printer jams on every page.",
+            timestamp=old, status='replied',
+        )
+        Reply.objects.create(message=self.old, admin=self.user, reply_body="Replace the roller.", timestamp=old)
+        Message.objects.filter(pk=self.old.pk).update(last_activity_at=old)
+        self.recent = Message.objects.create(
+            sender_name="New Customer", sender_email="new@example.com",
+            subject="Printer offline", message_body="It shows offline.", status='replied',
+        )
+        self.unanswered = Message.objects.create(
+            sender_name="Waiting Customer", sender_email="wait@example.com",
+            subject="Printer question", message_body="Still waiting.", timestamp=old,
+        )
+        Message.objects.filter(pk=self.unanswered.pk).update(last_activity_at=old)
+        self.client.login(username='admin', password='testpass')
+    
+    def archive(self, **kwargs):
+        return archive.archive_batch(archive.cutoff_for(365), **kwargs)
+    
+    def test_moves_old_replied_threads(self):
+        self.assertEqual(self.archive(), 1)
+        self.assertEqual(self.archive(), 0)
+        
+        self.assertEqual(set(Message.objects.values_list('id', flat=True)), {self.recent.pk, self.unanswered.pk})
+        archived = ArchivedMessage.objects.get(pk=self.old.pk)
+        self.assertEqual(archived.message_body, "The printer jams on every page.")
+        self.assertEqual(archived.reply_count, 1)
+        self.assertEqual([reply.reply_body for reply in archived.replies.all()], ["Replace the roller."])
+        self.assertFalse(Reply.objects.exists())
+        self.assertEqual(counters.get_counts()['total'], 2)
+    
+    def test_compressed_bodies(self):
+        self.archive(compress=True)
+        archived = ArchivedMessage.objects.get(pk=self.old.pk)
+        self.assertEqual(archived.body, '')
+        self.assertEqual(archived.message_body, "The printer jams on every page.")
+        self.assertEqual(ArchivedReply.objects.get().reply_body, "Replace the roller.")
+    
+    def test_command_runs_in_batches(self):
+        for i in range(3):
+            message = Message.objects.create(
+                sender_name="Batch", sender_email="batch@example.com", subject=f"Batch {i}",
+                message_body="Done.", status='replied',
+            )
+            Message.objects.filter(pk=message.pk).update(last_activity_at=timezone.now() - timedelta(days=400))
+        
+        out = StringIO()
+        call_command('archive_messages', '--dry-run', stdout=out)
+        self.assertEqual(out.getvalue(), "4 messages would be archived.\n")
+        self.assertEqual(ArchivedMessage.objects.count(), 0)
+        
+        with CaptureQueriesContext(connection) as queries:
+            call_command('archive_messages', '--batch-size', '2', stdout=mock.MagicMock())
+        self.assertEqual(ArchivedMessage.objects.count(), 4)
+        self.assertEqual(Message.objects.count(), 2)
+        # Two full batches and an empty one
+        self.assertEqual(sum('FROM "helpdesk_app_message"' in query['sql'] and 'LIMIT 2' in query['sql']
+                             for query in queries.captured_queries), 3)
+    
+    def test_search_and_detail_reach_archive(self):
+        self.archive(compress=True)
+        
+        response = self.client.get(reverse('inbox'), {'q': 'roller'})
+        self.assertEqual(list(response.context['page_obj']), [])
+        self.assertEqual([message.pk for message in response.context['archived_matches']], [self.old.pk])
+        
+        response = self.client.get(reverse('inbox'), {'q': 'printer'})
+        self.assertEqual(len(response.context['page_obj']), 2)
+        self.assertEqual(len(response.context['archived_matches']), 1)
+        
+        response = self.client.get(reverse('message_detail', args=[self.old.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['archived'])
+        self.assertContains(response, "The printer jams on every page.")
+        self.assertContains(response, "Replace the roller.")
+        self.assertNotContains(response, 'Send Reply')
+        
+        response = self.client.post(reverse('message_detail', args=[self.old.pk]), {'reply_body': 'Hello'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ArchivedReply.objects.count(), 1)
+    
+    def test_rebuild_keeps_archived_rows(self):
+        self.archive(compress=True)
+        get_search_backend().rebuild()
+        self.assertEqual(
+            list(get_search_backend().filter(ArchivedMessage.objects.all(), 'roller')),
+            [ArchivedMessage.objects.get()],
+        )
+    
+    @override_settings(HELPDESK_SEARCH_BACKEND='helpdesk_app.search.InvertedIndexBackend')
+    def test_inverted_index_covers_archive(self):
+        self.archive(compress=True)
+        backend = get_search_backend()
+        backend.rebuild()
+        self.assertEqual(list(backend.filter(ArchivedMessage.objects.all(), 'jams')), [ArchivedMessage.objects.get()])
+        self.assertEqual(list(backend.filter(Message.objects.all(), 'jams')), [])
+
+
+class RequestMetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        SystemSettings.invalidate_cache()
+        for histogram in metrics.HISTOGRAMS:
+            histogram.clear()
+        self.staff = User.objects.create_user(username='admin', password='testpass', is_staff=True)
+        Message.objects.create(
+            sender_name="John Doe", sender_email="john@example.com",
+            subject="Printer", message_body="It is broken.",
+        )
+        self.client.force_login(self.staff)
+    
+    def series(self, histogram, view):
+        return histogram._series[view]
+    
+    def test_records_per_view(self):
+        self.client.get(reverse('inbox'))
+        self.client.get(reverse('inbox'))
+        
+        self.assertEqual(sum(self.series(metrics.REQUEST_SECONDS, 'inbox')[:-1]), 2)
+        self.assertGreater(self.series(metrics.DB_QUERIES, 'inbox')[-1], 0)
+        self.assertGreater(self.series(metrics.DB_SECONDS, 'inbox')[-1], 0)
+        self.assertGreater(self.series(metrics.TEMPLATE_SECONDS, 'inbox')[-1], 0)
+        self.assertEqual(self.series(metrics.EMAIL_SECONDS, 'inbox')[-1], 0)
+    
+    @override_settings(EMAIL_OUTBOX_ENABLED=False, RATELIMIT_ENABLE=False)
+    def test_records_email_time(self):
+        self.client.post(reverse('contact'), AsyncViewsTest.contact_data)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertGreater(self.series(metrics.EMAIL_SECONDS, 'contact')[-1], 0)
+    
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('inbox'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        content = response.content.decode()
+        self.assertIn('# TYPE helpdesk_request_duration_seconds histogram', content)
+        self.assertIn('helpdesk_request_duration_seconds_bucket{view="inbox",le="+Inf"} 1', content)
+        self.assertIn('helpdesk_request_duration_seconds_count{view="inbox"} 1', content)
+        self.assertIn('helpdesk_db_queries_per_request_sum{view="inbox"}', content)
+    
+    def test_metrics_requires_staff(self):
+        self.client.force_login(User.objects.create_user(username='agent', password='testpass'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 302)
+    
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('test_seconds', 'Test', (0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe('x', value)
+        lines = histogram.render().splitlines()
+        self.assertIn('test_seconds_bucket{view="x",le="0.1"} 2', lines)
+        self.assertIn('test_seconds_bucket{view="x",le="1"} 3', lines)
+        self.assertIn('test_seconds_bucket{view="x",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_count{view="x"} 4', lines)
+    
+    @override_settings(SLOW_REQUEST_THRESHOLD_MS=0)
+    def test_slow_request_log(self):
+        with self.assertLogs('helpdesk_app.middleware', 'WARNING') as logs:
+            self.client.get(reverse('inbox'))
+        (record,) = [record for record in logs.records if 'Slow request' in record.getMessage()]
+        self.assertIn('GET /inbox/ (inbox)', record.getMessage())
+        self.assertEqual(record.status, 200)
+        self.assertTrue(any('SELECT' in query['sql'] for query in record.slow_queries))
+    
+    def test_request_log_line(self):
+        with self.assertLogs('helpdesk_app.requests', 'INFO') as logs:
+            self.client.get(reverse('inbox'))
+        (record,) = logs.records
+        self.assertEqual(record.getMessage(), 'GET /inbox/ 200')
+        self.assertEqual((record.view, record.status), ('inbox', 200))
+        self.assertGreater(record.queries, 0)
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.threads = set()
+    
+    def emit(self, record):
+        self.records.append(record)
+        self.threads.add(threading.current_thread())
+
+
+class LoggingPipelineTest(TestCase):
+    def make_record(self, level=logging.INFO, msg='%s %s', args=('GET', '/inbox/'), **extra):
+        record = logging.LogRecord('helpdesk_app.requests', level, __file__, 1, msg, args, None)
+        record.__dict__.update(extra)
+        return record
+    
+    def test_json_formatter(self):
+        entry = json.loads(JSONFormatter().format(self.make_record(status=200, view='inbox')))
+        self.assertEqual(entry['message'], 'GET /inbox/')
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['logger'], 'helpdesk_app.requests')
+        self.assertEqual((entry['status'], entry['view']), (200, 'inbox'))
+        self.assertNotIn('args', entry)
+    
+    def test_json_formatter_includes_traceback(self):
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            record = logging.LogRecord('x', logging.ERROR, __file__, 1, 'failed', (), sys.exc_info())
+        entry = json.loads(JSONFormatter().format(record))
+        self.assertIn('ZeroDivisionError', entry['exc_info'])
+    
+    def test_queue_handler_emits_on_listener_thread(self):
+        target = _ListHandler()
+        handler = QueueListenerHandler([target])
+        items = ['first']
+        handler.handle(self.make_record(msg='%s', args=(items,)))
+        items.append('changed later')
+        handler.close()
+        
+        (record,) = target.records
+        self.assertEqual(record.getMessage(), "['first']")
+        self.assertNotIn(threading.current_thread(), target.threads)
+    
+    def test_sampling_filter(self):
+        drop_all = SamplingFilter(0)
+        self.assertFalse(drop_all.filter(self.make_record()))
+        self.assertTrue(drop_all.filter(self.make_record(level=logging.WARNING)))
+        self.assertTrue(SamplingFilter(1).filter(self.make_record()))
+        with mock.patch('helpdesk_app.log.random.random', return_value=0.3):
+            self.assertTrue(SamplingFilter(0.5).filter(self.make_record()))
+            self.assertFalse(SamplingFilter(0.2).filter(self.make_record()))
+    
+    def test_settings_use_queued_pipeline(self):
+        (handler,) = logging.getLogger('helpdesk_app').handlers
+        self.assertIsInstance(handler, QueueListenerHandler)
+        self.assertTrue(all(isinstance(target.formatter, JSONFormatter) for target in handler.listener.handlers))
+
+
+class PageCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        pagecache.clear()
+        SystemSettings.invalidate_cache()
+    
+    def csrf_input(self, response):
+        return re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', response.content.decode()).group(1)
+    
+    def test_home_is_rendered_once_and_revalidated(self):
+        with mock.patch('helpdesk_app.pagecache.render_to_string', wraps=pagecache.render_to_string) as rendered:
+            first = self.client.get(reverse('home'))
+            with self.assertNumQueries(0):
+                second = self.client.get(reverse('home'))
+        self.assertEqual(rendered.call_count, 1)
+        self.assertEqual(first.content, second.content)
+        self.assertContains(first, 'Login')
+        self.assertEqual(first['Cache-Control'], 'no-cache')
+        self.assertIn('Cookie', first['Vary'])
+        
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(reverse('home'), HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+    
+    def test_logged_in_users_bypass_cache(self):
+        self.client.get(reverse('home'))
+        self.client.force_login(User.objects.create_user(username='agent', password='testpass'))
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'Inbox')
+        self.assertNotIn('ETag', response)
+    
+    def test_new_release_renders_again(self):
+        first = self.client.get(reverse('home'))
+        with override_settings(RELEASE_VERSION='next-release'):
+            response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)  # same content, same validator
+        with mock.patch('helpdesk_app.pagecache.render_to_string', return_value='changed') as rendered:
+            with override_settings(RELEASE_VERSION='another-release'):
+                response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(rendered.call_count, 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'changed')
+    
+    def test_contact_injects_a_working_csrf_token(self):
+        first_visitor = Client(enforce_csrf_checks=True)
+        second_visitor = Client(enforce_csrf_checks=True)
+        first = first_visitor.get(reverse('contact'))
+        second = second_visitor.get(reverse('contact'))
+        
+        self.assertNotIn(pagecache.CSRF_PLACEHOLDER, first.content.decode())
+        self.assertNotEqual(first['ETag'], second['ETag'])
+        self.assertNotIn('Last-Modified', first)
+        self.assertIn('private', first['Cache-Control'])
+        
+        response = first_visitor.post(reverse('contact'), {
+            **AsyncViewsTest.contact_data, 'csrfmiddlewaretoken': self.csrf_input(first),
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Message.objects.count(), 1)
+    
+    def test_contact_revalidates_per_csrf_cookie(self):
+        visitor = Client()
+        first = visitor.get(reverse('contact'))
+        response = visitor.get(reverse('contact'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        
+        # Same page, but the cookie no longer matches the token the browser has
+        response = Client().get(reverse('contact'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+    
+    def test_flash_messages_are_not_cached(self):
+        self.client.post(reverse('contact'), AsyncViewsTest.contact_data)
+        response = self.client.get(reverse('contact'))
+        self.assertContains(response, 'Thank you for your message!')
+        self.assertNotIn('ETag', response)
+
+
+class MessagePreviewTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_superuser(username='admin', password='testpass', email='admin@example.com')
+        self.message = Message.objects.create(
+            sender_name="John Doe", sender_email="john@example.com", subject="Crash log",
+            message_body="The app crashed. Log follows:\n" + "ERROR something failed\n" * 5000,
+        )
+        self.client.force_login(self.user)
+    
+    def test_preview_is_stored_on_save(self):
+        self.assertEqual(len(self.message.body_preview.split()), 15)
+        self.assertTrue(self.message.body_preview.startswith("The app crashed. Log follows: ERROR"))
+        self.assertTrue(self.message.body_preview.endswith('…'))
+        
+        self.message.message_body = "Short one."
+        self.message.save()
+        self.assertEqual(Message.objects.get(pk=self.message.pk).body_preview, "Short one.")
+    
+    def test_preview_of_long_unbroken_text(self):
+        self.assertEqual(message_preview("short"), "short")
+        preview = message_preview("x" * 5000)
+        self.assertEqual(len(preview), 255)
+        self.assertTrue(preview.endswith('…'))
+    
+    def test_saving_a_deferred_instance_keeps_the_preview(self):
+        message = Message.objects.defer('message_body').get(pk=self.message.pk)
+        message.status = 'replied'
+        message.save()
+        self.assertEqual(Message.objects.get(pk=self.message.pk).body_preview, self.message.body_preview)
+    
+    def assertBodyNotLoaded(self, queries):
+        for query in queries.captured_queries:
+            self.assertNotIn('"helpdesk_app_message"."message_body"', query['sql'])
+    
+    def test_inbox_does_not_load_bodies(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('inbox'))
+        self.assertContains(response, self.message.body_preview)
+        self.assertBodyNotLoaded(queries)
+        
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('inbox'), {'q': 'crashed', 'sort': 'relevance'})
+        self.assertBodyNotLoaded(queries)
+    
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_admin_changelist_does_not_load_bodies(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:helpdesk_app_message_changelist'))
+        self.assertEqual(response.status_code, 200)
+        self.assertBodyNotLoaded(queries)
+        
+        response = self.client.get(reverse('admin:helpdesk_app_message_change', args=[self.message.pk]))
+        self.assertContains(response, 'ERROR something failed')
+
+
+class DuplicateSubmissionTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        dedup.clear()
+        SystemSettings.invalidate_cache()
+    
+    def tearDown(self):
+        dedup.clear()
+    
+    def post(self, follow=False, **changes):
+        # Saved messages are remembered once their transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('contact'), {**AsyncViewsTest.contact_data, **changes}, follow=follow)
+    
+    def test_fingerprint_ignores_case_and_whitespace(self):
+        self.assertEqual(
+            message_fingerprint('John@Example.com ', 'Need  help', 'My account\nis locked.'),
+            message_fingerprint('john@example.com', 'need help', 'my account is locked.'),
+        )
+        self.assertNotEqual(
+            message_fingerprint('john@example.com', 'Need help', 'Body'),
+            message_fingerprint('john@example.com', 'Need help', 'Other body'),
+        )
+    
+    def test_resubmission_is_merged(self):
+        response = self.post()
+        self.assertRedirects(response, reverse('contact'), fetch_redirect_response=False)
+        response = self.post(message_body='  MY ACCOUNT is locked out.  ', follow=True)
+        self.assertContains(response, 'Thank you for your message!')
+        
+        message = Message.objects.get()
+        self.assertEqual(message.duplicate_count, 1)
+        self.assertEqual(message.fingerprint, message_fingerprint(
+            'john@example.com', 'Need help', 'My account is locked out.',
+        ))
+        # Only the first submission sent the auto-response and admin notification
+        self.assertEqual(OutgoingEmail.objects.count(), 2)
+    
+    def test_duplicate_found_without_process_memory(self):
+        self.post()
+        dedup.clear()
+        fingerprint = Message.objects.get().fingerprint
+        with self.assertNumQueries(2):
+            self.assertIsNotNone(dedup.merge_duplicate(fingerprint))
+        self.assertEqual(Message.objects.get().duplicate_count, 1)
+    
+    def test_remembered_duplicate_needs_no_lookup(self):
+        self.post()
+        fingerprint = Message.objects.get().fingerprint
+        with self.assertNumQueries(1):
+            self.assertIsNotNone(dedup.merge_duplicate(fingerprint))
+    
+    def test_different_or_old_submissions_are_new(self):
+        self.post()
+        self.post(subject='Still need help')
+        self.assertEqual(Message.objects.count(), 2)
+        
+        Message.objects.update(timestamp=timezone.now() - timedelta(hours=1))
+        dedup.clear()
+        self.post()
+        self.assertEqual(Message.objects.count(), 3)
+        self.assertFalse(Message.objects.filter(duplicate_count__gt=0).exists())
+    
+    def test_deleted_message_is_not_merged_into(self):
+        self.post()
+        Message.objects.all().delete()
+        self.post()
+        self.assertEqual(Message.objects.get().duplicate_count, 0)
+    
+    @override_settings(DUPLICATE_WINDOW_SECONDS=0)
+    def test_disabled(self):
+        self.post()
+        self.post()
+        self.assertEqual(Message.objects.count(), 2)
+
+
+class AttachmentPreviewTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        dedup.clear()
+        SystemSettings.invalidate_cache()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(username='agent', password='testpass')
+    
+    def tearDown(self):
+        dedup.clear()
+    
+    def png(self, size=(1200, 800)):
+        from PIL import Image
+        
+        output = BytesIO()
+        Image.new('RGBA', size, (200, 30, 30, 128)).save(output, 'PNG')
+        return output.getvalue()
+    
+    def create_message(self, filename, content):
+        return Message.objects.create(
+            sender_name="Jane Doe", sender_email="jane@example.com", subject=f"About {filename}",
+            message_body="See attached.", attachment=SimpleUploadedFile(filename, content),
+        )
+    
+    def test_contact_form_only_queues_the_preview(self):
+        attachment = SimpleUploadedFile('screenshot.png', self.png(), content_type='image/png')
+        with mock.patch.object(previews, 'render') as render:
+            response = self.client.post(reverse('contact'), {**AsyncViewsTest.contact_data, 'attachment': attachment})
+        self.assertEqual(response.status_code, 302)
+        render.assert_not_called()
+        
+        message = Message.objects.get()
+        self.assertEqual(message.preview_status, 'pending')
+        self.assertFalse(message.attachment.storage.exists(previews.preview_name(message.attachment.name)))
+    
+    def test_status_follows_the_attachment(self):
+        self.assertEqual(self.create_message('manual.pdf', b'%PDF').preview_status, '')
+        message = self.create_message('notes.txt', b'notes')
+        self.assertEqual(message.preview_status, 'pending')
+        
+        Message.objects.filter(pk=message.pk).update(preview_status='ready')
+        message = Message.objects.get(pk=message.pk)
+        message.status = 'replied'
+        message.save()
+        self.assertEqual(Message.objects.get(pk=message.pk).preview_status, 'ready')
+        
+        message.attachment = SimpleUploadedFile('photo.jpg', self.png())
+        message.save()
+        self.assertEqual(Message.objects.get(pk=message.pk).preview_status, 'pending')
+    
+    def test_worker_renders_thumbnails_in_processes(self):
+        from PIL import Image
+        
+        message = self.create_message('screenshot.png', self.png())
+        out = StringIO()
+        call_command('process_attachment_previews', '--once', '--workers', '1', stdout=out)
+        self.assertIn('ready=1 failed=0', out.getvalue())
+        
+        message.refresh_from_db()
+        self.assertEqual(message.preview_status, 'ready')
+        thumbnail_name = previews.preview_name(message.attachment.name)
+        self.assertEqual(thumbnail_name, f'{message.attachment.name}.thumb.jpg')
+        with message.attachment.storage.open(thumbnail_name) as thumbnail:
+            image = Image.open(thumbnail)
+            self.assertEqual(image.format, 'JPEG')
+            self.assertEqual(image.size, (320, 213))
+        
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('message_detail', args=[message.pk]))
+        self.assertContains(response, reverse('attachment_preview', args=[message.pk]))
+        
+        response = self.client.get(reverse('attachment_preview', args=[message.pk]))
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('max-age=86400', response['Cache-Control'])
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'\xff\xd8'))
+    
+    def test_text_excerpt_is_shown_from_the_cache(self):
+        lines = [f"line {number}" for number in range(1, 101)]
+        message = self.create_message('server.log', '\n'.join(lines).encode())
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            self.assertEqual(previews.process_pending(executor), {'ready': 1, 'failed': 0})
+        
+        self.client.force_login(self.user)
+        message.attachment.storage.delete(previews.preview_name(message.attachment.name))
+        response = self.client.get(reverse('message_detail', args=[message.pk]))
+        self.assertContains(response, 'line 40')
+        self.assertNotContains(response, 'line 41')
+        
+        response = self.client.get(reverse('attachment_preview', args=[message.pk]))
+        self.assertEqual(response.status_code, 404)
+    
+    def test_identical_attachments_share_a_preview(self):
+        first = self.create_message('screenshot.png', self.png())
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            previews.process_pending(executor)
+            second = self.create_message('same screenshot.png', self.png())
+            self.assertEqual(second.attachment.name, first.attachment.name)
+            with mock.patch.object(previews, 'render') as render:
+                self.assertEqual(previews.process_pending(executor), {'ready': 1, 'failed': 0})
+        render.assert_not_called()
+        second.refresh_from_db()
+        self.assertEqual(second.preview_status, 'ready')
+    
+    def test_undecodable_images_fail(self):
+        message = self.create_message('broken.jpg', b'not an image')
+        with ThreadPoolExecutor(max_workers=1) as executor, self.assertLogs('helpdesk_app.previews', 'WARNING'):
+            self.assertEqual(previews.process_pending(executor), {'ready': 0, 'failed': 1})
+        message.refresh_from_db()
+        self.assertEqual(message.preview_status, 'failed')
+        
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('message_detail', args=[message.pk]))
+        self.assertNotContains(response, reverse('attachment_preview', args=[message.pk]))
+        self.assertContains(response, reverse('attachment_download', args=[message.pk]))
+
+
+class ContentAddressedStorageTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.media_root = media_root.name
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+    
+    def create_message(self, filename, content, subject="Invoice"):
+        return Message.objects.create(
+            sender_name="Jane Doe", sender_email="jane@example.com", subject=subject,
+            message_body="See attached.", attachment=SimpleUploadedFile(filename, content),
+        )
+    
+    def blob(self, name):
+        return StoredBlob.objects.get(name=name)
+    
+    def test_identical_uploads_are_stored_once(self):
+        first = self.create_message('Invoice.PDF', b'%PDF invoice')
+        second = self.create_message('copy of invoice.pdf', b'%PDF invoice')
+        other = self.create_message('invoice.pdf', b'%PDF another invoice')
+        
+        self.assertRegex(first.attachment.name, r'^attachments/([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}\.pdf$')
+        self.assertEqual(second.attachment.name, first.attachment.name)
+        self.assertNotEqual(other.attachment.name, first.attachment.name)
+        self.assertEqual(len(os.listdir(os.path.dirname(first.attachment.path))), 1)
+        
+        blob = self.blob(first.attachment.name)
+        self.assertEqual((blob.ref_count, blob.size), (2, len(b'%PDF invoice')))
+        self.assertEqual((first.attachment_name, second.attachment_name), ('Invoice.PDF', 'copy of invoice.pdf'))
+        
+        # Downloads keep each upload's own filename
+        self.client.force_login(User.objects.create_user(username='agent', password='testpass'))
+        response = self.client.get(reverse('attachment_download', args=[second.pk]))
+        self.assertEqual(response['Content-Disposition'], 'inline; filename="copy of invoice.pdf"')
+    
+    def test_deleting_releases_and_garbage_collection_removes_unused_files(self):
+        first = self.create_message('photo.png', b'png bytes')
+        second = self.create_message('photo.png', b'png bytes')
+        name = first.attachment.name
+        
+        first.delete()
+        self.assertEqual(self.blob(name).ref_count, 1)
+        second.delete()
+        self.assertEqual(self.blob(name).ref_count, 0)
+        self.assertEqual(storage.collect_garbage(), {'deleted': 0, 'recounted': 0, 'orphans': 0})
+        self.assertTrue(storage.attachment_storage.exists(name))
+        
+        storage.attachment_storage.save_derived(previews.preview_name(name), ContentFile(b'thumbnail'))
+        out = StringIO()
+        call_command('collect_attachment_garbage', '--grace-hours', '0', stdout=out)
+        self.assertIn('Deleted 1 unused', out.getvalue())
+        self.assertFalse(StoredBlob.objects.exists())
+        self.assertFalse(storage.attachment_storage.exists(name))
+        self.assertFalse(storage.attachment_storage.exists(previews.preview_name(name)))
+    
+    def test_garbage_collection_recounts_blobs_still_in_use(self):
+        message = self.create_message('notes.txt', b'notes')
+        StoredBlob.objects.update(ref_count=0, released_at=timezone.now())
+        
+        self.assertEqual(storage.collect_garbage(timedelta(0)), {'deleted': 0, 'recounted': 1, 'orphans': 0})
+        self.assertEqual(self.blob(message.attachment.name).ref_count, 1)
+        self.assertTrue(storage.attachment_storage.exists(message.attachment.name))
+    
+    def test_orphaned_files_are_removed(self):
+        with transaction.atomic():
+            name = storage.attachment_storage.save('attachments/lost.pdf', ContentFile(b'rolled back'))
+            transaction.set_rollback(True)
+        self.assertTrue(storage.attachment_storage.exists(name))
+        
+        self.assertEqual(storage.collect_garbage(timedelta(hours=1))['orphans'], 0)
+        self.assertEqual(storage.collect_garbage(timedelta(0))['orphans'], 1)
+        self.assertFalse(storage.attachment_storage.exists(name))
+    
+    def test_replacing_an_attachment_releases_the_old_file(self):
+        message = self.create_message('v1.txt', b'first draft')
+        old_name = message.attachment.name
+        message.attachment = SimpleUploadedFile('v2.txt', b'second draft')
+        message.save()
+        
+        self.assertEqual(self.blob(old_name).ref_count, 0)
+        self.assertEqual(self.blob(message.attachment.name).ref_count, 1)
+        self.assertEqual(message.attachment_name, 'v2.txt')
+    
+    def test_archived_attachments_keep_their_count(self):
+        message = self.create_message('contract.pdf', b'%PDF contract')
+        Message.objects.filter(pk=message.pk).update(
+            status='replied', last_activity_at=timezone.now() - timedelta(days=400),
+        )
+        archive.archive_batch(archive.cutoff_for(365))
+        
+        archived = ArchivedMessage.objects.get(pk=message.pk)
+        self.assertEqual((archived.attachment.name, archived.attachment_name), (message.attachment.name, 'contract.pdf'))
+        self.assertEqual(self.blob(message.attachment.name).ref_count, 1)
+        
+        archived.delete()
+        self.assertEqual(self.blob(message.attachment.name).ref_count, 0)
+    
+    def test_migrating_legacy_files(self):
+        legacy_dir = os.path.join(self.media_root, 'attachments')
+        os.makedirs(legacy_dir)
+        for filename in ('scan.png', 'scan_a1b2c3.png', 'scan.png.thumb.jpg'):
+            with open(os.path.join(legacy_dir, filename), 'wb') as f:
+                f.write(b'thumbnail' if filename.endswith('.jpg') else b'scanned page')
+        first = self.create_message('readme.md', b'readme')
+        second = self.create_message('readme.md', b'readme', subject="Second")
+        Message.objects.filter(pk=first.pk).update(attachment='attachments/scan.png', attachment_name='', preview_status='ready')
+        Message.objects.filter(pk=second.pk).update(attachment='attachments/scan_a1b2c3.png', attachment_name='')
+        
+        out = StringIO()
+        call_command('migrate_attachment_storage', stdout=out)
+        self.assertIn('Moved 2 attachments into 1 stored files', out.getvalue())
+        
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertTrue(storage.is_blob_name(first.attachment.name))
+        self.assertEqual(second.attachment.name, first.attachment.name)
+        self.assertEqual((first.attachment_name, second.attachment_name), ('scan.png', 'scan_a1b2c3.png'))
+        self.assertEqual(self.blob(first.attachment.name).ref_count, 2)
+        self.assertEqual(first.attachment.read(), b'scanned page')
+        # The rendered thumbnail moved along; the old files are gone
+        self.assertTrue(storage.attachment_storage.exists(previews.preview_name(first.attachment.name)))
+        for filename in ('scan.png', 'scan_a1b2c3.png', 'scan.png.thumb.jpg'):
+            self.assertFalse(os.path.exists(os.path.join(legacy_dir, filename)))
+
+
+class InboundMailTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=os.path.join(self.tmp.name, 'media'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.maildir = os.path.join(self.tmp.name, 'maildir')
+        for folder in ('cur', 'new', 'tmp'):
+            os.makedirs(os.path.join(self.maildir, folder))
+        self.ticket = Message.objects.create(
+            sender_name="Jane Doe", sender_email="jane@example.com",
+            subject="Printer is broken", message_body="It prints blank pages.", status='replied',
+        )
+    
+    def deliver(self, name, headers, body='Thanks, that helped.'):
+        with open(os.path.join(self.maildir, 'new', name), 'w') as f:
+            f.write(headers + '\n' + body + '\n')
+    
+    def run_ingest(self, *args):
+        output = StringIO()
+        call_command('ingest_mail', '--maildir', self.maildir, *args, stdout=output)
+        return output.getvalue()
+    
+    def test_subject_helpers(self):
+        self.assertEqual(mailparse.tagged_ticket_id('Re: Printer is broken [#42]'), 42)
+        self.assertIsNone(mailparse.tagged_ticket_id('Printer is broken'))
+        self.assertEqual(mailparse.base_subject('AW: RE[2]:  Printer is broken [#42]'), 'Printer is broken')
+        self.assertTrue(mailparse.is_reply_subject('Fwd: Re: x'))
+        self.assertFalse(mailparse.is_reply_subject('Regarding x'))
+    
+    def test_answer_to_helpdesk_reply_is_threaded(self):
+        subject = EmailService.compose_reply(self.ticket, Reply(reply_body='Try again.'))[1]
+        self.deliver('1', (
+            'From: Jane Doe <Jane@example.com>\n'
+            f'Subject: Re: {subject}\n'
+            'Message-ID: <answer-1@example.com>\n'
+            'Date: Mon, 02 Jan 2023 10:00:00 +0000\n'
+        ))
+        output = self.run_ingest()
+        self.assertIn('Ingested 0 messages and 1 replies', output)
+        
+        reply = Reply.objects.get()
+        self.assertEqual(reply.message, self.ticket)
+        self.assertTrue(reply.is_inbound)
+        self.assertIsNone(reply.admin)
+        self.assertEqual(reply.reply_body, 'Thanks, that helped.')
+        ticket = Message.objects.get(pk=self.ticket.pk)
+        self.assertEqual(ticket.status, 'new')
+        self.assertEqual(ticket.reply_count, 1)
+        counters.invalidate()
+        self.assertEqual(counters.get_counts(), {'total': 1, 'new': 1, 'replied': 0})
+        self.assertEqual(list(get_search_backend().filter(Message.objects.all(), 'helped')), [self.ticket])
+        
+        # Ingested mail moves to cur/, so the next run finds nothing
+        self.assertEqual(os.listdir(os.path.join(self.maildir, 'cur')), ['1:2,S'])
+        self.assertIn('Ingested 0 messages and 0 replies', self.run_ingest())
+    
+    def test_tag_from_another_sender_opens_a_ticket(self):
+        self.deliver('1', (
+            'From: Mallory <mallory@example.com>\n'
+            f'Subject: Re: Printer is broken [#{self.ticket.pk}]\n'
+            'Message-ID: <sneaky@example.com>\n'
+        ))
+        self.run_ingest()
+        self.assertFalse(Reply.objects.exists())
+        self.assertEqual(Message.objects.get(sender_email='mallory@example.com').external_id, '<sneaky@example.com>')
+    
+    def test_new_tickets_and_follow_ups_in_one_batch(self):
+        self.deliver('1', (
+            'From: John Roe <john@example.com>\n'
+            'Subject: Refund\n'
+            'Message-ID: <refund@example.com>\n'
+            'Date: Mon, 02 Jan 2023 09:00:00 +0000\n'
+            'MIME-Version: 1.0\n'
+            'Content-Type: multipart/mixed; boundary="b"\n'
+        ), (
+            '--b\n'
+            'Content-Type: text/plain\n'
+            '\n'
+            'Please refund order 7.\n'
+            '--b\n'
+            'Content-Type: text/plain\n'
+            'Content-Disposition: attachment; filename="receipt.txt"\n'
+            '\n'
+            'order 7\n'
+            '--b--'
+        ))
+        self.deliver('2', (
+            'From: John Roe <john@example.com>\n'
+            'Subject: Re: Refund\n'
+            'Message-ID: <refund-2@example.com>\n'
+            'In-Reply-To: <refund@example.com>\n'
+            'Date: Mon, 02 Jan 2023 09:30:00 +0000\n'
+        ), 'Any news?')
+        self.deliver('3', (
+            'From: Jane Doe <jane@example.com>\n'
+            'Subject: RE: Printer is broken\n'
+            'Message-ID: <printer-2@example.com>\n'
+            'Date: Mon, 02 Jan 2023 10:00:00 +0000\n'
+        ))
+        self.deliver('4', 'From: Helpdesk <noreply@example.com>\nSubject: Thank you\n')
+        
+        stats = inbound.ingest(inbound.MaildirSource(self.maildir))
+        self.assertEqual(stats, {'messages': 1, 'replies': 2, 'skipped': 0, 'ignored': 1})
+        
+        refund = Message.objects.get(external_id='<refund@example.com>')
+        self.assertEqual(refund.message_body, 'Please refund order 7.')
+        self.assertEqual(refund.fingerprint, message_fingerprint('john@example.com', 'Refund', 'Please refund order 7.'))
+        self.assertEqual(refund.attachment_name, 'receipt.txt')
+        self.assertEqual(refund.replies.get().reply_body, 'Any news?')
+        self.assertEqual(self.ticket.replies.get().external_id, '<printer-2@example.com>')
+    
+    def test_reply_attachment_download(self):
+        self.deliver('1', (
+            'From: jane@example.com\n'
+            f'Subject: Re: Printer is broken [#{self.ticket.pk}]\n'
+            'MIME-Version: 1.0\n'
+            'Content-Type: multipart/mixed; boundary="b"\n'
+        ), (
+            '--b\n'
+            'Content-Type: text/plain\n'
+            '\n'
+            'Photo attached.\n'
+            '--b\n'
+            'Content-Type: text/plain\n'
+            'Content-Disposition: attachment; filename="photo.txt"\n'
+            '\n'
+            'pixels\n'
+            '--b--'
+        ))
+        self.run_ingest()
+        reply = Reply.objects.get()
+        self.client.force_login(User.objects.create_user(username='agent', password='testpass'))
+        
+        response = self.client.get(reverse('message_detail', args=[self.ticket.pk]))
+        self.assertContains(response, reverse('reply_attachment_download', args=[reply.pk]))
+        self.assertContains(response, 'Customer')
+        response = self.client.get(reverse('reply_attachment_download', args=[reply.pk]))
+        self.assertEqual(b''.join(response.streaming_content), b'pixels')
+
+
+@override_settings(LIVE_INBOX_POLL_INTERVAL=0.01)
+class LiveInboxTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='agent', password='testpass')
+        self.message = Message.objects.create(
+            sender_name="Jane Doe", sender_email="jane@example.com",
+            subject="Question", message_body="I have a question.",
+        )
+        self.client.force_login(self.user)
+    
+    def create_message(self, subject):
+        # Versions are bumped when the transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            return Message.objects.create(
+                sender_name="John Roe", sender_email="john@example.com",
+                subject=subject, message_body="Another question.",
+            )
+    
+    def test_changes_stamp_updated_at_and_bump_the_version(self):
+        before = self.message.updated_at
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.filter(pk=self.message.pk).set_status('replied')
+        self.assertGreater(Message.objects.get(pk=self.message.pk).updated_at, before)
+        version = cache.get(live.VERSION_KEY)
+        self.assertIsNotNone(version)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            Reply.objects.create(message=self.message, admin=self.user, reply_body="Answer.")
+        self.assertGreater(cache.get(live.VERSION_KEY), version)
+    
+    def test_changes_endpoint(self):
+        response = self.client.get(reverse('inbox'))
+        cursor = response.context['live']['cursor']
+        new = self.create_message("Follow-up")
+        
+        response = self.client.get(reverse('inbox_changes'), {'since': cursor})
+        changes = response.json()
+        self.assertEqual(changes['counts'], {'total': 2, 'new': 2, 'replied': 0})
+        self.assertFalse(changes['truncated'])
+        self.assertEqual(changes['messages'][-1]['id'], new.pk)
+        self.assertIn(f'data-message-id="{new.pk}"', changes['messages'][-1]['html'])
+        self.assertEqual(live.parse_cursor(changes['cursor']), new.updated_at)
+        
+        self.assertEqual(self.client.get(reverse('inbox_changes'), {'since': 'yesterday'}).status_code, 400)
+    
+    def test_events_need_asgi(self):
+        self.assertEqual(self.client.get(reverse('inbox_events')).status_code, 204)
+    
+    async def test_event_stream(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('inbox_events'), {'since': timezone.now().isoformat()})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = response.streaming_content
+        try:
+            self.assertTrue((await anext(stream)).startswith(b'retry:'))
+            # Changes before connecting are sent right away
+            first = await anext(stream)
+            self.assertIn(b'event: changes', first)
+            self.assertNotIn(b'Follow-up', first)
+            
+            new = await sync_to_async(self.create_message)("Follow-up")
+            event = await asyncio.wait_for(anext(stream), 5)
+            self.assertIn(b'event: changes', event)
+            changes = json.loads(event.decode().split('data: ', 1)[1])
+            # Recent rows before the cursor come again, in case they committed late
+            self.assertEqual(changes['messages'][-1]['id'], new.pk)
+        finally:
+            await stream.aclose()
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class QueryBudgetTest(TestCase):
+    """Exact number of queries per page, which must not grow with the data shown"""
+    
+    def setUp(self):
+        cache.clear()
+        SystemSettings.load()
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'testpass')
+        self.agents = [User.objects.create_user(f'agent{i}', password='testpass') for i in range(3)]
+        self.message = self.add_messages(25)[0]
+        self.client.force_login(self.admin)
+    
+    def add_messages(self, count):
+        """New messages about printers, every other one answered by a different agent"""
+        start = Message.objects.count()
+        messages = []
+        for n in range(start, start + count):
+            message = Message.objects.create(
+                sender_name=f"Sender {n}", sender_email=f"sender{n}@example.com",
+                subject=f"Printer {n}", message_body=f"The printer on floor {n} is jammed.",
+            )
+            if n % 2:
+                Reply.objects.create(message=message, admin=self.agents[n % 3], reply_body="On it.")
+            messages.append(message)
+        return messages
+    
+    def assertQueryBudget(self, queries, get):
+        """get() runs in exactly `queries` queries, before and after more rows are added"""
+        for more in (0, 30):
+            self.add_messages(more)
+            # Budgets are for cold caches, the worst case
+            cache.clear()
+            SystemSettings.invalidate_cache()
+            with self.assertNumQueries(queries):
+                response = get()
+            self.assertEqual(response.status_code, 200)
+    
+    def test_inbox(self):
+        self.assertQueryBudget(5, lambda: self.client.get(reverse('inbox')))
+    
+    def test_inbox_filtered(self):
+        self.assertQueryBudget(5, lambda: self.client.get(reverse('inbox'), {'status': 'new'}))
+        self.assertQueryBudget(5, lambda: self.client.get(reverse('inbox'), {'sort': 'activity'}))
+    
+    def test_inbox_searched(self):
+        self.assertQueryBudget(7, lambda: self.client.get(reverse('inbox'), {'q': 'printer'}))
+        self.assertQueryBudget(7, lambda: self.client.get(reverse('inbox'), {'q': 'printer', 'sort': 'relevance'}))
+    
+    def test_inbox_deep_page(self):
+        self.add_messages(30)
+        cursor = None
+        for page in range(2):
+            response = self.client.get(reverse('inbox'), {'cursor': cursor} if cursor else {})
+            cursor = response.context['page_obj'].next_cursor
+        self.assertQueryBudget(5, lambda: self.client.get(reverse('inbox'), {'cursor': cursor}))
+        
+        with override_settings(INBOX_PAGINATION='offset'):
+            self.assertQueryBudget(6, lambda: self.client.get(reverse('inbox'), {'page': 3}))
+    
+    def test_message_detail(self):
+        url = reverse('message_detail', args=[self.message.pk])
+        for i in range(20):
+            Reply.objects.create(message=self.message, admin=self.agents[i % 3], reply_body=f"Update {i}.")
+        self.assertQueryBudget(5, lambda: self.client.get(url))
+    
+    def test_contact(self):
+        self.client.logout()
+        self.assertQueryBudget(0, lambda: self.client.get(reverse('contact')))
+        for i in range(2):
+            self.add_messages(30)
+            cache.clear()
+            SystemSettings.invalidate_cache()
+            with self.assertNumQueries(13):
+                response = self.client.post(reverse('contact'), {
+                    **AsyncViewsTest.contact_data, 'subject': f'Need help {i}',
+                })
+            self.assertEqual(response.status_code, 302)
+    
+    def test_mark_as_read(self):
+        for message in (self.message, self.add_messages(30)[-1]):
+            Reply.objects.create(message=message, admin=self.agents[0], reply_body="More.")
+            Message.objects.filter(pk=message.pk).update(status='new')
+            cache.clear()
+            with self.assertNumQueries(9):
+                response = self.client.post(reverse('mark_as_read', args=[message.pk]))
+            self.assertEqual(response.status_code, 302)
+    
+    def test_admin_changelists(self):
+        budgets = {
+            'message': 7,
+            'reply': 7,
+            'archivedmessage': 7,
+            'outgoingemail': 6,
+            'storedblob': 5,
+            'systemsettings': 7,
+        }
+        for model, queries in budgets.items():
+            with self.subTest(model=model):
+                url = reverse(f'admin:helpdesk_app_{model}_changelist')
+                self.assertQueryBudget(queries, lambda: self.client.get(url))
+
+
+class QueryPlanTest(TestCase):
+    """
+    The main queries are answered from the indexes in Message.Meta
+    
+    Each check runs the real code path, then asks the database to EXPLAIN
+    what it ran; a changed query shape or a dropped index shows up as a
+    plan without the index. Runs against whatever DATABASE_URL points at.
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='agent', password='testpass')
+        for n in range(60):
+            Message.objects.create(
+                sender_name=f"Sender {n}", sender_email=f"sender{n}@example.com",
+                subject=f"Printer {n}", message_body=f"The printer on floor {n} is jammed.",
+                fingerprint=f"{n:064x}",
+            )
+        if connection.vendor == 'postgresql':
+            # A table this small would be read sequentially otherwise
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+        elif connection.vendor == 'mysql':
+            with connection.cursor() as cursor:
+                cursor.execute(f'ANALYZE TABLE {Message._meta.db_table}')
+        self.client.force_login(self.user)
+    
+    def index_name(self, *fields):
+        return next(index.name for index in Message._meta.indexes if index.fields == list(fields))
+    
+    def explain(self, sql):
+        options = {}
+        if connection.vendor == 'mysql' and not connection.mysql_is_mariadb:
+            # Plain EXPLAIN also lists the indexes it considered
+            options['format'] = 'TREE'
+        with connection.cursor() as cursor:
+            cursor.execute(f'{connection.ops.explain_query_prefix(**options)} {sql}')
+            return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+    
+    def assertUsesIndex(self, index_name, run):
+        """The queries run() makes on the message table use the named index"""
+        table = connection.ops.quote_name(Message._meta.db_table)
+        with CaptureQueriesContext(connection) as queries:
+            run()
+        plans = [
+            self.explain(query['sql']) for query in queries
+            if query['sql'].startswith('SELECT') and f'FROM {table}' in query['sql']
+        ]
+        self.assertTrue(plans, 'no query on the message table')
+        self.assertIn(index_name, '\n'.join(plans))
+    
+    def test_inbox(self):
+        self.assertUsesIndex(self.index_name('-timestamp'), lambda: self.client.get(reverse('inbox')))
+    
+    def test_inbox_deep_page(self):
+        cursor = self.client.get(reverse('inbox')).context['page_obj'].next_cursor
+        self.assertUsesIndex(
+            self.index_name('-timestamp'), lambda: self.client.get(reverse('inbox'), {'cursor': cursor}),
+        )
+    
+    def test_inbox_status_filter(self):
+        self.assertUsesIndex(
+            self.index_name('status'), lambda: self.client.get(reverse('inbox'), {'status': 'new'}),
+        )
+    
+    def test_inbox_activity_sort(self):
+        self.assertUsesIndex(
+            self.index_name('-last_activity_at'), lambda: self.client.get(reverse('inbox'), {'sort': 'activity'}),
+        )
+    
+    def test_duplicate_lookup(self):
+        self.assertUsesIndex(
+            self.index_name('fingerprint', '-timestamp'), lambda: dedup.merge_duplicate(f"{7:064x}"),
+        )
+    
+    def test_inbound_reply_matching(self):
+        email = {
+            'message_id': '<reply@example.com>', 'references': [],
+            'sender_email': 'sender7@example.com', 'subject': 'Re: Printer 7',
+        }
+        self.assertUsesIndex(self.index_name('sender_email'), lambda: inbound._existing_tickets([email]))
+    
+    def test_live_changes(self):
+        self.assertUsesIndex(self.index_name('updated_at'), lambda: live.changes_since(timezone.now()))
+    
+    def test_pending_previews(self):
+        if not connection.features.supports_partial_indexes:
+            self.skipTest('partial indexes are not created on this database')
+        self.assertUsesIndex('message_preview_pending_idx', lambda: previews.process_pending(executor=None))
+    
+    def test_fulltext_search(self):
+        if connection.vendor != 'mysql':
+            self.skipTest('FULLTEXT indexes are only created on MySQL')
+        run = lambda: list(MySQLFullTextBackend().filter(Message.objects.all(), 'printer jammed', rank=True))
+        self.assertUsesIndex('helpdesk_message_fulltext', run)
+        self.assertUsesIndex('helpdesk_reply_fulltext', run)
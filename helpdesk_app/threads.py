@@ -0,0 +1,65 @@
+"""
+Denormalized thread summary on Message
+
+reply_count, last_reply_at, last_responder and last_activity_at let the
+inbox show and sort by activity without joining and aggregating replies per
+row. A new reply updates the summary with one conditional UPDATE; deletes
+and bulk inserts recompute it from the replies table.
+"""
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import live
+
+SUMMARY_FIELDS = ['reply_count', 'last_reply_at', 'last_responder', 'last_activity_at']
+
+
+def reply_added(reply):
+    """Fold a newly created reply into its message's summary"""
+    from .models import Message
+
+    # Replies can be created out of order (e.g. imports); only a newer one moves "last"
+    newer = Q(last_reply_at__isnull=True) | Q(last_reply_at__lt=reply.timestamp)
+    Message.objects.filter(pk=reply.message_id).update(
+        reply_count=F('reply_count') + 1,
+        last_reply_at=Case(When(newer, then=Value(reply.timestamp)), default=F('last_reply_at')),
+        last_responder=Case(
+            When(newer, then=Value(reply.admin_id)),
+            default=F('last_responder'),
+            output_field=Message._meta.get_field('last_responder').target_field,
+        ),
+        last_activity_at=Case(
+            When(last_activity_at__lt=reply.timestamp, then=Value(reply.timestamp)),
+            default=F('last_activity_at'),
+        ),
+        updated_at=timezone.now(),
+    )
+    live.notify()
+    # Keep an in-memory parent current, so a later message.save() doesn't write stale values back
+    if type(reply).message.is_cached(reply):
+        reply.message.refresh_from_db(fields=SUMMARY_FIELDS)
+
+
+def refresh(queryset):
+    """
+    Recompute the summary of every message in a queryset from its replies
+
+    Returns:
+        Number of messages updated
+    """
+    from .models import Reply
+
+    replies = Reply.objects.filter(message=OuterRef('pk')).order_by()
+    latest = replies.order_by('-timestamp', '-id')
+    reply_count = replies.values('message').annotate(count=Count('id')).values('count')
+
+    updated = queryset.order_by().update(
+        reply_count=Coalesce(Subquery(reply_count[:1]), 0),
+        last_reply_at=Subquery(latest.values('timestamp')[:1]),
+        last_responder=Subquery(latest.values('admin')[:1]),
+        last_activity_at=Coalesce(Subquery(latest.values('timestamp')[:1]), F('timestamp')),
+        updated_at=timezone.now(),
+    )
+    live.notify()
+    return updated
@@ -9,8 +9,17 @@ urlpatterns = [
     
     # Admin pages
     path('inbox/', views.inbox_view, name='inbox'),
+    path('inbox/bulk/status/', views.bulk_update_status, name='bulk_update_status'),
+    path('inbox/bulk/reply/', views.bulk_reply, name='bulk_reply'),
+    path('inbox/export/', views.export_messages, name='export_messages'),
+    path('inbox/changes/', views.inbox_changes, name='inbox_changes'),
+    path('inbox/events/', views.inbox_events, name='inbox_events'),
     path('message/<int:message_id>/', views.message_detail_view, name='message_detail'),
     path('message/<int:message_id>/mark-read/', views.mark_as_read, name='mark_as_read'),
+    path('message/<int:message_id>/attachment/', views.attachment_download, name='attachment_download'),
+    path('message/<int:message_id>/attachment/preview/', views.attachment_preview, name='attachment_preview'),
+    path('reply/<int:reply_id>/attachment/', views.reply_attachment_download, name='reply_attachment_download'),
+    path('metrics/', views.metrics_view, name='metrics'),
     
     # Authentication
     path('login/', auth_views.LoginView.as_view(template_name='login.html'), name='login'),
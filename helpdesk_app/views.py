@@ -1,41 +1,104 @@
-from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth.decorators import login_required
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, render, redirect, get_object_or_404
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.views.decorators.http import require_POST, require_safe
+from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
 from django.core.paginator import Paginator
-from django.db.models import Q
-from django_ratelimit.decorators import ratelimit
-from .models import Message, Reply
+from django.db import transaction
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+from .models import ArchivedMessage, ArchivedReply, Message, Reply, message_fingerprint
 from .forms import MessageForm, ReplyForm
+from . import counters, dedup, exports, live, metrics, pagecache, previews, threads
+from .decorators import async_login_required, async_ratelimit
+from .downloads import serve_file
 from .email_service import EmailService
+from .pagination import KeysetPaginator
+from .search import filter_messages, get_search_backend
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Archived threads listed under an inbox search
+ARCHIVED_MATCHES_SHOWN = 20
 
-@ratelimit(key='ip', rate='5/h', method='POST')
-def contact_view(request):
+# Seconds browsers may reuse an attachment thumbnail
+PREVIEW_MAX_AGE = 24 * 60 * 60
+
+# Templates read the session, the user and the CSRF token lazily, any of which
+# may query the database, so async views render in a thread
+_arender = sync_to_async(render)
+
+
+def _queue_or_defer(emails):
+    """
+    Queue emails in the current transaction when the outbox is enabled
+    
+    Returns:
+        The emails still to be delivered once the transaction has committed
+    """
+    if settings.EMAIL_OUTBOX_ENABLED:
+        EmailService.send_batch(emails)
+        return []
+    return emails
+
+
+@sync_to_async
+def _create_message(form):
+    """
+    Save a contact submission and queue its notification emails atomically
+    
+    Returns:
+        (message, emails still to send); message is None when the submission
+        repeated a recent one and was merged into it, in which case no email
+        is sent
+    """
+    data = form.cleaned_data
+    fingerprint = message_fingerprint(data['sender_email'], data['subject'], data['message_body'])
+    with transaction.atomic():
+        duplicate_of = dedup.merge_duplicate(fingerprint)
+        if duplicate_of is not None:
+            logger.info("Duplicate contact submission merged into message %s", duplicate_of)
+            return None, []
+        message = form.save()
+        transaction.on_commit(lambda: dedup.remember(message))
+        emails = [
+            email for email in (
+                # Send auto-response to customer
+                EmailService.compose_auto_response(message.sender_email, message.sender_name),
+                # Notify admin
+                EmailService.compose_admin_notification(message),
+            )
+            if email is not None
+        ]
+        return message, _queue_or_defer(emails)
+
+
+@async_ratelimit(key='ip', rate='5/h', method='POST')
+async def contact_view(request):
     """Public contact form for customers to submit messages"""
     was_limited = getattr(request, 'limited', False)
     
     if was_limited:
         messages.error(request, 'Too many requests. Please try again later.')
-        return render(request, 'contact.html', {'form': MessageForm()})
+        return await _arender(request, 'contact.html', {'form': MessageForm()})
+    
+    # Anonymous visitors get the cached form with their own CSRF token
+    if pagecache.is_cacheable(request):
+        return await pagecache.aserve(request, 'contact.html', lambda: {'form': MessageForm()}, csrf=True)
     
     if request.method == 'POST':
         form = MessageForm(request.POST, request.FILES)
-        if form.is_valid():
+        if await sync_to_async(form.is_valid)():
             try:
-                # Save the message
-                message = form.save()
-                
-                # Send auto-response to customer
-                EmailService.send_auto_response(
-                    message.sender_email,
-                    message.sender_name
-                )
-                
-                # Notify admin
-                EmailService.send_admin_notification(message)
+                message, emails = await _create_message(form)
+                # Without the outbox, mail goes out after commit, off the event loop
+                await EmailService.asend_batch(emails)
                 
                 messages.success(
                     request,
@@ -44,7 +107,7 @@ def contact_view(request):
                 return redirect('contact')
                 
             except Exception as e:
-                logger.error(f"Error processing message: {str(e)}")
+                logger.error("Error processing message: %s", e)
                 messages.error(
                     request,
                     'An error occurred while sending your message. Please try again.'
@@ -54,76 +117,187 @@ def contact_view(request):
     else:
         form = MessageForm()
     
-    return render(request, 'contact.html', {'form': form})
+    return await _arender(request, 'contact.html', {'form': form})
 
 
-@login_required
-def inbox_view(request):
+def _archived_matches(search_query, status_filter):
+    """Archived threads matching an inbox search, newest first"""
+    queryset = filter_messages(
+        ArchivedMessage.objects.select_related('last_responder').defer('body', 'body_compressed'),
+        search_query, status_filter,
+    )
+    return list(queryset.order_by('-timestamp', '-id')[:ARCHIVED_MATCHES_SHOWN])
+
+
+@async_login_required
+async def inbox_view(request):
     """Admin inbox view showing all messages"""
     # Get search and filter parameters
     search_query = request.GET.get('q', '')
     status_filter = request.GET.get('status', '')
+    sort = request.GET.get('sort', '')
     
-    # Base queryset
-    messages_list = Message.objects.all()
+    # Live updates pick up whatever changes after this
+    live_cursor = timezone.now()
     
-    # Apply search
-    if search_query:
-        messages_list = messages_list.filter(
-            Q(sender_name__icontains=search_query) |
-            Q(sender_email__icontains=search_query) |
-            Q(subject__icontains=search_query) |
-            Q(message_body__icontains=search_query)
+    # Base queryset; rows show the stored preview, so the full body stays unloaded
+    messages_list = Message.objects.select_related('last_responder').defer('message_body')
+    
+    # Apply search and status filter; search backends may query the database here
+    messages_list = await sync_to_async(filter_messages)(
+        messages_list, search_query, status_filter, rank=(sort == 'relevance')
+    )
+    
+    # Most recently active threads first
+    order_field = 'last_activity_at' if sort == 'activity' else 'timestamp'
+    if sort == 'activity':
+        messages_list = messages_list.order_by('-last_activity_at', '-id')
+    
+    # Pagination; relevance ordering has no (field, id) key to seek on
+    cursor_pagination = settings.INBOX_PAGINATION == 'keyset' and sort != 'relevance'
+    if cursor_pagination:
+        page_obj = await KeysetPaginator(messages_list, 20, field=order_field).aget_page(
+            request.GET.get('cursor')
         )
+    else:
+        paginator = Paginator(messages_list, 20)
+        page_number = request.GET.get('page')
+        page_obj = await sync_to_async(paginator.get_page)(page_number)
+    
+    # Badge counts come from the materialized counters; only search needs a COUNT
+    counts = await sync_to_async(counters.get_counts)()
+    if search_query:
+        total_messages = await messages_list.acount() if cursor_pagination else page_obj.paginator.count
+    elif status_filter:
+        total_messages = counts.get(status_filter, 0)
+    else:
+        total_messages = counts['total']
     
-    # Apply status filter
-    if status_filter:
-        messages_list = messages_list.filter(status=status_filter)
+    # Search also reaches threads moved to the archive
+    archived_matches = []
+    if search_query:
+        archived_matches = await sync_to_async(_archived_matches)(search_query, status_filter)
     
-    # Pagination
-    paginator = Paginator(messages_list, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Current filters, for building pagination links
+    filter_params = request.GET.copy()
+    filter_params.pop('page', None)
+    filter_params.pop('cursor', None)
+    export_params = filter_params.copy()
+    export_params.pop('sort', None)
     
     context = {
         'page_obj': page_obj,
+        'archived_matches': archived_matches,
+        'cursor_pagination': cursor_pagination,
+        'filter_query': filter_params.urlencode(),
+        'export_query': export_params.urlencode(),
         'search_query': search_query,
         'status_filter': status_filter,
-        'total_messages': messages_list.count(),
-        'new_messages': Message.objects.filter(status='new').count(),
+        'sort': sort,
+        'total_messages': total_messages,
+        'new_messages': counts['new'],
+        'live': {
+            'events_url': reverse('inbox_events'),
+            'changes_url': reverse('inbox_changes'),
+            'cursor': live_cursor.isoformat(),
+            'poll_seconds': live.FALLBACK_POLL_SECONDS,
+            # New messages are added on the first page of the newest-first list
+            'insert': not search_query and not sort and not page_obj.has_previous(),
+            'status': status_filter,
+        },
     }
     
-    return render(request, 'inbox.html', context)
+    return await _arender(request, 'inbox.html', context)
 
 
-@login_required
-def message_detail_view(request, message_id):
+def _inbox_changes(cursor):
+    """Counters and re-rendered rows of the messages changed after a cursor"""
+    changed, cursor, truncated = live.changes_since(cursor)
+    return {
+        'cursor': cursor.isoformat(),
+        'counts': counters.get_counts(),
+        'truncated': truncated,
+        'messages': [
+            {
+                'id': message.pk,
+                'status': message.status,
+                'timestamp': message.timestamp.isoformat(),
+                'html': render_to_string('inbox_row.html', {'message': message}),
+            }
+            for message in changed
+        ],
+    }
+
+
+@async_login_required
+@require_safe
+async def inbox_changes(request):
+    """Inbox changes after the `since` cursor, as JSON"""
+    cursor = live.parse_cursor(request.GET.get('since'))
+    if cursor is None:
+        return HttpResponseBadRequest('Invalid cursor.')
+    return JsonResponse(await sync_to_async(_inbox_changes)(cursor))
+
+
+@async_login_required
+@require_safe
+async def inbox_events(request):
+    """Server-sent event stream of inbox changes"""
+    # Under WSGI a stream would hold a worker thread; the page polls inbox_changes instead
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    
+    # Browsers resume a dropped stream from the last event id
+    cursor = (
+        live.parse_cursor(request.headers.get('Last-Event-ID'))
+        or live.parse_cursor(request.GET.get('since'))
+        or timezone.now()
+    )
+    response = StreamingHttpResponse(live.event_stream(cursor, _inbox_changes), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx-style proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@sync_to_async
+def _save_reply(message, form, user):
+    """Save an admin reply, mark the message replied and queue the customer email"""
+    with transaction.atomic():
+        # Save the reply
+        reply = form.save(commit=False)
+        reply.message = message
+        reply.admin = user
+        reply.save()
+        
+        # Update message status
+        message.status = 'replied'
+        message.save()
+        
+        return _queue_or_defer([EmailService.compose_reply(message, reply)])
+
+
+@async_login_required
+async def message_detail_view(request, message_id):
     """View and reply to a specific message"""
-    message = get_object_or_404(Message, id=message_id)
-    replies = message.replies.all()
+    message = await Message.objects.filter(id=message_id).afirst()
+    if message is None:
+        return await _archived_detail_view(request, message_id)
     
     if request.method == 'POST':
         form = ReplyForm(request.POST)
-        if form.is_valid():
+        if await sync_to_async(form.is_valid)():
             try:
-                # Save the reply
-                reply = form.save(commit=False)
-                reply.message = message
-                reply.admin = request.user
-                reply.save()
-                
-                # Update message status
-                message.status = 'replied'
-                message.save()
+                emails = await _save_reply(message, form, await request.auser())
                 
                 # Send reply to customer
-                EmailService.send_reply_to_customer(message, reply)
+                await EmailService.asend_batch(emails)
                 
                 messages.success(request, 'Reply sent successfully!')
                 return redirect('message_detail', message_id=message.id)
                 
             except Exception as e:
-                logger.error(f"Error sending reply: {str(e)}")
+                logger.error("Error sending reply: %s", e)
                 messages.error(request, 'Error sending reply. Please try again.')
         else:
             messages.error(request, 'Please correct the errors below.')
@@ -132,11 +306,28 @@ def message_detail_view(request, message_id):
     
     context = {
         'message': message,
-        'replies': replies,
+        'replies': [reply async for reply in message.replies.select_related('admin')],
         'form': form,
+        'preview': await sync_to_async(previews.describe)(message),
+    }
+    
+    return await _arender(request, 'message_detail.html', context)
+
+
+async def _archived_detail_view(request, message_id):
+    """Read-only view of an archived thread, reached by its original message id"""
+    message = await aget_object_or_404(ArchivedMessage, id=message_id)
+    if request.method == 'POST':
+        messages.error(request, 'This conversation is archived and can no longer be replied to.')
+    
+    context = {
+        'message': message,
+        'replies': [reply async for reply in message.replies.select_related('admin')],
+        'archived': True,
+        'preview': await sync_to_async(previews.describe)(message),
     }
     
-    return render(request, 'message_detail.html', context)
+    return await _arender(request, 'message_detail.html', context)
 
 
 @login_required
@@ -151,6 +342,157 @@ def mark_as_read(request, message_id):
     return redirect('inbox')
 
 
+def _selected_message_ids(request):
+    """Message ids ticked in the inbox bulk-action form"""
+    return [int(pk) for pk in request.POST.getlist('message_ids') if pk.isdigit()]
+
+
+@login_required
+@require_POST
+def bulk_update_status(request):
+    """Change the status of all selected messages with a single UPDATE"""
+    message_ids = _selected_message_ids(request)
+    status = request.POST.get('status', '')
+    
+    if not message_ids:
+        messages.error(request, 'Select at least one message.')
+    elif status not in dict(Message.STATUS_CHOICES):
+        messages.error(request, 'Invalid status.')
+    else:
+        updated = Message.objects.filter(id__in=message_ids).set_status(status)
+        messages.success(request, f'{updated} message(s) marked as {status}.')
+    
+    return redirect('inbox')
+
+
+@login_required
+@require_POST
+def bulk_reply(request):
+    """Send the same reply to all selected messages"""
+    message_ids = _selected_message_ids(request)
+    form = ReplyForm(request.POST)
+    
+    if not message_ids:
+        messages.error(request, 'Select at least one message.')
+    elif not form.is_valid():
+        messages.error(request, ' '.join(form.errors.get('reply_body', ['Invalid reply.'])))
+    else:
+        try:
+            with transaction.atomic():
+                selected = list(Message.objects.filter(id__in=message_ids))
+                replies = Reply.objects.bulk_create([
+                    Reply(message=message, admin=request.user, reply_body=form.cleaned_data['reply_body'])
+                    for message in selected
+                ])
+                Message.objects.filter(id__in=message_ids).set_status('replied')
+                
+                # bulk_create skips the signals that keep the search index
+                # and the thread summary current; one reply query for all
+                get_search_backend().index_messages(
+                    Message.objects.filter(id__in=message_ids).prefetch_related('replies')
+                )
+                threads.refresh(Message.objects.filter(id__in=message_ids))
+                
+                # One batch for all customer emails; without the outbox they
+                # go out once the replies are committed, not while rows are locked
+                emails = _queue_or_defer([
+                    EmailService.compose_reply(message, reply)
+                    for message, reply in zip(selected, replies)
+                ])
+                if emails:
+                    transaction.on_commit(lambda: _send_bulk_replies(request, emails))
+            
+            messages.success(request, f'Reply sent to {len(replies)} message(s).')
+        except Exception as e:
+            logger.error("Error sending bulk reply: %s", e)
+            messages.error(request, 'Error sending replies. Please try again.')
+    
+    return redirect('inbox')
+
+
+def _send_bulk_replies(request, emails):
+    failed = len(emails) - EmailService.send_batch(emails)
+    if failed:
+        messages.warning(request, f'{failed} reply email(s) could not be sent.')
+
+
+@user_passes_test(lambda user: user.is_active and user.is_staff)
+@require_safe
+def export_messages(request):
+    """Stream the inbox, with its search and status filters, as CSV or JSON Lines"""
+    output_format = request.GET.get('format', 'csv')
+    if output_format not in exports.CONTENT_TYPES:
+        return HttpResponseBadRequest('Unsupported export format.')
+    compress = request.GET.get('gzip') == '1'
+    
+    queryset = filter_messages(Message.objects.all(), request.GET.get('q', ''), request.GET.get('status', ''))
+    stream = exports.export_stream(queryset, output_format, compress)
+    if isinstance(request, ASGIRequest):
+        stream = exports.aiter_stream(stream)
+    
+    filename = f"messages-{timezone.now():%Y%m%d-%H%M%S}.{output_format}{'.gz' if compress else ''}"
+    response = StreamingHttpResponse(
+        stream,
+        content_type='application/gzip' if compress else f'{exports.CONTENT_TYPES[output_format]}; charset=utf-8',
+    )
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
+
+
+@login_required
+@require_safe
+def attachment_download(request, message_id):
+    """Stream a message attachment (supports Range and conditional requests)"""
+    message = (
+        Message.objects.only('id', 'attachment', 'attachment_name').filter(id=message_id).first()
+        or get_object_or_404(ArchivedMessage.objects.only('id', 'attachment', 'attachment_name'), id=message_id)
+    )
+    if not message.attachment:
+        raise Http404('Message has no attachment')
+    
+    return serve_file(request, message.attachment.storage, message.attachment.name, message.attachment_name)
+
+
+@login_required
+@require_safe
+def attachment_preview(request, message_id):
+    """Serve the rendered thumbnail of a message's image attachment"""
+    message = (
+        Message.objects.only('id', 'attachment', 'preview_status').filter(id=message_id).first()
+        or get_object_or_404(ArchivedMessage.objects.only('id', 'attachment', 'preview_status'), id=message_id)
+    )
+    if message.preview_status != 'ready' or previews.preview_kind(message.attachment.name) != 'image':
+        raise Http404('Attachment has no thumbnail')
+    
+    response = serve_file(request, message.attachment.storage, previews.preview_name(message.attachment.name))
+    # Unlike the attachment itself, a thumbnail never changes under its name
+    response['Cache-Control'] = f'private, max-age={PREVIEW_MAX_AGE}'
+    return response
+
+
+@login_required
+@require_safe
+def reply_attachment_download(request, reply_id):
+    """Stream the attachment of an emailed customer reply"""
+    reply = (
+        Reply.objects.only('id', 'attachment', 'attachment_name').filter(id=reply_id).first()
+        or get_object_or_404(ArchivedReply.objects.only('id', 'attachment', 'attachment_name'), id=reply_id)
+    )
+    if not reply.attachment:
+        raise Http404('Reply has no attachment')
+    
+    return serve_file(request, reply.attachment.storage, reply.attachment.name, reply.attachment_name)
+
+
+@user_passes_test(lambda user: user.is_active and user.is_staff)
+@require_safe
+def metrics_view(request):
+    """Request histograms of this worker process, in the Prometheus text format"""
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 def home_view(request):
     """Homepage view"""
+    if pagecache.is_cacheable(request):
+        return pagecache.serve(request, 'home.html')
     return render(request, 'home.html')